@@ -1,9 +1,55 @@
 #!/usr/bin/env python
 # A module that fetches a resource pointed to by a URL and then writes it to disk.
+# The response is streamed to a temporary file next to the destination, which then replaces it atomically.
+# The ETag and Last-Modified of the response are kept in a sidecar file, and sent back as If-None-Match and
+# If-Modified-Since by the next run, so an unchanged resource isn't transferred again.
+# With "urls", many resources are fetched at the same time over keep-alive connections, and large resources
+# are fetched as parallel Range requests when the server supports them. URLs with credentials, in the URL or in
+# the netrc file, and URLs behind a proxy are fetched with open_url, one request at a time.
+# With "cache_dir", the resources are kept in a local cache addressed by their content, and the destinations
+# are linked to it, so a resource already fetched by an earlier run or for another destination isn't fetched again.
 
+import contextlib
+import fcntl
+import hashlib
+import json
+import netrc
+import os
+import re
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.urls import open_url
-from urllib2 import URLError
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.six.moves.urllib.error import HTTPError, URLError
+from ansible.module_utils.six.moves.urllib.parse import urljoin, urlparse
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+
+# bytes read from the response and written to the temporary file at a time
+CHUNK_SIZE = 64 * 1024
+# suffix of the sidecar file with the ETag and Last-Modified of the destination
+VALIDATORS_SUFFIX = ".validators.json"
+# resources larger than this are fetched as parallel Range requests of this size
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+# resources, and segments of a resource, fetched at the same time
+DEFAULT_PARALLELISM = 4
+# seconds to connect and to wait for data
+TIMEOUT = 10
+MAX_REDIRECTS = 5
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+# bytes the cache is held under, the least recently used resources are evicted first
+DEFAULT_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+# algorithm of the content address of the resources without a declared checksum
+CACHE_ALGORITHM = "sha256"
+DECLARED_CHECKSUM = re.compile(r"^(\w+):([0-9a-fA-F]+)$")
+# ioctl cloning a file on copy-on-write file systems (btrfs, XFS), see ioctl_ficlone(2)
+FICLONE = 0x40049409
 
 class FetchError(Exception):
     pass
@@ -11,34 +57,614 @@ class FetchError(Exception):
 class WriteError(Exception):
     pass
 
+class RangesNotSupported(Exception):
+    """
+    Raised when a segment isn't answered with the requested range, e.g. the resource changed in the meantime.
+    """
+    pass
+
+class Cache(object):
+    """
+    Local cache of the resources, addressed by the checksum of their content: objects/<algorithm>/<digest>.
+    index.json keeps the size, modification time and last use of every object, and the object and validators
+    of every URL. It is only read and written under a lock, shared by the tasks running on the host.
+    """
+    def __init__(self, path, size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.size = size
+        self.used = set()
+        for directory in ("objects", "tmp"):
+            if not os.path.isdir(os.path.join(path, directory)):
+                os.makedirs(os.path.join(path, directory))
+
+    @contextlib.contextmanager
+    def index(self):
+        """
+        Locks the index and yields it, and saves it when the block completes.
+        """
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(os.path.join(self.path, "index.json")) as source:
+                    index = json.load(source)
+            except (IOError, OSError, ValueError):
+                index = {}
+            index.setdefault("objects", {})
+            index.setdefault("urls", {})
+            yield index
+            fd, temp_index = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "w") as output:
+                json.dump(index, output)
+            os.rename(temp_index, os.path.join(self.path, "index.json"))
+
+    def object_path(self, name):
+        return os.path.join(self.path, "objects", name)
+
+    def valid(self, index, name):
+        """
+        Tells if an object is in the cache, unchanged since it was added. The content of an object whose size
+        or modification time changed is checked against its name, and the object is removed if it changed through
+        a hardlinked destination.
+        """
+        entry = index["objects"].get(name)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(self.object_path(name))
+            if (stat.st_size, stat.st_mtime) == (entry["size"], entry["mtime"]):
+                return True
+            algorithm, digest = name.split("/")
+            if stat.st_size == entry["size"] and checksum(self.object_path(name), algorithm) == digest:
+                # only the attributes changed, e.g. by atomic_move through a hardlinked destination
+                entry["mtime"] = stat.st_mtime
+                return True
+            os.remove(self.object_path(name))
+        except (IOError, OSError):
+            pass
+        del index["objects"][name]
+        return False
+
+    def fetch(self, url, dest, checksum, connections, segment_size=0, segments=None):
+        """
+        Fetches a resource through the cache: not at all if its declared checksum is cached, conditionally with
+        the validators of the cached object of its URL otherwise.
+        Returns the temporary file linked to the object to move over dest, or None if dest already is the object,
+        and the response headers, None if no response was received.
+        """
+        algorithm, expected = parse_checksum(checksum)
+        with self.index() as index:
+            name = "{0}/{1}".format(algorithm, expected) if expected else None
+            if name is not None and not self.valid(index, name):
+                name = None
+            entry = index["urls"].get(url)
+            cached, validators = None, {}
+            if name is None and entry is not None and self.valid(index, entry["object"]) and \
+                    (expected is None or entry["object"] == "{0}/{1}".format(algorithm, expected)):
+                cached = entry["object"]
+                validators = dict(etag=entry.get("etag"), last_modified=entry.get("last_modified"))
+
+        headers = None
+        if name is None:
+            temp_path, headers = download(url, os.path.join(self.path, "tmp", hashlib.sha1(url.encode("utf-8"))
+                                                            .hexdigest()),
+                                          connections, segment_size=segment_size, segments=segments,
+                                          validators=validators)
+            if temp_path is None:
+                name = cached
+            else:
+                name = self.add(temp_path, url, headers, algorithm, expected)
+
+        with self.index() as index:
+            if name not in index["objects"]:
+                raise FetchError("Data could not be fetched: {0} was evicted from the cache.".format(name))
+            index["objects"][name]["last_used"] = time.time()
+            self.used.add(name)
+        return self.link(name, dest), headers
+
+    def add(self, temp_path, url, headers, algorithm, expected=None):
+        """
+        Verifies a completed download against its declared checksum and adds it to the cache.
+        :return: name of the object.
+        """
+        digest = checksum(temp_path, algorithm)
+        if expected is not None and digest != expected:
+            os.remove(temp_path)
+            raise FetchError("Data could not be fetched: the {0} checksum is {1} instead of {2}.".format(
+                algorithm, digest, expected))
+        name = "{0}/{1}".format(algorithm, digest)
+        with self.index() as index:
+            if self.valid(index, name):
+                # the same content was fetched from another URL
+                os.remove(temp_path)
+            else:
+                if not os.path.isdir(os.path.dirname(self.object_path(name))):
+                    os.makedirs(os.path.dirname(self.object_path(name)))
+                os.rename(temp_path, self.object_path(name))
+                stat = os.stat(self.object_path(name))
+                index["objects"][name] = dict(size=stat.st_size, mtime=stat.st_mtime, last_used=time.time())
+            index["urls"][url] = dict(object=name, etag=headers.get("ETag"),
+                                      last_modified=headers.get("Last-Modified"))
+        return name
+
+    def link(self, name, dest):
+        """
+        Makes a temporary file next to dest with the content of the object: a reflink if the file system
+        supports it, otherwise a hardlink, and a copy if dest is on another file system.
+        An existing dest is replaced by a copy rather than a hardlink, atomic_move gives the temporary file the
+        owner, mode and times of the dest it replaces, which would change the object itself.
+        :return: the temporary file, or None if dest already has the content of the object.
+        """
+        source = self.object_path(name)
+        if os.path.isfile(dest) and (os.path.samefile(source, dest) or (
+                os.path.getsize(source) == os.path.getsize(dest) and
+                checksum(dest, name.split("/")[0]) == name.split("/")[1])):
+            return None
+        fd, temp_dest = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)),
+                                         prefix="." + os.path.basename(dest) + ".")
+        try:
+            try:
+                if not sys.platform.startswith("linux"):
+                    raise OSError("reflinks are only supported on Linux")
+                with open(source, "rb") as source_file:
+                    fcntl.ioctl(fd, FICLONE, source_file.fileno())
+                os.close(fd)
+            except (IOError, OSError):
+                os.close(fd)
+                os.remove(temp_dest)
+                try:
+                    if os.path.lexists(dest):
+                        raise OSError("dest is replaced by a copy")
+                    os.link(source, temp_dest)
+                except OSError:
+                    shutil.copyfile(source, temp_dest)
+        except (IOError, OSError):
+            if os.path.exists(temp_dest):
+                os.remove(temp_dest)
+            raise WriteError("Data could not be written.")
+        return temp_dest
+
+    def evict(self):
+        """
+        Removes the least recently used objects not used by this run until the cache is under its size.
+        """
+        with self.index() as index:
+            for name in list(index["objects"]):
+                self.valid(index, name)
+            total = sum(entry["size"] for entry in index["objects"].values())
+            for name, entry in sorted(index["objects"].items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.size:
+                    break
+                if name in self.used:
+                    continue
+                try:
+                    os.remove(self.object_path(name))
+                except OSError:
+                    pass
+                del index["objects"][name]
+                total -= entry["size"]
+            for url, entry in list(index["urls"].items()):
+                if entry["object"] not in index["objects"]:
+                    del index["urls"][url]
+
+class Response(object):
+    """
+    Response of a keep-alive connection with the interface of the responses of open_url, info() and getcode(),
+    which the responses of httplib don't have on Python 2.
+    """
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, size=None):
+        return self._response.read() if size is None else self._response.read(size)
+
+    def info(self):
+        return self._response.msg
+
+    def getcode(self):
+        return self._response.status
+
+class Connections(object):
+    """
+    Keep-alive HTTP connections, one per host and thread, reused by all the requests of the thread.
+    """
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        try:
+            self._netrc = netrc.netrc(os.environ.get("NETRC"))
+        except (IOError, OSError, netrc.NetrcParseError):
+            self._netrc = None
+
+    def handles(self, url):
+        """
+        Tells if the URL is fetched over the keep-alive connections. URLs going through a proxy, and URLs with
+        credentials, in the URL itself or in the netrc file, are left to open_url, which supports them.
+        """
+        parts = urlparse(url)
+        if parts.username is not None:
+            return False
+        if parts.scheme in getproxies() and not proxy_bypass(parts.hostname or ""):
+            return False
+        return self._netrc is None or self._netrc.authenticators(parts.hostname or "") is None
+
+    def request(self, url, headers=None, redirects=MAX_REDIRECTS):
+        """
+        Sends a GET request on the connection of the thread to the host, and follows redirects.
+        Returns the response as a Response, raises HTTPError like open_url for the other statuses.
+        The response must be read to the end before the thread sends its next request.
+        """
+        parts = urlparse(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        key = (parts.scheme, parts.netloc)
+        connections = self._local.__dict__.setdefault("connections", {})
+        for attempt in range(2):
+            connection = connections.get(key)
+            if connection is None:
+                connection = connections[key] = self._connect(parts)
+            try:
+                connection.request("GET", path, headers=headers or {})
+                response = connection.getresponse()
+                break
+            except (http_client.HTTPException, socket.error) as e:
+                # the server closed an idle keep-alive connection, the request is sent again on a new one
+                connection.close()
+                del connections[key]
+                if attempt:
+                    raise URLError(e)
+
+        if response.status in (301, 302, 303, 307, 308) and redirects:
+            response.read()
+            return self.request(urljoin(url, response.getheader("Location")), headers, redirects - 1)
+        if response.status >= 300:
+            response.read()
+            raise HTTPError(url, response.status, response.reason, response.msg, None)
+        return Response(response)
+
+    def _connect(self, parts):
+        if parts.scheme == "https":
+            connection = http_client.HTTPSConnection(parts.netloc, timeout=self.timeout,
+                                                     context=ssl.create_default_context())
+        elif parts.scheme == "http":
+            connection = http_client.HTTPConnection(parts.netloc, timeout=self.timeout)
+        else:
+            raise URLError("unsupported scheme: {0}".format(parts.scheme))
+        with self._lock:
+            self._all.append(connection)
+        return connection
+
+    def close(self):
+        with self._lock:
+            for connection in self._all:
+                connection.close()
+            self._all = []
+
 def save_data(mod):
-    data = fetch(mod.params["url"])
-    write(data, mod.params["dest"])
-    mod.exit_json(msg="Data saved", changed=True)
+    params = mod.params
+    parallelism = max(params["parallelism"], 1)
+    if params["urls"]:
+        if not os.path.isdir(params["dest"]):
+            mod.fail_json(msg="dest must be a directory to save urls into.")
+            return
+        resources = [resource(entry, params["dest"]) for entry in params["urls"]]
+    else:
+        resources = [(params["url"], params["dest"], params["checksum"])]
+    try:
+        for url, dest, declared in resources:
+            parse_checksum(declared)
+    except ValueError as e:
+        mod.fail_json(msg=str(e))
+        return
+
+    cache = Cache(params["cache_dir"], params["cache_size"]) if params["cache_dir"] else None
+    connections = Connections()
+    # segments get their own threads, a resource waiting for its segments never holds them up
+    segments = ThreadPool(parallelism) if params["segment_size"] > 0 else None
+    pool = ThreadPool(min(parallelism, len(resources)))
 
-def fetch(url):
+    def _download(url_dest_and_checksum):
+        url, dest, declared = url_dest_and_checksum
+        try:
+            if cache is not None:
+                return cache.fetch(url, dest, declared, connections, segment_size=params["segment_size"],
+                                   segments=segments) + (None,)
+            temp_dest, headers = download(url, dest, connections, segment_size=params["segment_size"],
+                                          segments=segments)
+            algorithm, expected = parse_checksum(declared)
+            if temp_dest is not None and expected is not None and checksum(temp_dest, algorithm) != expected:
+                os.remove(temp_dest)
+                raise FetchError("Data could not be fetched: the {0} checksum doesn't match.".format(algorithm))
+            return temp_dest, headers, None
+        except (FetchError, WriteError) as e:
+            return None, None, e
+
+    try:
+        downloads = pool.map(_download, resources)
+    finally:
+        pool.close()
+        if segments is not None:
+            segments.close()
+        connections.close()
+    if cache is not None:
+        cache.evict()
+
+    results = []
+    for (url, dest, declared), (temp_dest, headers, error) in zip(resources, downloads):
+        if error is not None:
+            if not params["urls"]:
+                raise error
+            results.append(dict(url=url, dest=dest, failed=True, changed=False, msg=str(error)))
+            continue
+        if temp_dest is not None:
+            mod.atomic_move(temp_dest, dest)
+        if headers is not None:
+            write_validators(url, dest, headers)
+        results.append(dict(url=url, dest=dest, changed=temp_dest is not None,
+                            msg="Data saved" if temp_dest is not None else "Data not modified"))
+
+    if not params["urls"]:
+        mod.exit_json(msg=results[0]["msg"], changed=results[0]["changed"])
+        return
+    failed = [result for result in results if result.get("failed")]
+    if failed:
+        mod.fail_json(msg="{0} of {1} resources could not be saved.".format(len(failed), len(results)),
+                      changed=any(result["changed"] for result in results), results=results)
+        return
+    mod.exit_json(msg="{0} resources saved, {1} not modified.".format(
+                      len([result for result in results if result["changed"]]),
+                      len([result for result in results if not result["changed"]])),
+                  changed=any(result["changed"] for result in results), results=results)
+
+def resource(entry, dest_dir):
+    """
+    Returns the URL, destination and declared checksum of an entry of urls: a URL saved under its file name,
+    or a dict with url and optionally dest, relative to dest_dir, and checksum.
+    """
+    if isinstance(entry, dict):
+        return entry["url"], os.path.join(dest_dir, entry.get("dest") or
+                                          os.path.basename(urlparse(entry["url"]).path)), entry.get("checksum")
+    return entry, os.path.join(dest_dir, os.path.basename(urlparse(entry).path)), None
+
+def parse_checksum(declared):
+    """
+    Returns the algorithm and the lowercase digest of a declared checksum, e.g. "sha256:9f86d08...",
+    or CACHE_ALGORITHM and None if none is declared.
+    """
+    if not declared:
+        return CACHE_ALGORITHM, None
+    match = DECLARED_CHECKSUM.match(declared)
+    if match is None or match.group(1).lower() not in hashlib.algorithms_available:
+        raise ValueError("checksum must be <algorithm>:<hex digest>, e.g. sha256:9f86d08..., got {0}".format(
+            declared))
+    return match.group(1).lower(), match.group(2).lower()
+
+def download(url, dest, connections, segment_size=0, segments=None, validators=None):
+    """
+    Fetches a resource to a temporary file next to dest.
+    Returns the temporary file to move over dest and the response headers. The temporary file is None if the
+    resource isn't modified, and the headers are None if the server answered 304 Not Modified.
+    The validators are the ones saved along with dest, unless given.
+    """
+    if validators is None:
+        validators = read_validators(url, dest)
+    stream = fetch(url, connections=connections, segment_size=segment_size, **validators)
+    if stream is None:
+        return None, None
+    headers = stream.info()
+    if stream.getcode() != 206:
+        return write(stream, dest), headers
+    content_range = CONTENT_RANGE.match(headers.get("Content-Range") or "")
+    start, end, size = [int(group) for group in content_range.groups()] if content_range else (None, None, None)
+    if start != 0 or (size <= segment_size and end != size - 1):
+        # a range of unknown total length, or not the one asked for, is fetched again as a whole
+        try:
+            for _ in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                pass
+        except (http_client.HTTPException, socket.error):
+            raise FetchError("Data could not be fetched.")
+        stream = fetch(url, connections=connections)
+        return write(stream, dest), stream.info()
+    if size <= segment_size:
+        return write(stream, dest), headers
+    # the first segment is already on its way, the others are requested in parallel
+    validator = headers.get("ETag") if not (headers.get("ETag") or "W/").startswith("W/") \
+        else headers.get("Last-Modified")
+    try:
+        return write_segments(stream, connections, url, dest, size, segment_size,
+                              segments, validator), headers
+    except RangesNotSupported:
+        stream = fetch(url, connections=connections)
+        return write(stream, dest), stream.info()
+
+def fetch(url, etag=None, last_modified=None, connections=None, segment_size=0):
+    """
+    Opens the resource, conditionally if the validators of the saved copy are given.
+    With connections, the request reuses a keep-alive connection and asks for the first segment only.
+    Returns the response stream, or None if the server answers 304 Not Modified.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        if connections is None or not connections.handles(url):
+            return open_url(url, headers=headers)
+        if segment_size > 0:
+            try:
+                return connections.request(url, headers=dict(headers, Range="bytes=0-{0}".format(segment_size - 1)))
+            except HTTPError as e:
+                # 416 for an empty resource
+                if e.code != 416:
+                    raise
+        return connections.request(url, headers=headers)
+    except HTTPError as e:
+        if e.code == 304:
+            return None
+        raise FetchError("Data could not be fetched.")
+    except (URLError, http_client.HTTPException, socket.error):
+        raise FetchError("Data could not be fetched.")
+
+def write(stream, dest):
+    """
+    Streams the response to a temporary file in the directory of dest, CHUNK_SIZE bytes at a time.
+    Returns the temporary file to move over dest, or None if dest already has the same content.
+    """
+    digest = hashlib.sha1()
+    temp_dest = None
     try:
-        stream = open_url(url)
-        return stream.read()
-    except URLError:
+        fd, temp_dest = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)),
+                                         prefix="." + os.path.basename(dest) + ".")
+        with os.fdopen(fd, "wb") as output:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                output.write(chunk)
+        if os.path.isfile(dest) and checksum(dest) == digest.hexdigest():
+            os.remove(temp_dest)
+            return None
+        return temp_dest
+    except (IOError, OSError):
+        if temp_dest is not None and os.path.exists(temp_dest):
+            os.remove(temp_dest)
+        raise WriteError("Data could not be written.")
+    except (http_client.HTTPException, socket.error):
+        if temp_dest is not None and os.path.exists(temp_dest):
+            os.remove(temp_dest)
         raise FetchError("Data could not be fetched.")
 
-def write(data, dest):
+def write_segments(first, connections, url, dest, size, segment_size, segments, validator=None):
+    """
+    Writes a resource into a preallocated temporary file next to dest: the first segment from the response
+    already received, the other ones from Range requests sent in parallel on the segments pool.
+    If-Range makes the server answer a resource changed since the first segment with all of it, and then
+    RangesNotSupported is raised.
+    Returns the temporary file to move over dest, or None if dest already has the same content.
+    """
+    fd, temp_dest = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)),
+                                     prefix="." + os.path.basename(dest) + ".")
+    ranges = [(start, min(start + segment_size, size) - 1) for start in range(segment_size, size, segment_size)]
+
+    def _segment(byte_range):
+        headers = {"Range": "bytes={0}-{1}".format(*byte_range)}
+        if validator:
+            headers["If-Range"] = validator
+        response = connections.request(url, headers=headers)
+        content_range = CONTENT_RANGE.match(response.info().get("Content-Range") or "")
+        if response.getcode() != 206 or content_range is None or int(content_range.group(1)) != byte_range[0]:
+            response.read()
+            raise RangesNotSupported()
+        write_range(fd, response, byte_range[0], byte_range[1] - byte_range[0] + 1)
+
     try:
-        with open(dest, "w") as dest:
-            dest.write(data)
-    except IOError:
+        try:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, size)
+            else:
+                os.ftruncate(fd, size)
+            write_range(fd, first, 0, segment_size)
+            if segments is not None:
+                segments.map(_segment, ranges)
+            else:
+                for byte_range in ranges:
+                    _segment(byte_range)
+        finally:
+            os.close(fd)
+        if os.path.isfile(dest) and os.path.getsize(dest) == size and checksum(dest) == checksum(temp_dest):
+            os.remove(temp_dest)
+            return None
+        return temp_dest
+    except (IOError, OSError):
+        os.remove(temp_dest)
         raise WriteError("Data could not be written.")
+    except (RangesNotSupported, FetchError, URLError, http_client.HTTPException, socket.error) as e:
+        os.remove(temp_dest)
+        if isinstance(e, RangesNotSupported):
+            raise
+        raise FetchError("Data could not be fetched.")
+
+def write_range(fd, stream, offset, length):
+    """
+    Writes a response of length bytes at offset of the file, and fails if the response ends before.
+    """
+    end = offset + length
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        pwrite(fd, chunk, offset)
+        offset += len(chunk)
+    if offset != end:
+        raise FetchError("Data could not be fetched: the response ended after {0} of {1} bytes.".format(
+            length - (end - offset), length))
+
+def pwrite(fd, data, offset, lock=threading.Lock()):
+    """
+    Writes data at an offset of the file without moving a file position shared with the other segments.
+    Python 2 has no os.pwrite, the position is then moved under a lock.
+    """
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+def checksum(path, algorithm="sha1"):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_validators(url, dest):
+    """
+    Returns the ETag and Last-Modified saved along with dest, if dest still exists and was fetched from url.
+    """
+    if not os.path.isfile(dest):
+        return {}
+    try:
+        with open(dest + VALIDATORS_SUFFIX) as sidecar:
+            validators = json.load(sidecar)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(validators, dict) or validators.get("url") != url:
+        return {}
+    return dict(etag=validators.get("etag"), last_modified=validators.get("last_modified"))
+
+def write_validators(url, dest, headers):
+    """
+    Saves the ETag and Last-Modified of the response along with dest, or removes them if it sent neither.
+    """
+    validators = dict(url=url, etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"))
+    try:
+        if validators["etag"] is None and validators["last_modified"] is None:
+            if os.path.exists(dest + VALIDATORS_SUFFIX):
+                os.remove(dest + VALIDATORS_SUFFIX)
+            return
+        with open(dest + VALIDATORS_SUFFIX, "w") as sidecar:
+            json.dump(validators, sidecar)
+    except (IOError, OSError):
+        raise WriteError("Validators could not be written.")
 
 def main():
     mod = AnsibleModule(
         argument_spec=dict(
-            url = dict(required=True),
-            dest = dict(required=False, default='/tmp/testAnsible.txt')
-        )
+            url = dict(required=False),
+            urls = dict(required=False, type='list'),
+            dest = dict(required=False, default='/tmp/testAnsible.txt'),
+            checksum = dict(required=False),
+            parallelism = dict(required=False, type='int', default=DEFAULT_PARALLELISM),
+            segment_size = dict(required=False, type='int', default=DEFAULT_SEGMENT_SIZE),
+            cache_dir = dict(required=False, type='path'),
+            cache_size = dict(required=False, type='int', default=DEFAULT_CACHE_SIZE)
+        ),
+        required_one_of=[["url", "urls"]],
+        mutually_exclusive=[["url", "urls"]]
     )
 
     save_data(mod)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,292 @@
+"""
+With run_on=controller, runs hdfs_operations once per playbook run from the controller instead of once per host.
+Without it the task runs on every host, as before.
+
+The work of a task is keyed by the cluster, the command, the path and the other arguments. The first host to get
+to a key runs the module on the controller, every other host of the task waits for it and gets the same result,
+marked "deduplicated", without talking to the NameNode at all. The hosts then need neither the hdfs package nor
+a Python startup for the task, only the controller does.
+
+"put" of a single file reads the file from the host: its SHA1 is taken on the host first, and the file is only
+fetched to the controller when the HDFS file isn't the one uploaded from a file with the same SHA1 before.
+Commands reading or writing other local files of the host ("get", "sync", "put" of a directory, "output_file",
+"checksum_manifest", resumable uploads with their journal, or any of them in "operations") still run on the host.
+The controller talks to the NameNode as the user running Ansible, not as the remote or become user of the hosts.
+
+With persistent=true the request is sent straight to the persistent worker of the module over its Unix socket,
+so a task costs a round trip to the worker instead of a Python startup.
+"""
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from ansible import constants as C
+from ansible.module_utils._text import to_native
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins.action import ActionBase
+from ansible.utils.hashing import checksum as sha1_checksum
+
+# commands that read or write files of the host
+HOST_COMMANDS = ("get", "sync")
+# options naming files of the host
+HOST_FILE_OPTIONS = ("output_file", "checksum_manifest", "upload_journal")
+# options selecting and authenticating against the cluster, shared by every command
+CONNECTION_OPTIONS = ("webhdfs_url", "authentication", "principal", "delegation_token_cache", "namenode_cache",
+                      "namenode_cache_ttl", "retries")
+# controller file with the SHA1 and the HDFS status of the files uploaded by "put" from a host
+DEFAULT_PUT_CACHE = "~/.ansible/hdfs_put_checksums.json"
+# directory of the sockets of the persistent workers, DEFAULT_WORKER_DIR of the module
+DEFAULT_WORKER_DIR = "~/.ansible/pc"
+# WORKER_READY_TIMEOUT, WORKER_RESULT_TIMEOUT and WORKER_READY of the module
+WORKER_READY_TIMEOUT = 10
+WORKER_RESULT_TIMEOUT = 3600
+WORKER_READY = b"+"
+
+class ActionModule(ActionBase):
+
+    TRANSFERS_FILES = False
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp  # tmp no longer has any effect
+
+        module_args = dict(self._task.args)
+        run_on = module_args.pop("run_on", "host")
+        stat = None
+        if run_on == "host" or self._needs_host(module_args):
+            result.update(self._execute_module(module_name="hdfs_operations", module_args=module_args,
+                                               task_vars=task_vars))
+            return result
+
+        if module_args.get("command") == "put":
+            stat = self._execute_remote_stat(module_args.get("local_path") or "", all_vars=task_vars,
+                                             follow=True, checksum=True)
+            if not stat["exists"] or stat.get("isdir"):
+                # the module reports a missing file and mirrors a directory on the host
+                result.update(self._execute_module(module_name="hdfs_operations", module_args=module_args,
+                                                   task_vars=task_vars))
+                return result
+
+        key = hashlib.sha256(json.dumps([self._task._uuid, self._play_context.check_mode, module_args,
+                                         stat and stat["checksum"]], sort_keys=True).encode("utf-8")).hexdigest()
+        result.update(self._run_once(key, lambda: self._run_put(module_args, stat) if stat is not None
+                                     else self._run_on_controller(module_args)))
+        return result
+
+    def _needs_host(self, module_args):
+        """
+        Tells if the task reads or writes files of the host other than the file of "put".
+        """
+        if _uses_host_files(module_args):
+            return True
+        operations = module_args.get("operations")
+        if operations:
+            return not isinstance(operations, list) or any(
+                not isinstance(operation, dict) or operation.get("command") in HOST_COMMANDS + ("put",) or
+                _uses_host_files(operation) for operation in operations)
+        return module_args.get("command") in HOST_COMMANDS
+
+    def _run_once(self, key, func):
+        """
+        Runs func for the first host of the key, and returns its result to every other host.
+        The lock and the result live in the local temporary directory of the playbook run, shared by the forks.
+        :param key: key of the work
+        :param func: function running the work and returning its result
+        :return: result of the work.
+        """
+        state_dir = os.path.join(C.DEFAULT_LOCAL_TMP, "hdfs_operations")
+        _makedirs(state_dir)
+        result_file = os.path.join(state_dir, key + ".json")
+        with open(os.path.join(state_dir, key + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(result_file):
+                with open(result_file) as cached:
+                    result = json.load(cached)
+                # the NameNode saw the requests once, the metrics of the run are reported by the first host only
+                result.pop("metrics", None)
+                result["deduplicated"] = True
+                return result
+            result = func()
+            with open(result_file, "w") as cached:
+                json.dump(result, cached)
+            return result
+
+    def _run_on_controller(self, module_args):
+        """
+        Runs the module on the controller with the Python running Ansible.
+        :param module_args: arguments of the module
+        :return: result of the module.
+        """
+        module_path = self._shared_loader_obj.module_loader.find_plugin("hdfs_operations")
+        args = dict(module_args, _ansible_check_mode=self._play_context.check_mode,
+                    _ansible_diff=self._play_context.diff, _ansible_no_log=self._play_context.no_log)
+        if boolean(module_args.get("persistent", False), strict=False):
+            # a running worker takes the request without even starting the module, otherwise the module starts it
+            try:
+                return _call_worker(_worker_socket(module_path), args)
+            except socket.timeout:
+                # the worker is busy or stuck, the module would wait for it as well
+                args["persistent"] = False
+            except (IOError, OSError, ValueError):
+                pass
+        fd, args_file = tempfile.mkstemp(dir=C.DEFAULT_LOCAL_TMP, suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as args_output:
+                json.dump({"ANSIBLE_MODULE_ARGS": args}, args_output)
+            process = subprocess.Popen([sys.executable, module_path, args_file],
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
+        finally:
+            os.remove(args_file)
+        try:
+            return json.loads(to_native(stdout))
+        except ValueError:
+            return dict(failed=True, rc=process.returncode, module_stdout=to_native(stdout),
+                        module_stderr=to_native(stderr), msg="hdfs_operations failed on the controller.")
+
+    def _run_put(self, module_args, stat):
+        """
+        Uploads the local file of the host, fetching it to the controller only when HDFS may not have it yet.
+        :param module_args: arguments of the module
+        :param stat: stat of the local file on the host, with its SHA1
+        :return: result of the module.
+        """
+        local_path = module_args["local_path"]
+        hdfs_file_path = "{0}/{1}".format(module_args["path"].rstrip("/"), os.path.basename(local_path))
+        cache_file = os.path.expanduser(DEFAULT_PUT_CACHE)
+        cache_key = json.dumps([sorted(module_args["webhdfs_url"]) if isinstance(module_args["webhdfs_url"], list)
+                                else module_args["webhdfs_url"], hdfs_file_path])
+        connection_args = dict((option, module_args[option]) for option in CONNECTION_OPTIONS if option in module_args)
+
+        uploaded = _load_cache_file(cache_file).get(cache_key)
+        if uploaded is not None and uploaded["checksum"] == stat["checksum"]:
+            status = self._file_status(connection_args, hdfs_file_path)
+            if status is not None and [status["length"], status["modificationTime"]] == \
+                    [uploaded["length"], uploaded["modificationTime"]]:
+                return dict(changed=False,
+                            local_path=local_path,
+                            path=hdfs_file_path,
+                            msg="content of the local file and the file in HDFS is same. Skipping upload.")
+
+        fetch_dir = tempfile.mkdtemp(dir=C.DEFAULT_LOCAL_TMP)
+        try:
+            fetched = os.path.join(fetch_dir, os.path.basename(local_path))
+            self._connection.fetch_file(local_path, fetched)
+            if sha1_checksum(fetched) != stat["checksum"]:
+                return dict(failed=True, local_path=local_path, msg="{0} changed while it was fetched "
+                                                                    "from the host.".format(local_path))
+            result = self._run_on_controller(dict(module_args, local_path=fetched))
+        finally:
+            shutil.rmtree(fetch_dir, ignore_errors=True)
+        result["local_path"] = local_path
+
+        if not result.get("failed") and not self._play_context.check_mode:
+            status = self._file_status(connection_args, hdfs_file_path)
+            _update_cache_file(cache_file, cache_key, None if status is None else
+                               {"checksum": stat["checksum"], "length": status["length"],
+                                "modificationTime": status["modificationTime"]})
+        return result
+
+    def _file_status(self, connection_args, hdfs_file_path):
+        """
+        :return: FileStatus of a HDFS file, None if it doesn't exist.
+        """
+        result = self._run_on_controller(dict(connection_args, command="ls", path=hdfs_file_path))
+        entries = [] if result.get("failed") else result.get("entries", [])
+        return entries[0] if len(entries) == 1 and entries[0]["type"] == "FILE" else None
+
+def _uses_host_files(args):
+    """
+    Tells if the arguments name files of the host, or make "put" resumable: its journal on the host identifies
+    the local file by its inode and modification time, which a copy fetched to the controller never keeps.
+    """
+    return any(args.get(option) for option in HOST_FILE_OPTIONS) or \
+        boolean(args.get("resumable", False), strict=False)
+
+def _worker_socket(module_path):
+    """
+    Returns the socket of the persistent worker of the module, named after the version of its source like the
+    module does.
+    """
+    with open(module_path) as module_file:
+        version = hashlib.sha1(module_file.read().encode("utf-8")).hexdigest()[:12]
+    return os.path.join(os.path.expanduser(DEFAULT_WORKER_DIR), "hdfs_operations-{0}.sock".format(version))
+
+def _call_worker(socket_path, args):
+    """
+    Sends the module arguments of a request to the persistent worker and returns its result, like the module does:
+    the arguments are only sent once the worker takes the request, socket.timeout is raised if it doesn't.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(WORKER_READY_TIMEOUT)
+        connection.connect(socket_path)
+        if connection.recv(len(WORKER_READY)) != WORKER_READY:
+            raise socket.error("the persistent worker closed the connection.")
+        connection.sendall(json.dumps(args).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        connection.settimeout(WORKER_RESULT_TIMEOUT)
+        chunks = []
+        try:
+            while True:
+                chunk = connection.recv(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.timeout:
+            # the worker may still be running the request, it isn't run a second time
+            return dict(failed=True, msg="the persistent worker didn't return the result within {0} seconds."
+                        .format(WORKER_RESULT_TIMEOUT))
+    finally:
+        connection.close()
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def _makedirs(path):
+    """
+    Creates a directory if it doesn't exist yet, another fork may create it at the same time.
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _load_cache_file(cache_file):
+    """
+    :return: entries of a controller cache file, empty if it doesn't exist or can't be read.
+    """
+    try:
+        with open(cache_file) as cache:
+            entries = json.load(cache)
+    except (IOError, OSError, ValueError):
+        return {}
+    return entries if isinstance(entries, dict) else {}
+
+def _update_cache_file(cache_file, key, entry):
+    """
+    Sets one entry of a controller cache file, and deletes it if entry is None.
+    The forks update the file under a lock, and replace it atomically.
+    """
+    cache_dir = os.path.dirname(cache_file)
+    _makedirs(cache_dir)
+    with open(cache_file + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        entries = _load_cache_file(cache_file)
+        if entry is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = entry
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "w") as output:
+            json.dump(entries, output, sort_keys=True)
+        os.chmod(temp_file, 0o600)
+        os.rename(temp_file, cache_file)
@@ -0,0 +1,141 @@
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: hdfs_metrics
+    type: aggregate
+    short_description: Summarizes the metrics returned by hdfs_operations tasks
+    description:
+        - Aggregates the "metrics" returned by hdfs_operations across hosts and tasks.
+        - At the end of every play, displays a table with the wall time in seconds of every phase, the HTTP requests,
+          the bytes sent and received and the retries per task, and writes them to a JSON file.
+        - The "overhead" column is the time the task took on the controller minus the time the module reported,
+          i.e. the Python startup on the target, the connection and the transfer of the module.
+    requirements:
+        - enable in configuration, e.g. callback_whitelist = hdfs_metrics
+    options:
+        output_file:
+            description: JSON file the aggregated metrics of all the plays are written to.
+            default: hdfs_metrics.json
+            env:
+                - name: HDFS_METRICS_FILE
+            ini:
+                - section: callback_hdfs_metrics
+                  key: output_file
+'''
+
+import json
+import time
+from ansible.plugins.callback import CallbackBase
+
+PHASES = ["client_init", "status", "list", "checksum", "transfer", "update"]
+COUNTERS = ["requests", "bytes_sent", "bytes_received", "retries"]
+
+def _empty_totals():
+    totals = dict((phase, 0.0) for phase in ["total", "overhead"] + PHASES)
+    totals.update((counter, 0) for counter in COUNTERS)
+    totals["runs"] = 0
+    return totals
+
+def _add_metrics(totals, metrics, duration=None):
+    """
+    Adds the metrics of a module run to the totals.
+    :param totals: totals as returned by _empty_totals
+    :param metrics: "metrics" of the module result
+    :param duration: time the task took on the controller, if known
+    """
+    seconds = metrics.get("seconds", {})
+    for phase in ["total"] + PHASES:
+        totals[phase] += seconds.get(phase, 0.0)
+    for counter in COUNTERS:
+        totals[counter] += metrics.get(counter, 0)
+    if duration is not None:
+        totals["overhead"] += max(duration - seconds.get("total", 0.0), 0.0)
+    totals["runs"] += 1
+
+class CallbackModule(CallbackBase):
+    """
+    Aggregates the metrics of hdfs_operations tasks per play, task and host.
+    """
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'hdfs_metrics'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display=display)
+        self._plays = []
+        self._play = None
+        self._task_started = None
+        self._host_started = {}
+
+    def v2_playbook_on_play_start(self, play):
+        self._end_play()
+        self._play = {"play": play.get_name(), "tasks": [], "hosts": {}, "total": _empty_totals()}
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_started = time.time()
+
+    def v2_runner_on_start(self, host, task):
+        self._host_started[(host.get_name(), task._uuid)] = time.time()
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    def v2_playbook_on_stats(self, stats):
+        self._end_play()
+
+    def _record(self, result):
+        """
+        Adds the metrics of a task result, or of every item of a loop, to the play.
+        """
+        if self._play is None:
+            return
+        results = result._result.get("results")
+        metrics = [item["metrics"] for item in results if isinstance(item, dict) and "metrics" in item] \
+            if isinstance(results, list) else [result._result["metrics"]] if "metrics" in result._result else []
+        if not metrics:
+            return
+
+        host = result._host.get_name()
+        started = self._host_started.pop((host, result._task._uuid), self._task_started)
+        # the items of a loop aren't timed separately on the controller
+        duration = time.time() - started if started is not None and len(metrics) == 1 else None
+        task_name = result._task.get_name()
+        tasks = [task for task in self._play["tasks"] if task["task"] == task_name]
+        if tasks:
+            task = tasks[0]
+        else:
+            task = {"task": task_name, "total": _empty_totals(), "hosts": {}}
+            self._play["tasks"].append(task)
+        for run in metrics:
+            for totals in (task["total"], task["hosts"].setdefault(host, _empty_totals()),
+                           self._play["hosts"].setdefault(host, _empty_totals()), self._play["total"]):
+                _add_metrics(totals, run, duration)
+
+    def _end_play(self):
+        """
+        Displays the summary of the current play and writes the metrics of all the plays so far.
+        """
+        play, self._play = self._play, None
+        if play is None or not play["tasks"]:
+            return
+        self._plays.append(play)
+        self._display.banner("HDFS METRICS [{0}]".format(play["play"]))
+        columns = ["runs", "total", "overhead"] + PHASES + COUNTERS
+        self._display.display("{0:<40}".format("task") + "".join(" {0:>14}".format(column) for column in columns))
+        for name, totals in [(task["task"], task["total"]) for task in play["tasks"]] + [("TOTAL", play["total"])]:
+            self._display.display("{0:<40}".format(name[:40]) +
+                                  "".join(" {0:>14}".format(totals[column] if isinstance(totals[column], int)
+                                                            else "{0:.2f}".format(totals[column]))
+                                          for column in columns))
+
+        output_file = self.get_option("output_file")
+        if output_file:
+            with open(output_file, "w") as output:
+                json.dump({"plays": self._plays}, output, indent=2, sort_keys=True)
+            self._display.display("HDFS metrics written to {0}".format(output_file))
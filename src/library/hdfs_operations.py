@@ -12,49 +12,269 @@ short_description: Performs operations against HDFS.
 description:
     Given a HDFS path, this module performs the below operations.
     - Uploads a local file to HDFS (hdfs dfs -put ...)
+    - Downloads a HDFS file or directory to a local directory (hdfs dfs -get ...)
+    - Mirrors a local directory into HDFS like rsync, optionally deleting extra files and fixing attributes
     - Changes the permissions of a file or directory (hdfs dfs -chmod ...)
     - Changes the owner of a file or directory (hdfs dfs -chown ...)
     - Changes the group of a file or directory (hdfs dfs -chown ...)
-    - Removes a file or directory in the HDFS (hdfs dfs -rm ...)
+    - Removes a file or directory in the HDFS (hdfs dfs -rm ...), or every path matching a glob pattern and filters
     - Creates a new directory in the HDFS (hdfs dfs -mkdir ...)
+    - Lists a directory or searches a tree in the HDFS (hdfs dfs -ls ..., hdfs dfs -find ...)
+    Before uploading over an existing file, the checksum computed by HDFS (GETFILECHECKSUM) is compared with the
+    same checksum computed from the local file, so the HDFS file is never downloaded to check if it has changed.
+    A changed file of up to 16 MiB is then uploaded from the content read for the checksum, larger files are read
+    again for the upload.
+    Many operations can be run in a single task with "operations", sharing one WebHDFS client and HTTP session.
+    In check mode nothing is changed and the operations that would be performed are returned as "plan". The plan
+    is computed from metadata, file contents are only compared by checksum when the metadata can't tell.
     This modules uses the HTTP REST API for interfacing with HDFS and it's all the mentioned operations.
 version_added: "2.4"
 requirements: [ "hdfs (Python 2.X WebHDFS client)",
-                "requests-kerberos (Kerberos requests)",
-                "pykerberos (A high-level wrapper for Kerberos (GSSAPI) operations)" ]
+                "requests-kerberos (Kerberos requests, for authentication=kerberos)",
+                "pykerberos (A high-level wrapper for Kerberos (GSSAPI) operations)",
+                "crc32c (optional, fast CRC32C to compare files with their HDFS checksum)" ]
 options:        
     webhdfs_url:
         description:
-            - WebHDFS URL with Hostname and PORT.
+            - WebHDFS URL with Hostname and PORT, or a list of them for the NameNodes of a HA cluster.
+            - With several NameNodes they are probed concurrently and the active one is remembered in
+              "namenode_cache". A request answered with StandbyException is retried against the next NameNode.
         required: True
     path:
         description:
-            - HDFS Path on which the operations will be carried out.
-        required: True
+            - HDFS Path on which the operations will be carried out. Required together with "command".
+            - For "rm" it may contain glob characters, e.g. /data/*/dt=2018-*, to remove every matching path.
+        required: False
     command:
         description:
             - Commands that performs certain operations. Please check the description for what each command does.
-        required: True
+            - Either "command" or "operations" is required.
+        required: False
+        choices: [ "rm", "chown", "chgrp", "chmod", "put", "get", "sync", "mkdir", "ls", "find" ]
     local_path:
         description:
             - Local file path. This is required for "put" command that will upload files into the certain HDFS directory.
+            - If it is a directory, it is mirrored into the HDFS directory and the files are uploaded concurrently.
+            - For "get", the local directory the HDFS file or directory is downloaded into. Large files are read as
+              up to "parallelism" ranges at the same time, and directories are mirrored "parallelism" files at a
+              time. Downloads are verified against the HDFS checksum and skipped when the local copy is the same.
         required: False
     recurse:
         description:
             - Recursively visits the directory.
+            - For "rm" it deletes the directory with everything below it. For "chown", "chgrp" and "chmod" it also
+              updates every file and directory below the path that doesn't match yet, up to "parallelism" at a time.
+              For "ls" it lists the whole tree instead of the directory only.
         required: False
     owner:
         description:
-            - Changes the owner of a file or directory.
+            - Changes the owner of a file or directory. For "ls" and "find", only returns the paths with this owner.
         required: False
     group:
         description:
-            - Changes the group of a file or directory.
+            - Changes the group of a file or directory. For "ls" and "find", only returns the paths with this group.
         required: False
     permission:
         description:
             - Changes the permission(octal) eg: 0777 of a file or directory.
         required: False
+    max_depth:
+        description:
+            - Maximum depth below the path listed by "ls" and "find". Defaults to 1 for "ls" and no limit for "find".
+        required: False
+    pattern:
+        description:
+            - Glob patterns, e.g. "*.jar". "ls" and "find" only return the paths whose name matches one of them.
+        required: False
+    regex:
+        description:
+            - Regular expression. "ls" and "find" only return the paths that match it.
+        required: False
+    file_type:
+        description:
+            - Type of the paths returned by "ls" and "find".
+        required: False
+        choices: [ "file", "directory" ]
+    older_than:
+        description:
+            - Only selects the paths modified before this age (also for "rm"), e.g. "30d". Units are s, m, h, d (default) and w.
+        required: False
+    newer_than:
+        description:
+            - Only selects the paths modified within this age, e.g. "12h".
+        required: False
+    larger_than:
+        description:
+            - Only selects the files larger than this size (also for "rm"), e.g. "1g". Units are b (default), k, m, g and t.
+        required: False
+    smaller_than:
+        description:
+            - Only selects the files smaller than this size, e.g. "10k".
+        required: False
+    delete:
+        description:
+            - For "sync", deletes the files and directories in HDFS that don't exist in the local directory.
+        required: False
+        default: False
+    checksum:
+        description:
+            - For "sync", compares files of the same size by checksum even if their modification time is the same.
+              By default, like rsync, files with the same size and modification time are unchanged, and uploaded
+              files get the modification time of the local file.
+        required: False
+        default: False
+    trash:
+        description:
+            - For "rm", moves the paths to the trash of the user instead of deleting them.
+        required: False
+        default: False
+    rate_limit:
+        description:
+            - For "rm" with a glob pattern or filters, maximum number of NameNode calls per second.
+        required: False
+    count_only:
+        description:
+            - For "ls" and "find", only returns the counts instead of the matching entries.
+        required: False
+        default: False
+    output_file:
+        description:
+            - For "ls" and "find", writes the matching entries to this local file as JSON lines instead of returning them.
+              In check mode the file isn't written, the write is recorded in the plan.
+        required: False
+    operations:
+        description:
+            - List of operations to run in one module call. Each entry takes "command" and "path", and
+              optionally "local_path", "recurse", "owner", "group" and "permission". Options that are not
+              set in an entry are taken from the module options.
+            - Entries on unrelated paths run concurrently, entries on the same or nested paths run in the given order.
+        required: False
+    parallelism:
+        description:
+            - Maximum number of operations that run concurrently. Also bounds the number of concurrent
+              requests of a recursive "chown", "chgrp" or "chmod" and the number of files uploaded at the same
+              time by a directory "put".
+            - Concurrent NameNode requests are further limited to what the NameNode keeps up with. The limit
+              is halved whenever the NameNode throttles a request, lowered while its latency grows, and raised
+              again one request at a time while it answers quickly.
+        required: False
+        default: 8
+    retries:
+        description:
+            - Number of times a request throttled by the NameNode (RetriableException, HTTP 503 or 429) is sent
+              again, after a randomized exponential backoff.
+        required: False
+        default: 5
+    checksum_manifest:
+        description:
+            - Path of a local SQLite file that remembers the checksums of earlier runs. When the local file and the
+              length and modification time of the HDFS file haven't changed since they were last known to be the
+              same, the file is skipped without computing any checksum. Local checksums are only computed for files
+              the manifest doesn't know yet, and files uploaded by "put" that are new or of another length are
+              hashed while they are uploaded.
+        required: False
+    checksum_manifest_size:
+        description:
+            - Maximum number of entries kept in the checksum manifest. The least recently used entries are evicted.
+        required: False
+        default: 100000
+    max_bytes_in_flight:
+        description:
+            - Maximum number of bytes uploaded at the same time by a directory "put". A file larger than this is
+              uploaded on its own.
+        required: False
+        default: 268435456
+    resumable:
+        description:
+            - For "put" and "sync", uploads files in chunks (CREATE followed by APPEND) to a temporary file that is renamed into
+              place at the end. If an upload fails, the next run continues after the part already written, once
+              its length and checksum in HDFS match the start of the local file.
+        required: False
+        default: False
+    chunk_size:
+        description:
+            - Number of bytes written per request by a resumable upload.
+        required: False
+        default: 134217728
+    upload_journal:
+        description:
+            - Local directory where resumable uploads keep their progress.
+        required: False
+        default: ~/.ansible/hdfs_upload_journal
+    parallel_upload:
+        description:
+            - For "put" of a single file larger than "block_size", uploads up to "parallelism" block aligned parts of
+              the file at the same time and joins them with CONCAT before renaming the file into place.
+              Ignored when "resumable" is set.
+        required: False
+        default: False
+    block_size:
+        description:
+            - Block size of the files written by a parallel upload.
+        required: False
+        default: 134217728
+    namenode_cache:
+        description:
+            - Local file where the active NameNode of a HA cluster is remembered between tasks. With
+              "delegate_to: localhost" it is shared by all the hosts of the play.
+        required: False
+        default: ~/.ansible/hdfs_namenodes.json
+    namenode_cache_ttl:
+        description:
+            - Number of seconds the active NameNode is remembered before the NameNodes are probed again.
+              A failover seen during a task updates it right away.
+        required: False
+        default: 300
+    authentication:
+        description:
+            - "simple" sends the user name with every request, for clusters without security.
+            - "kerberos" authenticates once with SPNEGO, using the Kerberos credentials of the user running the
+              module (kinit), to fetch a WebHDFS delegation token. All the requests then carry the token instead of
+              negotiating. The token is kept in "delegation_token_cache" and reused by later tasks and other hosts
+              until it's about to expire.
+        required: False
+        choices: [ "simple", "kerberos" ]
+        default: simple
+    principal:
+        description:
+            - Kerberos principal the delegation token is cached for. Defaults to the default principal of the
+              credential cache (klist).
+        required: False
+    delegation_token_cache:
+        description:
+            - Local file, only readable by its owner, where delegation tokens are kept by principal and cluster.
+              With "delegate_to: localhost" the tokens are shared by all the hosts of the play.
+        required: False
+        default: ~/.ansible/hdfs_delegation_tokens.json
+    run_on:
+        description:
+            - Where the operations run, with the hdfs_operations action plugin (src/action_plugins).
+            - With "controller", the task runs once per distinct arguments on the controller, whatever the number
+              of hosts, and every host gets the same result. The hosts don't need the hdfs package. "put" of a file
+              only fetches the file from the host when HDFS doesn't have the same content yet.
+            - "get", "sync", "put" of a directory, resumable uploads and the options naming local files
+              ("output_file", "checksum_manifest") always run on the host, as do "operations" using them.
+            - On the controller the requests are made as the user running Ansible, not as the remote or become
+              user of the hosts, and the controller needs access to the NameNode.
+        required: False
+        default: host
+        choices: [ "controller", "host" ]
+    persistent:
+        description:
+            - Forwards the request to a long-lived worker process of the same user, over a Unix socket in
+              ~/.ansible/pc. The worker is started by the first task and keeps a warm client and its keep-alive
+              connections per cluster, the delegation tokens and the active NameNode, so the following tasks skip
+              the client setup and the TCP/TLS handshakes.
+            - With run_on=controller the action plugin sends the request to the worker itself, so the tasks don't
+              even start a Python interpreter.
+            - The worker serves one request at a time. If it can't be started, the module runs the request itself.
+        required: False
+        default: False
+    persistent_idle_timeout:
+        description:
+            - Seconds the persistent worker waits for a new request before it exits. Set by the task that starts it.
+        required: False
+        default: 60
 author:
     - Sayed Anisul Hoque @ Ultra Tendency GmbH
 '''
@@ -66,6 +286,16 @@ EXAMPLES = '''
     hdfs_path: /tmp/not-exist
     command: rm
 
+# Removes the partitions older than 30 days of every table, 20 at a time and at most 100 NameNode calls per second.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /data/*/dt=*
+    command: rm
+    recurse: True
+    older_than: 30d
+    parallelism: 20
+    rate_limit: 100
+
 # Sets the owner of a HDFS file or directory in the HDFS.
 - hdfs_operations:
     webhdfs_url: http://sandbox.hortonworks.com:50070
@@ -87,6 +317,33 @@ EXAMPLES = '''
     command: chmod
     permission: "0666"
 
+# Sets the owner of a HDFS directory and of everything below it.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps/hive/warehouse
+    command: chown
+    owner: hive
+    recurse: True
+    parallelism: 32
+
+# Counts the jars older than 30 days below a directory.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps/releases
+    command: find
+    pattern: "*.jar"
+    file_type: file
+    older_than: 30d
+    count_only: True
+
+# Writes the listing of a whole tree to a local file instead of the task result.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /data/landing
+    command: ls
+    recurse: True
+    output_file: /tmp/landing.jsonl
+
 # Creates a new directory in the HDFS, if it does not exist.
 - hdfs_operations:
     webhdfs_url: http://sandbox.hortonworks.com:50070
@@ -99,6 +356,103 @@ EXAMPLES = '''
     hdfs_path: /tmp
     local_path: /home/sayed/oozie-document-sla-retrieval.adoc
     command: put
+
+# Restores a HDFS directory into /restore/conf, downloading up to 16 files at a time.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps/conf
+    local_path: /restore
+    command: get
+    parallelism: 16
+
+# Mirrors a local directory into /apps/releases/lib, uploading up to 16 files at a time.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps/releases
+    local_path: /opt/build/lib
+    command: put
+    parallelism: 16
+
+# Mirrors /opt/build/conf into /apps/conf, deleting files removed locally and fixing owner and permissions.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps
+    local_path: /opt/build/conf
+    command: sync
+    delete: True
+    owner: hive
+    permission: "0644"
+
+# Uploads a large file in chunks of 256 MB. If the upload fails, running the task again continues where it stopped.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /data/dumps
+    command: put
+    local_path: /backup/dump-2018-06-01.tar
+    resumable: True
+    chunk_size: 268435456
+
+# Uploads a 100 GB file as 32 parts at the same time, joined in HDFS once all are written.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /data/dumps
+    command: put
+    local_path: /backup/warehouse.tar
+    parallel_upload: True
+    parallelism: 32
+
+# Uploads a release, skipping the files that haven't changed since the last run without hashing them.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /apps/releases
+    local_path: /opt/build/lib
+    command: put
+    checksum_manifest: ~/.ansible/hdfs_checksums.sqlite
+
+# Creates a directory on the active NameNode of a HA cluster.
+- hdfs_operations:
+    webhdfs_url:
+      - http://nn1.example.com:50070
+      - http://nn2.example.com:50070
+    hdfs_path: /tmp/some-new-folder
+    command: mkdir
+
+# Uploads a file to a kerberized cluster, after kinit on the controller. The delegation token fetched by the first
+# task is reused by the following tasks of every host.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    authentication: kerberos
+    hdfs_path: /tmp
+    command: put
+    local_path: /home/sayed/oozie-document-sla-retrieval.adoc
+  delegate_to: localhost
+
+# Runs many operations over one WebHDFS session, up to 4 at a time.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    owner: solr
+    parallelism: 4
+    operations:
+      - { command: mkdir, path: /tmp/some-new-folder }
+      - { command: put, path: /tmp/some-new-folder, local_path: /home/sayed/oozie-document-sla-retrieval.adoc }
+      - { command: chown, path: /tmp/some-new-folder }
+      - { command: chmod, path: /tmp/kernel_cleaner.sh, permission: "0666" }
+
+# Creates a directory from the controller once for all the hosts of the play, instead of once per host.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: /tmp/some-new-folder
+    command: mkdir
+    run_on: controller
+
+# Runs many small tasks through a persistent worker that exits after two minutes without requests.
+- hdfs_operations:
+    webhdfs_url: http://sandbox.hortonworks.com:50070
+    hdfs_path: "/tmp/{{ item }}"
+    command: mkdir
+    persistent: true
+    persistent_idle_timeout: 120
+  with_items: "{{ directories }}"
 '''
 
 RETURN = '''
@@ -120,15 +474,237 @@ msg:
     description: The output message generated by different functionalities in this module.
     type: string
     sample: "uploaded: /tmp/oozie-document-sla-retrieval.adoc"
+uploaded:
+    description: Number of files uploaded by a directory "put".
+    returned: when "local_path" is a directory
+    type: int
+    sample: 42
+unchanged:
+    description: Number of files skipped by a directory "put" because their content hasn't changed.
+    returned: when "local_path" is a directory
+    type: int
+    sample: 1380
+bytes:
+    description: Number of bytes uploaded by a directory "put", downloaded by "get", or freed by "rm" with a glob
+                 pattern or filters.
+    returned: when "local_path" is a directory, for "get", for "rm" with a glob pattern or filters
+    type: int
+    sample: 73400320
+updated:
+    description: Number of files and directories below the path that were updated by a recursive chown, chgrp or chmod.
+    returned: for "chown", "chgrp" and "chmod"
+    type: int
+    sample: 1250
+entries:
+    description: FileStatus of every path found by "ls" or "find", with its "path".
+    returned: for "ls" and "find", unless "count_only" or "output_file" is set
+    type: list
+    sample: [{"path": "/tmp/kernel_cleaner.sh", "type": "FILE", "length": 1024, "owner": "solr", "group": "hdfs",
+              "permission": "644", "modificationTime": 1528808340000, "replication": 3, "blockSize": 134217728}]
+count:
+    description: Number of paths found by "ls" or "find", along with "files", "directories" and "bytes".
+    returned: for "ls" and "find"
+    type: int
+    sample: 1024
+downloaded:
+    description: Number of files downloaded by a directory "get", along with "unchanged" and "bytes".
+    returned: when "path" is a directory for "get"
+    type: int
+    sample: 12
+deleted:
+    description: Number of paths removed by "rm" with a glob pattern or filters, along with "bytes" and "duration".
+    returned: for "rm" with a glob pattern or filters
+    type: int
+    sample: 730
+metadata_cache:
+    description: Number of remote metadata calls (status, listing, checksum) saved by the per-run cache and still made.
+    returned: always
+    type: dict
+    sample: {"remote_calls_saved": 12, "remote_calls": 14}
+report:
+    description: Number of paths and bytes of every category of a "sync".
+    returned: for "sync"
+    type: dict
+    sample: {"created": {"count": 2, "bytes": 4096}, "updated": {"count": 1, "bytes": 1024},
+             "unchanged": {"count": 120, "bytes": 7340032}, "deleted": {"count": 1, "bytes": 512},
+             "attributes": {"count": 3, "bytes": 0}, "directories": {"count": 1, "bytes": 0}}
+plan:
+    description: Operations that would be performed, with the path and arguments of each, e.g. the reason of an upload.
+    returned: in check mode
+    type: list
+    sample: [{"operation": "upload", "path": "/apps/conf/hive-site.xml", "local_path": "/opt/conf/hive-site.xml",
+              "bytes": 5120, "reason": "size"}, {"operation": "set_owner", "path": "/apps/conf", "owner": "hive"}]
+metrics:
+    description: Wall time in seconds of every phase of the run (client_init, status, list, checksum, transfer,
+                 update and the total), the number of HTTP requests, also by WebHDFS operation, the bytes sent and
+                 received and the number of retried requests. Phases running concurrently overlap.
+    returned: always
+    type: dict
+    sample: {"seconds": {"client_init": 0.012, "status": 0.031, "list": 0.004, "checksum": 0.25, "transfer": 1.84,
+                         "update": 0.02, "total": 2.21},
+             "requests": 9, "requests_by_operation": {"GETFILESTATUS": 2, "GETFILECHECKSUM": 1, "CREATE": 2,
+                                                      "DELETE": 1, "RENAME": 1, "MKDIRS": 2},
+             "bytes_sent": 73400320, "bytes_received": 1210, "retries": 0}
+results:
+    description: Result of every entry of "operations", in the given order.
+    returned: when "operations" is used
+    type: list
+    sample: [{"command": "mkdir", "path": "/tmp/some-new-folder", "changed": true, "msg": "created directory."}]
+deduplicated:
+    description: Set when the result is the one of another host of the task, the operations ran only once. The
+                 "metrics" are only returned to the host that ran them.
+    returned: with run_on=controller, on every host but the first with the same arguments
+    type: bool
+    sample: true
 '''
 
+import contextlib
+import fcntl
+import fnmatch
+import getpass
 import hashlib
+import inspect
+import itertools
+import json
 import os
+import random
 import re
+import requests
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from ansible.module_utils import basic
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.module_utils.six.moves import queue
 from hdfs import InsecureClient
 from hdfs import HdfsError
-# from hdfs.ext.kerberos import KerberosClient
+from hdfs.client import Client
+from hdfs.client import _Request
+
+try:
+    import crc32c
+    _crc32c = getattr(crc32c, "crc32c", None) or crc32c.crc32
+    HAS_CRC32C = True
+except ImportError:
+    HAS_CRC32C = False
+
+try:
+    from requests_kerberos import HTTPKerberosAuth, OPTIONAL
+    HAS_REQUESTS_KERBEROS = True
+except ImportError:
+    HAS_REQUESTS_KERBEROS = False
+
+COMMANDS = ["rm", "chown", "chgrp", "chmod", "put", "get", "sync", "mkdir", "ls", "find"]
+# options that can be set per entry of `operations`
+OPERATION_OPTIONS = ["command", "path", "local_path", "recurse", "owner", "group", "permission",
+                     "max_depth", "pattern", "regex", "file_type", "older_than", "newer_than", "larger_than",
+                     "smaller_than", "count_only", "output_file", "trash", "resumable",
+                     "parallel_upload", "delete", "checksum"]
+# options that turn "rm" into the removal of every path matching them
+FILTER_OPTIONS = ["pattern", "regex", "file_type", "older_than", "newer_than", "larger_than", "smaller_than"]
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+# units of the age and size filters
+AGE_UNITS = {"": 86400, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+# upper bound of the bytes uploaded at the same time by a directory "put"
+DEFAULT_MAX_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+# categories of the report of "sync", with the number of paths and bytes of each
+SYNC_CATEGORIES = ["created", "updated", "unchanged", "deleted", "attributes", "directories"]
+# bytes written per CREATE/APPEND request by a resumable upload
+DEFAULT_CHUNK_SIZE = 128 * 1024 * 1024
+DEFAULT_UPLOAD_JOURNAL = "~/.ansible/hdfs_upload_journal"
+# dfs.blocksize default, the part files of a parallel upload are multiples of it
+DEFAULT_BLOCK_SIZE = 128 * 1024 * 1024
+
+# without the crc32c package, larger files are compared by reading them back from HDFS instead
+PURE_PYTHON_CRC32C_LIMIT = 64 * 1024 * 1024
+# checksum algorithms returned by GETFILECHECKSUM, e.g. MD5-of-0MD5-of-512CRC32C or COMPOSITE-CRC32C
+MD5_MD5_CRC_ALGORITHM = re.compile(r"^MD5-of-(\d+)MD5-of-(\d+)(CRC32C?)$")
+COMPOSITE_CRC_ALGORITHM = re.compile(r"^COMPOSITE-(CRC32C?)$")
+
+# default maximum number of entries of the checksum manifest
+DEFAULT_MANIFEST_ENTRIES = 100000
+# checksum parameters of files written on a cluster, the HDFS defaults until a checksum of the cluster is seen
+DEFAULT_CHECKSUM_PARAMETERS = ("MD5-of-0MD5-of-512CRC32C", 512, 128 * 1024 * 1024)
+_CHECKSUM_PARAMETERS = {}
+# bytes read ahead of the upload by a hashing upload
+PIPELINE_CHUNK_SIZE = 4 * 1024 * 1024
+# same length files up to this size keep the content read for the checksum comparison, and are uploaded from it
+COMPARE_BUFFER_SIZE = 16 * 1024 * 1024
+# checksum manifests opened in this run, by path
+_MANIFESTS = {}
+_MANIFESTS_LOCK = threading.Lock()
+
+_CRC32C_TABLE = []
+for _byte in range(256):
+    _crc = _byte
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0x82F63B78 if _crc & 1 else _crc >> 1
+    _CRC32C_TABLE.append(_crc)
+
+# number of entries per LISTSTATUS_BATCH page (dfs.ls.limit)
+LISTING_PAGE_SIZE = 1000
+# minimum number of lookups in a directory before its name index is built
+NAME_INDEX_MIN_LOOKUPS = 32
+
+# phases of a run whose wall time is reported in the metrics
+METRICS_PHASES = ["client_init", "status", "list", "checksum", "transfer", "update"]
+# phase of the requests of every WebHDFS operation, all other operations update metadata
+OPERATION_PHASES = {"GETFILESTATUS": "status", "GETTRASHROOT": "status", "GETHOMEDIRECTORY": "status",
+                    "LISTSTATUS": "list", "LISTSTATUS_BATCH": "list", "GETCONTENTSUMMARY": "list",
+                    "GETFILECHECKSUM": "checksum", "CREATE": "transfer", "APPEND": "transfer", "OPEN": "transfer",
+                    "CONCAT": "transfer"}
+WEBHDFS_OPERATION = re.compile(r"[?&]op=([^&]+)")
+
+DEFAULT_RETRIES = 5
+# seconds of the first and the longest backoff before retrying a throttled request
+RETRY_BACKOFF = 0.2
+RETRY_BACKOFF_MAX = 30
+# responses of a NameNode that is too busy to perform the request
+THROTTLED_STATUSES = (429, 503)
+THROTTLED_EXCEPTION = b"RetriableException"
+# NameNode latency, relative to the usual latency of the operation, above which fewer requests are sent at a time
+LATENCY_TOLERANCE = 3.0
+
+DEFAULT_DELEGATION_TOKEN_CACHE = "~/.ansible/hdfs_delegation_tokens.json"
+# seconds a delegation token is used for, the default renew interval of the NameNode (24 hours) minus a margin
+DELEGATION_TOKEN_LIFETIME = 24 * 3600 - 600
+DELEGATION_PARAMETER = re.compile(r"([?&])delegation=([^&]*)&?")
+INVALID_TOKEN_EXCEPTION = b"InvalidToken"
+
+DEFAULT_NAMENODE_CACHE = "~/.ansible/hdfs_namenodes.json"
+DEFAULT_NAMENODE_CACHE_TTL = 300
+# seconds to connect to a NameNode of a HA cluster, or to probe its state
+NAMENODE_TIMEOUT = 5
+# order in which NameNodes are tried, by the state found when probing them
+NAMENODE_STATES = ["active", "unknown", "standby", "unreachable"]
+
+# directory of the sockets of the persistent workers, one per user and version of the module
+DEFAULT_WORKER_DIR = "~/.ansible/pc"
+# seconds a persistent worker waits for its next request before it exits
+DEFAULT_WORKER_IDLE_TIMEOUT = 60
+# seconds the module waits for a worker it started to accept requests
+WORKER_START_TIMEOUT = 10
+# seconds a request waits for the worker to take it, a worker busy longer is bypassed
+WORKER_READY_TIMEOUT = 10
+# seconds a request waits for its result once the worker took it
+WORKER_RESULT_TIMEOUT = 3600
+# sent by the worker when it takes a request
+WORKER_READY = b"+"
+
+# WebHDFS operations that aren't exposed by the hdfs client, see _list_directory
+_list_status_batch = _Request("GET").to_method("LISTSTATUS_BATCH")
+_get_trash_root = _Request("GET").to_method("GETTRASHROOT")
+_concat = _Request("POST").to_method("CONCAT")
+_get_delegation_token = _Request("GET").to_method("GETDELEGATIONTOKEN")
+# WebHDFS URLs of the clusters that don't support LISTSTATUS_BATCH
+_NO_BATCH_LISTING = set()
 
 def _path_exists(module, hdfs_client, hdfs_path=None):
     """
@@ -154,7 +730,7 @@ def _checksum_from_local_file(file_name):
     """
     hash_md5 = hashlib.md5()
     chunk_size = 64 * 1024
-    with open(file_name, "rb") as file:
+    with _METRICS.phase("checksum"), open(file_name, "rb") as file:
         for chunk in iter(lambda: file.read(chunk_size), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
@@ -170,19 +746,422 @@ def _checksum_from_hdfs_file(hdfs_client, hdfs_path):
     if status_hdfs is not None and status_hdfs['type'] == 'FILE':
         chunk_size = 64 * 1024
         hash_md5 = hashlib.md5()
-        with hdfs_client.read(hdfs_path) as file:
+        with _METRICS.phase("checksum"), hdfs_client.read(hdfs_path) as file:
             for chunk in iter(lambda: file.read(chunk_size), b""):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
     raise HdfsError("{0} provided is not file.".format(hdfs_path))
 
-def change_owner(module, hdfs_client, hdfs_path=None, owner=None):
+def _crc32c_pure(data, crc=0):
+    """
+    CRC32C (Castagnoli) in pure python, used when the crc32c package isn't installed.
+    :param data: bytes
+    :param crc: CRC of the preceding data
+    :return: CRC32C of the data
+    """
+    crc ^= 0xFFFFFFFF
+    for byte in bytearray(data):
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+def _crc_function(crc_type):
+    """
+    Returns the CRC function for the HDFS checksum type, CRC32 or CRC32C.
+    """
+    if crc_type == "CRC32":
+        return lambda data, crc=0: zlib.crc32(data, crc) & 0xFFFFFFFF
+    if HAS_CRC32C:
+        return _crc32c
+    return _crc32c_pure
+
+class _HdfsChecksum(object):
+    """
+    Incremental computation of the checksum HDFS reports through GETFILECHECKSUM.
+    MD5-of-MD5-of-CRC: CRC of every bytes_per_crc chunk, MD5 of the CRCs of every block, MD5 of the block MD5s.
+    COMPOSITE-CRC: CRC of the whole content.
+    Raises ValueError if the algorithm is not supported.
+    """
+    def __init__(self, algorithm, bytes_per_crc, block_size):
+        composite = COMPOSITE_CRC_ALGORITHM.match(algorithm)
+        md5_md5 = MD5_MD5_CRC_ALGORITHM.match(algorithm)
+        if not composite and not md5_md5:
+            raise ValueError("checksum algorithm {0} is not supported.".format(algorithm))
+        self.composite = composite is not None
+        self.crc_type = (composite or md5_md5).groups()[-1]
+        self.bytes_per_crc = bytes_per_crc
+        self.block_size = block_size
+        self._crc_function = _crc_function(self.crc_type)
+        self._crc = 0
+        self._partial = b""
+        self._block_length = 0
+        self._block_md5 = hashlib.md5()
+        self._block_digests = []
+
+    def computes(self, algorithm, bytes_per_crc, block_size):
+        """
+        Checks if this checksum is comparable to a checksum HDFS computed with the given parameters.
+        """
+        composite = COMPOSITE_CRC_ALGORITHM.match(algorithm)
+        match = composite or MD5_MD5_CRC_ALGORITHM.match(algorithm)
+        if match is None or (composite is not None) != self.composite or match.groups()[-1] != self.crc_type:
+            return False
+        return self.composite or (bytes_per_crc == self.bytes_per_crc and block_size == self.block_size)
+
+    def _add_crc(self, data):
+        self._block_md5.update(struct.pack(">I", self._crc_function(data)))
+
+    def _finish_block(self):
+        if self._partial:
+            self._add_crc(self._partial)
+            self._partial = b""
+        self._block_digests.append(self._block_md5.digest())
+        self._block_md5 = hashlib.md5()
+        self._block_length = 0
+
+    def update(self, data):
+        if self.composite:
+            self._crc = self._crc_function(data, self._crc)
+            return
+        view = memoryview(data)
+        position = 0
+        while position < len(view):
+            block_left = self.block_size - self._block_length
+            if self._partial or len(view) - position < self.bytes_per_crc or block_left < self.bytes_per_crc:
+                # a CRC chunk split across updates
+                take = min(self.bytes_per_crc - len(self._partial), len(view) - position, block_left)
+                self._partial += view[position:position + take].tobytes()
+                if len(self._partial) == self.bytes_per_crc:
+                    self._add_crc(self._partial)
+                    self._partial = b""
+            else:
+                take = min(len(view) - position, block_left)
+                take -= take % self.bytes_per_crc
+                self._block_md5.update(b"".join(struct.pack(">I", self._crc_function(view[i:i + self.bytes_per_crc]))
+                                                for i in range(position, position + take, self.bytes_per_crc)))
+            position += take
+            self._block_length += take
+            if self._block_length == self.block_size:
+                self._finish_block()
+
+    def block_digests(self):
+        """
+        Returns the MD5 of every block, once all the content was added.
+        """
+        if self._block_length:
+            self._finish_block()
+        return self._block_digests
+
+    def hexdigest(self):
+        """
+        Returns the checksum as hex string, once all the content was added.
+        """
+        if self.composite:
+            return "{0:08x}".format(self._crc)
+        return hashlib.md5(b"".join(self.block_digests())).hexdigest()
+
+def _hdfs_style_checksum(local_path, algorithm, bytes_per_crc, block_size, length=None, chunks=None):
+    """
+    Computes the checksum HDFS reports through GETFILECHECKSUM for the content of a local file.
+    :param local_path: file in the local FS
+    :param algorithm: algorithm name returned by GETFILECHECKSUM
+    :param bytes_per_crc: number of bytes covered by a single CRC
+    :param block_size: block size of the HDFS file
+    :param length: only checksums the first `length` bytes of the local file, if set
+    :param chunks: list the content read is appended to, if set
+    :return: checksum as hex string, None if the algorithm is not supported.
+    """
+    try:
+        checksum = _HdfsChecksum(algorithm, bytes_per_crc, block_size)
+    except ValueError:
+        return None
+    read_size = max(bytes_per_crc, (1024 * 1024 // bytes_per_crc) * bytes_per_crc)
+    remaining = float("inf") if length is None else length
+
+    with _METRICS.phase("checksum"), open(local_path, "rb") as local_file:
+        while remaining > 0:
+            chunk = local_file.read(int(min(read_size, remaining)))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            checksum.update(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+    return checksum.hexdigest()
+
+def _local_file_key(local_stat):
+    """
+    Identifies a version of a local file: device, inode, size and modification time in nanoseconds.
+    """
+    mtime = getattr(local_stat, "st_mtime_ns", None) or int(local_stat.st_mtime * 1e9)
+    return local_stat.st_dev, local_stat.st_ino, local_stat.st_size, mtime
+
+class _ChecksumManifest(object):
+    """
+    Persistent SQLite manifest of earlier checksums, so that unchanged files are not hashed on every run.
+    Local checksums are keyed by (device, inode, size, mtime) of the local file and the checksum algorithm.
+    Synced files map a HDFS path to the local file and the length and modification time the HDFS file had
+    when both were known to have the same content.
+    Both tables are held under `max_entries` by evicting the least recently used entries.
+    """
+    def __init__(self, path, max_entries):
+        import sqlite3
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS checksums (device INTEGER, inode INTEGER, size INTEGER, "
+                         "mtime INTEGER, algorithm TEXT, checksum TEXT, last_used REAL, "
+                         "PRIMARY KEY (device, inode, size, mtime, algorithm))")
+        self._db.execute("CREATE TABLE IF NOT EXISTS synced (url TEXT, hdfs_path TEXT, device INTEGER, inode INTEGER, "
+                         "size INTEGER, mtime INTEGER, remote_mtime INTEGER, last_used REAL, "
+                         "PRIMARY KEY (url, hdfs_path))")
+        for table in ("checksums", "synced"):
+            self._evict(table, max_entries)
+
+    def _evict(self, table, max_entries):
+        count = self._db.execute("SELECT COUNT(*) FROM {0}".format(table)).fetchone()[0]
+        if count > max_entries:
+            # evict down to 90% of the cap, so that eviction doesn't run on every call
+            self._db.execute("DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} ORDER BY last_used LIMIT ?)"
+                             .format(table), (count - int(max_entries * 0.9),))
+
+    def checksum(self, local_stat, algorithm):
+        key = _local_file_key(local_stat) + (algorithm,)
+        with self._lock:
+            row = self._db.execute("SELECT checksum FROM checksums WHERE device=? AND inode=? AND size=? AND mtime=? "
+                                   "AND algorithm=?", key).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE checksums SET last_used=? WHERE device=? AND inode=? AND size=? AND mtime=? "
+                                 "AND algorithm=?", (time.time(),) + key)
+        return row[0] if row is not None else None
+
+    def store_checksum(self, local_stat, algorithm, checksum):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             _local_file_key(local_stat) + (algorithm, checksum, time.time()))
+
+    def is_synced(self, url, hdfs_path, local_stat, status):
+        with self._lock:
+            row = self._db.execute("SELECT device, inode, size, mtime, remote_mtime FROM synced "
+                                   "WHERE url=? AND hdfs_path=?", (url, hdfs_path)).fetchone()
+            synced = row is not None and tuple(row[:4]) == _local_file_key(local_stat) and \
+                row[2] == status['length'] and row[4] == status['modificationTime']
+            if synced:
+                self._db.execute("UPDATE synced SET last_used=? WHERE url=? AND hdfs_path=?",
+                                 (time.time(), url, hdfs_path))
+        return synced
+
+    def store_synced(self, url, hdfs_path, local_stat, status):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (url, hdfs_path) + _local_file_key(local_stat) +
+                             (status['modificationTime'], time.time()))
+
+def _open_manifest(path, max_entries=None):
+    """
+    Opens the checksum manifest once per run and path.
+    :param path: path of the SQLite file, None to disable the manifest
+    :param max_entries: maximum number of entries kept in the manifest
+    :return: checksum manifest, or None.
+    """
+    if not path:
+        return None
+    path = os.path.expanduser(path)
+    with _MANIFESTS_LOCK:
+        if path not in _MANIFESTS:
+            _MANIFESTS[path] = _ChecksumManifest(path, max_entries or DEFAULT_MANIFEST_ENTRIES)
+        return _MANIFESTS[path]
+
+def _record_synced(hdfs_client, hdfs_path, local_path, manifest):
+    """
+    Records in the manifest that a HDFS file was just written from a local file, so that the next run can
+    tell the file is unchanged from the metadata alone.
+    """
+    if manifest is not None:
+        manifest.store_synced(hdfs_client.url, hdfs_path, os.stat(local_path), hdfs_client.status(hdfs_path))
+
+def _parse_hdfs_checksum(checksum):
+    """
+    Splits a FileChecksum returned by GETFILECHECKSUM.
+    :param checksum: FileChecksum with algorithm, bytes and length
+    :return: tuple of the algorithm, the bytes per CRC and the checksum as hex string.
+    """
+    algorithm = checksum['algorithm']
+    checksum_bytes = checksum['bytes'].lower()
+    if MD5_MD5_CRC_ALGORITHM.match(algorithm):
+        # bytes: bytes per CRC (int), CRCs per block (long), MD5
+        bytes_per_crc = struct.unpack(">i", bytearray.fromhex(checksum_bytes[:8]))[0]
+        checksum_bytes = checksum_bytes[24:]
+    else:
+        bytes_per_crc = 512
+    return algorithm, bytes_per_crc, checksum_bytes
+
+def _manifest_key(algorithm, bytes_per_crc, block_size):
+    return "{0}/{1}/{2}".format(algorithm, bytes_per_crc, block_size)
+
+def _same_content(hdfs_client, hdfs_path, local_path, status=None, manifest=None, chunks=None):
+    """
+    Checks if a HDFS file has the same content as a local file without reading the HDFS file.
+    Cheapest checks first: the lengths, then the manifest of earlier runs (local file and HDFS modification time
+    unchanged since the files were known to be the same), and finally the checksum computed by HDFS
+    (GETFILECHECKSUM) against the same checksum for the local file. The local checksum is only computed when
+    the manifest doesn't know it yet.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: file in the HDFS
+    :param local_path: file in the local FS
+    :param status: FileStatus of hdfs_path, if already known
+    :param manifest: checksum manifest, if enabled
+    :param chunks: list the content of the local file is appended to when it's read for its checksum, if set
+    :return: True if the content is the same, otherwise False.
+    """
+    status = status or hdfs_client.status(hdfs_path)
+    if status['type'] != 'FILE':
+        raise HdfsError("{0} provided is not file.".format(hdfs_path))
+    local_stat = os.stat(local_path)
+    if status['length'] != local_stat.st_size:
+        return False
+    if status['length'] == 0:
+        return True
+    if manifest is not None and manifest.is_synced(hdfs_client.url, hdfs_path, local_stat, status):
+        return True
+
+    algorithm, bytes_per_crc, checksum_bytes = _parse_hdfs_checksum(hdfs_client.checksum(hdfs_path))
+    _CHECKSUM_PARAMETERS[hdfs_client.url] = (algorithm, bytes_per_crc, status['blockSize'])
+    manifest_key = _manifest_key(algorithm, bytes_per_crc, status['blockSize'])
+    local_checksum = manifest.checksum(local_stat, manifest_key) if manifest is not None else None
+    if local_checksum is None:
+        crc_type = algorithm.split("-")[-1]
+        if crc_type.endswith("CRC32C") and not HAS_CRC32C and status['length'] > PURE_PYTHON_CRC32C_LIMIT:
+            return str(_checksum_from_hdfs_file(hdfs_client, hdfs_path)) == str(_checksum_from_local_file(local_path))
+        local_checksum = _hdfs_style_checksum(local_path, algorithm, bytes_per_crc, status['blockSize'],
+                                              chunks=chunks)
+        if local_checksum is None:
+            return str(_checksum_from_hdfs_file(hdfs_client, hdfs_path)) == str(_checksum_from_local_file(local_path))
+        if manifest is not None:
+            manifest.store_checksum(local_stat, manifest_key, local_checksum)
+
+    same = local_checksum == checksum_bytes
+    if same and manifest is not None:
+        manifest.store_synced(hdfs_client.url, hdfs_path, local_stat, status)
+    return same
+
+def _list_directory(hdfs_client, hdfs_path):
+    """
+    Lists a HDFS directory page by page with LISTSTATUS_BATCH, so that huge directories are never held in memory.
+    Falls back to a single LISTSTATUS on clusters that don't support LISTSTATUS_BATCH.
+    Pages are not cached, but a listing that is already in the metadata cache is used instead.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS directory
+    :return: generator of (name, FileStatus) tuples.
+    """
+    listing = hdfs_client.cached_listing(hdfs_path) if hasattr(hdfs_client, "cached_listing") else None
+    if listing is not None:
+        for entry in listing:
+            yield entry
+        return
+    if hdfs_client.url in _NO_BATCH_LISTING:
+        for entry in hdfs_client.list(hdfs_path, status=True):
+            yield entry
+        return
+    start_after = ""
+    while True:
+        try:
+            listing = _list_status_batch(hdfs_client, hdfs_path, startAfter=start_after).json()["DirectoryListing"]
+        except HdfsError as e:
+            if start_after or getattr(e, "exception", None) not in ("IllegalArgumentException",
+                                                                     "UnsupportedOperationException"):
+                raise
+            _NO_BATCH_LISTING.add(hdfs_client.url)
+            for entry in hdfs_client.list(hdfs_path, status=True):
+                yield entry
+            return
+        statuses = listing["partialListing"]["FileStatuses"]["FileStatus"]
+        for status in statuses:
+            yield status["pathSuffix"], status
+        if not statuses or not listing["remainingEntries"]:
+            return
+        start_after = statuses[-1]["pathSuffix"]
+
+def _walk_tree(hdfs_client, hdfs_path, max_depth=0):
+    """
+    Walks all the files and directories below a HDFS directory, one directory listing at a time.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS directory
+    :param max_depth: maximum depth to walk, 1 for the entries of the directory only and 0 for no limit.
+    :return: generator of (path, FileStatus) tuples, not including hdfs_path itself.
+    """
+    directories = [(hdfs_path.rstrip("/") or "/", 1)]
+    while directories:
+        directory, depth = directories.pop()
+        for name, status in _list_directory(hdfs_client, directory):
+            path = os.path.join(directory, name)
+            if status["type"] == "DIRECTORY" and (not max_depth or depth < max_depth):
+                directories.append((path, depth + 1))
+            yield path, status
+
+class _ChangePlan(object):
+    """
+    Operations a run would perform, recorded instead of performed in check mode.
+    """
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def record(self, operation, hdfs_path, **details):
+        details.update(operation=operation, path=hdfs_path)
+        with self._lock:
+            self.entries.append(details)
+
+def _is_check_mode(module):
+    return getattr(module, "check_mode", False) is True
+
+def _planned(module, operation, hdfs_path, **details):
+    """
+    In check mode, records an operation in the change plan of the run instead of performing it.
+    :param module: Ansible module
+    :param operation: name of the operation, e.g. "upload" or "set_owner"
+    :param hdfs_path: HDFS path, or local path of local operations
+    :param details: arguments of the operation and why it's needed
+    :return: True if the operation must not be performed, False if it has to be performed.
+    """
+    if not _is_check_mode(module):
+        return False
+    plan = getattr(module, "plan", None)
+    if isinstance(plan, _ChangePlan):
+        plan.record(operation, hdfs_path, **details)
+    return True
+
+def _update_tree(module, hdfs_client, hdfs_path, needs_update, update, parallelism):
+    """
+    Updates every file and directory below a HDFS directory that doesn't match yet.
+    Matching entries are skipped based on the FileStatus returned by the listing,
+    the remaining updates are spread over at most `parallelism` threads.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS directory
+    :param needs_update: function taking a FileStatus, returns True if the path has to be updated
+    :param update: function taking a HDFS path, updates the path
+    :param parallelism: maximum number of concurrent updates
+    :return: number of updated paths.
+    """
+    paths = (path for path, status in _walk_tree(hdfs_client, hdfs_path) if needs_update(status))
+    try:
+        return _run_streaming(parallelism, update, paths)
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_path, msg="{0}".format(e))
+
+def change_owner(module, hdfs_client, hdfs_path=None, owner=None, recurse=False, parallelism=1):
     """
     Sets the owner of an HDFS file or directory.
     :param module: Ansible module
     :param hdfs_client: HDFS client
     :param hdfs_path: HDFS path
     :param owner: owner
+    :param recurse: if recurse is set to True, it also sets the owner of everything below the directory.
+    :param parallelism: maximum number of concurrent requests when recurse is set
     :return: False if the owner of the HDFS file or directory is not changed, otherwise it returns True.
     """
     if hdfs_path is None:
@@ -191,24 +1170,35 @@ def change_owner(module, hdfs_client, hdfs_path=None, owner=None):
         module.fail_json(path=owner, msg="owner should not be empty.")
 
     if _path_exists(module, hdfs_client, hdfs_path):
-        current_owner = hdfs_client.status(hdfs_path)["owner"]
+        status = hdfs_client.status(hdfs_path)
+        current_owner = status["owner"]
         if current_owner != owner:
-            hdfs_client.set_owner(hdfs_path, owner=owner)
+            if not _planned(module, "set_owner", hdfs_path, owner=owner):
+                hdfs_client.set_owner(hdfs_path, owner=owner)
             changed = True
         else:
             changed = False
 
-        return {'current': current_owner, 'new': owner, 'changed': changed}
+        updated = 0
+        if recurse and status["type"] == "DIRECTORY":
+            updated = _update_tree(module, hdfs_client, hdfs_path,
+                                   lambda file_status: file_status["owner"] != owner,
+                                   lambda path: _planned(module, "set_owner", path, owner=owner) or
+                                   hdfs_client.set_owner(path, owner=owner),
+                                   parallelism)
+        return {'current': current_owner, 'new': owner, 'changed': changed or updated > 0, 'updated': updated}
     else:
         module.fail_json(path=hdfs_path, msg="{0} - path doesn't exist".format(hdfs_path))
 
-def change_permission(module, hdfs_client, hdfs_path=None, permission=None):
+def change_permission(module, hdfs_client, hdfs_path=None, permission=None, recurse=False, parallelism=1):
     """
     Sets the permissions of an HDFS file or directory.
     :param module: Ansible module
     :param hdfs_client: HDFS client
     :param hdfs_path: HDFS path
     :param permission: permission (in octal string)
+    :param recurse: if recurse is set to True, it also sets the permissions of everything below the directory.
+    :param parallelism: maximum number of concurrent requests when recurse is set
     :return: False if the permission of the HDFS file or directory is not changed, otherwise it returns True.
     """
     if hdfs_path is None:
@@ -217,28 +1207,41 @@ def change_permission(module, hdfs_client, hdfs_path=None, permission=None):
         module.fail_json(path=permission, msg="permission should not be empty.")
 
     if _path_exists(module, hdfs_client, hdfs_path):
-        current_permission = hdfs_client.status(hdfs_path)["permission"]
+        status = hdfs_client.status(hdfs_path)
+        current_permission = status["permission"]
         regex = r"(^[0-7]{3}$)"
         permission = permission[1:] if permission.startswith('0') else permission
         if re.search(regex, permission):
             if current_permission != permission:
-                hdfs_client.set_permission(hdfs_path, permission=permission)
+                if not _planned(module, "set_permission", hdfs_path, permission=permission):
+                    hdfs_client.set_permission(hdfs_path, permission=permission)
                 changed = True
             else:
                 changed = False
-            return {'current': "0"+current_permission, 'new': "0"+permission, 'changed': changed}
+
+            updated = 0
+            if recurse and status["type"] == "DIRECTORY":
+                updated = _update_tree(module, hdfs_client, hdfs_path,
+                                       lambda file_status: file_status["permission"] != permission,
+                                       lambda path: _planned(module, "set_permission", path, permission=permission) or
+                                       hdfs_client.set_permission(path, permission=permission),
+                                       parallelism)
+            return {'current': "0"+current_permission, 'new': "0"+permission, 'changed': changed or updated > 0,
+                    'updated': updated}
         else:
             module.fail_json(path=hdfs_path, msg="mode '{0}' does not match the expected pattern.".format(permission))
     else:
         module.fail_json(path=hdfs_path, msg="{0} - path doesn't exist".format(hdfs_path))
 
-def change_group(module, hdfs_client, hdfs_path=None, group=None):
+def change_group(module, hdfs_client, hdfs_path=None, group=None, recurse=False, parallelism=1):
     """
     Sets the group of an HDFS file or directory.
     :param module: Ansible module
     :param hdfs_client: HDFS client
     :param hdfs_path: HDFS path
     :param group: group
+    :param recurse: if recurse is set to True, it also sets the group of everything below the directory.
+    :param parallelism: maximum number of concurrent requests when recurse is set
     :return: False if the group of the HDFS file or directory is not changed, otherwise it returns True.
     """
     if hdfs_path is None:
@@ -247,67 +1250,958 @@ def change_group(module, hdfs_client, hdfs_path=None, group=None):
         module.fail_json(path=group, msg="group should not be empty.")
 
     if _path_exists(module, hdfs_client, hdfs_path):
-        current_group = hdfs_client.status(hdfs_path)["group"]
+        status = hdfs_client.status(hdfs_path)
+        current_group = status["group"]
         if current_group != group:
-            hdfs_client.set_owner(hdfs_path, group=group)
+            if not _planned(module, "set_owner", hdfs_path, group=group):
+                hdfs_client.set_owner(hdfs_path, group=group)
             changed = True
         else:
             changed = False
 
-        return {'current': current_group, 'new': group, 'changed': changed}
+        updated = 0
+        if recurse and status["type"] == "DIRECTORY":
+            updated = _update_tree(module, hdfs_client, hdfs_path,
+                                   lambda file_status: file_status["group"] != group,
+                                   lambda path: _planned(module, "set_owner", path, group=group) or
+                                   hdfs_client.set_owner(path, group=group),
+                                   parallelism)
+        return {'current': current_group, 'new': group, 'changed': changed or updated > 0, 'updated': updated}
     else:
         module.fail_json(path=hdfs_path, msg="{0} - path doesn't exist".format(hdfs_path))
 
-def upload_localfile(module, hdfs_client, hdfs_path=None, local_path=None):
+def _parse_quantity(value, units, name):
     """
-    Uploads a local file in the HDFS directory. It checks if the file exists or not in the hdfs_path.
-    If it doesn't exist, then uploads the file. If the file exists, then it checks if the content has changed.
-    If the content hasn't changed, then it doesn't uploads the file. If the content has changed, overwrites the existing file.
+    Parses a number with an optional unit suffix, e.g. "7d" or "10m".
+    :param value: value to parse
+    :param units: dictionary of unit suffix to multiplier, the empty suffix is the default unit
+    :param name: option name used in the error message
+    :return: the value in the base unit.
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]?)\s*$", str(value))
+    if not match or match.group(2).lower() not in units:
+        raise ValueError("{0} should be a number with one of the units {1}, got: {2}"
+                         .format(name, ", ".join(sorted(unit for unit in units if unit)), value))
+    return float(match.group(1)) * units[match.group(2).lower()]
+
+def _path_filter(params):
+    """
+    Builds the predicate used by "ls", "find" and "rm" to select paths from their FileStatus.
+    :param params: module parameters with the filter options
+    :return: function taking a path and its FileStatus, returns True if the path is selected.
+    """
+    now = time.time() * 1000
+    age_units = dict(AGE_UNITS)
+    size_units = dict(SIZE_UNITS)
+    older_than = params.get("older_than")
+    newer_than = params.get("newer_than")
+    larger_than = params.get("larger_than")
+    smaller_than = params.get("smaller_than")
+    conditions = []
+    if params.get("pattern"):
+        patterns = [params["pattern"]] if not isinstance(params["pattern"], list) else params["pattern"]
+        conditions.append(lambda path, status: any(fnmatch.fnmatchcase(os.path.basename(path), pattern)
+                                                   for pattern in patterns))
+    if params.get("regex"):
+        regex = re.compile(params["regex"])
+        conditions.append(lambda path, status: regex.search(path) is not None)
+    if params.get("file_type"):
+        file_type = params["file_type"].upper()
+        conditions.append(lambda path, status: status["type"] == file_type)
+    if older_than is not None:
+        older_than = now - _parse_quantity(older_than, age_units, "older_than") * 1000
+        conditions.append(lambda path, status: status["modificationTime"] < older_than)
+    if newer_than is not None:
+        newer_than = now - _parse_quantity(newer_than, age_units, "newer_than") * 1000
+        conditions.append(lambda path, status: status["modificationTime"] >= newer_than)
+    if larger_than is not None:
+        larger_than = _parse_quantity(larger_than, size_units, "larger_than")
+        conditions.append(lambda path, status: status["type"] == "FILE" and status["length"] > larger_than)
+    if smaller_than is not None:
+        smaller_than = _parse_quantity(smaller_than, size_units, "smaller_than")
+        conditions.append(lambda path, status: status["type"] == "FILE" and status["length"] < smaller_than)
+    if params.get("owner"):
+        conditions.append(lambda path, status: status["owner"] == params["owner"])
+    if params.get("group"):
+        conditions.append(lambda path, status: status["group"] == params["group"])
+    return lambda path, status: all(condition(path, status) for condition in conditions)
+
+def find_paths(module, hdfs_client, hdfs_path=None, max_depth=0, matches=None, include_root=True, count_only=False,
+               output_file=None):
+    """
+    Lists the files and directories below a HDFS path, one LISTSTATUS_BATCH page at a time.
+    Only the matching entries are kept, and with count_only or output_file not even those,
+    so memory stays bounded whatever the size of the tree.
     :param module: Ansible module
     :param hdfs_client: HDFS client
     :param hdfs_path: HDFS path
-    :param local_path: local file path
-    :return: False if the uploaded operation is not successful, otherwise it returns the HDFS path..
+    :param max_depth: maximum depth below the path, 0 for no limit
+    :param matches: function taking a path and its FileStatus, returns True for the entries to return
+    :param include_root: if include_root is set to True, the path itself is returned as well when it matches.
+    :param count_only: if count_only is set to True, only the counts are returned.
+    :param output_file: local file the entries are written to as JSON lines, instead of being returned. In check
+                        mode the write is only recorded in the change plan.
+    :return: dictionary with the counts of matching files, directories and bytes, and the entries.
     """
     if hdfs_path is None:
         module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
-    if local_path is None:
-        module.fail_json(path=local_path, msg="local path should not be empty.")
+    matches = matches or (lambda path, status: True)
 
-    local_file_status = os.path.isfile(local_path)
-    hdfs_dir_status = hdfs_client.status(hdfs_path, strict=False)
+    status = hdfs_client.status(hdfs_path, strict=False)
+    if status is None:
+        module.fail_json(path=hdfs_path, msg="{0} - path doesn't exist".format(hdfs_path))
+    hdfs_path = hdfs_path.rstrip("/") or "/"
+    entries = [(hdfs_path, status)] if include_root or status["type"] == "FILE" else []
+    if status["type"] == "DIRECTORY":
+        entries = itertools.chain(entries, _walk_tree(hdfs_client, hdfs_path, max_depth=max_depth))
 
-    if hdfs_dir_status is not None and hdfs_dir_status['type'] == 'DIRECTORY' and local_file_status is True:
-        file_name = local_path.split("/")[-1]
-        files_list = hdfs_client.list(hdfs_path)
-        if file_name not in files_list:
-            try:
-                hdfs_client.upload(hdfs_path=hdfs_path, local_path=local_path)
-                return True
-            except (HdfsError, Exception) as e:
-                module.fail_json(path=hdfs_path, local_path=local_path, msg="{0}".format(e))
-        else:
-            hdfs_file_path = os.path.join(hdfs_path, file_name)
-            checksum_hdfs_file = _checksum_from_hdfs_file(hdfs_client, hdfs_file_path)
-            checksum_local_file = _checksum_from_local_file(local_path)
-            if str(checksum_hdfs_file) == str(checksum_local_file):
-                module.exit_json(changed=False,
-                                 local_path=local_path,
-                                 path=hdfs_file_path,
-                                 msg="content of the local file and the file in HDFS is same. Skipping upload.")
+    summary = {'count': 0, 'files': 0, 'directories': 0, 'bytes': 0}
+    collected = []
+    output = open(output_file, "w") if output_file and not _is_check_mode(module) else None
+    try:
+        for path, file_status in entries:
+            if not matches(path, file_status):
+                continue
+            summary['count'] += 1
+            if file_status["type"] == "DIRECTORY":
+                summary['directories'] += 1
             else:
-                try:
-                    hdfs_client.upload(hdfs_path=hdfs_path, local_path=local_path, overwrite=True)
-                    module.exit_json(changed=True,
-                                     local_path=local_path,
-                                     path=hdfs_file_path,
-                                     msg="content of the local file and the file in HDFS is different. Overwriting the file.")
-                    return True
-                except (HdfsError, Exception) as e:
-                    module.fail_json(path=hdfs_path, msg="{0}".format(e))
-    else:
-        module.fail_json(path=hdfs_path, local_path=local_path,
-                         msg="either HDFS path provided is not a directory or local file provided is not a file.")
+                summary['files'] += 1
+                summary['bytes'] += file_status["length"]
+            if count_only:
+                continue
+            entry = dict((key, value) for key, value in file_status.items() if key != "pathSuffix")
+            entry["path"] = path
+            if output is not None:
+                output.write(json.dumps(entry, sort_keys=True) + "\n")
+            elif not output_file:
+                collected.append(entry)
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_path, msg="{0}".format(e))
+    finally:
+        if output is not None:
+            output.close()
+    if output_file and output is None:
+        _planned(module, "write_output", output_file, entries=0 if count_only else summary['count'])
+    if not count_only and not output_file:
+        summary['entries'] = collected
+    return summary
+
+def _write_file(hdfs_client, hdfs_path, local_path, overwrite=False, journal_dir=None, chunk_size=None, parts=None,
+                block_size=None, data=None):
+    """
+    Streams a local file to a HDFS file path, without listing the target directory first.
+    An existing file is replaced only once the new content is completely written to a temporary file next to it.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param overwrite: if overwrite is set to True, an existing file is replaced.
+    :param journal_dir: local directory of the upload journals, makes the upload resumable if set
+    :param chunk_size: number of bytes written per request by a resumable upload
+    :param parts: number of parts uploaded at the same time by a parallel upload, if set
+    :param block_size: block size of the files written by a parallel upload
+    :param data: content of the local file already read, as a list of chunks, uploaded instead of reading the file
+    """
+    if journal_dir is not None:
+        return _write_file_resumable(hdfs_client, hdfs_path, local_path, overwrite=overwrite,
+                                     journal_dir=journal_dir, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+    if parts and parts > 1 and os.path.getsize(local_path) > (block_size or DEFAULT_BLOCK_SIZE):
+        return _write_file_parallel(hdfs_client, hdfs_path, local_path, overwrite=overwrite, parts=parts,
+                                    block_size=block_size or DEFAULT_BLOCK_SIZE)
+    target_path = hdfs_path
+    if overwrite:
+        target_path = "{0}.temp-{1}".format(hdfs_path, int(time.time() * 1e6))
+    try:
+        if data is not None:
+            hdfs_client.write(target_path, data=iter(data))
+        else:
+            with open(local_path, "rb") as reader:
+                hdfs_client.write(target_path, data=reader)
+        if overwrite:
+            _replace_file(hdfs_client, target_path, hdfs_path)
+    except Exception:
+        if overwrite:
+            _cleanup(hdfs_client.delete, target_path)
+        raise
+
+def _replace_file(hdfs_client, temp_path, hdfs_path):
+    """
+    Moves a completely written temporary file over a HDFS file. The existing file is renamed aside first and only
+    deleted once the new file is in place, and it's renamed back if the new file can't be moved in.
+    :param hdfs_client: HDFS client
+    :param temp_path: temporary HDFS file with the new content
+    :param hdfs_path: HDFS file path
+    """
+    old_path = "{0}.old-{1}".format(hdfs_path, int(time.time() * 1e6))
+    try:
+        hdfs_client.rename(hdfs_path, old_path)
+    except HdfsError:
+        if hdfs_client.status(hdfs_path, strict=False) is not None:
+            raise
+        # deleted in the meantime, there is nothing to keep
+        old_path = None
+    try:
+        hdfs_client.rename(temp_path, hdfs_path)
+    except Exception:
+        if old_path is not None:
+            _cleanup(hdfs_client.rename, old_path, hdfs_path)
+        raise
+    if old_path is not None:
+        hdfs_client.delete(old_path)
+
+def _cleanup(func, *args, **kwargs):
+    """
+    Runs a cleanup step after a failure. Its own errors are ignored, so that the original error is raised.
+    """
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        pass
+
+def _write_file_parallel(hdfs_client, hdfs_path, local_path, overwrite=False, parts=2,
+                         block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Uploads block aligned ranges of a local file concurrently as temporary part files next to the HDFS path,
+    so that a single large file is written through several DataNode streams. The parts are joined with CONCAT
+    into the first one, which is then renamed into place.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param overwrite: if overwrite is set to True, an existing file is replaced.
+    :param parts: maximum number of parts uploaded at the same time
+    :param block_size: block size of the parts, every part but the last is a multiple of it as CONCAT requires
+    """
+    size = os.path.getsize(local_path)
+    blocks = (size + block_size - 1) // block_size
+    part_size = ((blocks + parts - 1) // parts) * block_size
+    temp_path = "{0}.temp-{1}".format(hdfs_path, int(time.time() * 1e6))
+    ranges = [("{0}.part-{1:05d}".format(temp_path, index), offset, min(part_size, size - offset))
+              for index, offset in enumerate(range(0, size, part_size))]
+
+    def _upload_part(part):
+        part_path, offset, length = part
+        with open(local_path, "rb") as reader:
+            reader.seek(offset)
+            hdfs_client.write(part_path, data=_read_range(reader, length), overwrite=True, blocksize=block_size)
+
+    try:
+        _run_concurrently(parts, _upload_part, ranges)
+        if len(ranges) > 1:
+            _concat(hdfs_client, ranges[0][0], sources=",".join(part[0] for part in ranges[1:]))
+        if overwrite:
+            _replace_file(hdfs_client, ranges[0][0], hdfs_path)
+        else:
+            hdfs_client.rename(ranges[0][0], hdfs_path)
+    except Exception:
+        for part in ranges:
+            _cleanup(hdfs_client.delete, part[0])
+        raise
+
+def _pipelined_read(reader, checksum=None, chunk_size=PIPELINE_CHUNK_SIZE):
+    """
+    Reads a file in a background thread one chunk ahead of the consumer, so that reading the next chunk from disk
+    overlaps with sending the current one, and adds every chunk to a checksum on the way.
+    :param reader: file object
+    :param checksum: _HdfsChecksum to update, if any
+    :param chunk_size: number of bytes per chunk
+    :return: generator of chunks.
+    """
+    chunks = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _read():
+        try:
+            while not stop.is_set():
+                chunk = reader.read(chunk_size)
+                if chunk and checksum is not None:
+                    checksum.update(chunk)
+                _put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            _put(e)
+
+    thread = threading.Thread(target=_read)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        stop.set()
+
+def _fast_checksum(parameters):
+    """
+    Returns an incremental checksum for (algorithm, bytes per CRC, block size), None if the algorithm is not
+    supported or the checksum would slow the upload down (CRC32C without the crc32c package).
+    """
+    try:
+        checksum = _HdfsChecksum(*parameters)
+    except ValueError:
+        return None
+    if checksum.crc_type == "CRC32C" and not HAS_CRC32C:
+        return None
+    return checksum
+
+def _write_hashed(hdfs_client, hdfs_path, local_path, checksum, status=None, manifest=None):
+    """
+    Uploads a local file while computing its checksum, so that the file is read only once. Once uploaded, the
+    checksum is compared with the one HDFS computed for the new file and kept in the manifest.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param checksum: _HdfsChecksum computed on the way
+    :param status: FileStatus of the existing HDFS file, None for a new file
+    :param manifest: checksum manifest, if enabled
+    :return: True, the HDFS file is written.
+    """
+    local_stat = os.stat(local_path)
+    target_path = hdfs_path
+    if status is not None:
+        target_path = "{0}.temp-{1}".format(hdfs_path, int(time.time() * 1e6))
+    try:
+        with open(local_path, "rb") as reader:
+            hdfs_client.write(target_path, data=_pipelined_read(reader, checksum))
+        if status is not None:
+            _replace_file(hdfs_client, target_path, hdfs_path)
+    except Exception:
+        if status is not None:
+            _cleanup(hdfs_client.delete, target_path)
+        raise
+    local_checksum = checksum.hexdigest()
+
+    if manifest is not None and local_stat.st_size > 0:
+        new_status = hdfs_client.status(hdfs_path)
+        algorithm, bytes_per_crc, checksum_bytes = _parse_hdfs_checksum(hdfs_client.checksum(hdfs_path))
+        _CHECKSUM_PARAMETERS[hdfs_client.url] = (algorithm, bytes_per_crc, new_status['blockSize'])
+        if checksum.computes(algorithm, bytes_per_crc, new_status['blockSize']):
+            if local_checksum != checksum_bytes:
+                raise HdfsError("checksum of {0} doesn't match {1} after the upload.".format(hdfs_path, local_path))
+            manifest.store_checksum(local_stat, _manifest_key(algorithm, bytes_per_crc, new_status['blockSize']),
+                                    local_checksum)
+    _record_synced(hdfs_client, hdfs_path, local_path, manifest)
+    return True
+
+def _plan_upload(module, hdfs_client, hdfs_path, local_path, status=None, manifest=None):
+    """
+    Records the upload of a local file in the change plan, if the metadata or, when the metadata can't tell,
+    the checksums show that the HDFS file doesn't have the same content.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param status: FileStatus of the existing HDFS file, None for a new file
+    :param manifest: checksum manifest, if enabled
+    :return: True if the file would be uploaded, False if the HDFS file has the same content.
+    """
+    size = os.path.getsize(local_path)
+    if status is None:
+        reason = "missing"
+    elif status['type'] == 'FILE' and status['length'] != size:
+        reason = "size"
+    elif _same_content(hdfs_client, hdfs_path, local_path, status, manifest):
+        return False
+    else:
+        reason = "checksum"
+    return _planned(module, "upload", hdfs_path, local_path=local_path, bytes=size, reason=reason)
+
+def _upload_file(hdfs_client, hdfs_path, local_path, status=None, manifest=None, write_options=None):
+    """
+    Uploads a local file to a HDFS file path unless the HDFS file has the same content.
+    An existing file is compared by checksum before anything is sent, so that an unchanged file with a new
+    modification time, e.g. a rebuilt artifact, is never transferred. A changed file of up to COMPARE_BUFFER_SIZE
+    bytes is uploaded from the content read for the comparison, larger ones are read again. With a manifest, the
+    files whose local checksum wasn't computed by the comparison, new files and files of another length, are hashed
+    on the way, so that later runs don't have to read them for the comparison. Resumable and parallel uploads are
+    not hashed.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param status: FileStatus of the existing HDFS file, None for a new file
+    :param manifest: checksum manifest, if enabled
+    :param write_options: keyword arguments of _write_file
+    :return: True if the file was uploaded, False if the HDFS file has the same content.
+    """
+    chunks = [] if status is not None and not write_options and status['length'] <= COMPARE_BUFFER_SIZE else None
+    if status is not None and _same_content(hdfs_client, hdfs_path, local_path, status, manifest, chunks=chunks):
+        return False
+    if chunks and sum(len(chunk) for chunk in chunks) == status['length']:
+        # the content read for the comparison is sent, the local file isn't read again
+        _write_file(hdfs_client, hdfs_path, local_path, overwrite=True, data=chunks)
+        _record_synced(hdfs_client, hdfs_path, local_path, manifest)
+        return True
+    if not write_options and manifest is not None and \
+            (status is None or status['length'] != os.path.getsize(local_path)):
+        checksum = _fast_checksum(_CHECKSUM_PARAMETERS.get(hdfs_client.url, DEFAULT_CHECKSUM_PARAMETERS))
+        if checksum is not None:
+            return _write_hashed(hdfs_client, hdfs_path, local_path, checksum, status=status, manifest=manifest)
+    _write_file(hdfs_client, hdfs_path, local_path, overwrite=status is not None, **(write_options or {}))
+    _record_synced(hdfs_client, hdfs_path, local_path, manifest)
+    return True
+
+def _journal_file(journal_dir, hdfs_client, hdfs_path):
+    """
+    Returns the path of the local journal of an upload to a HDFS path.
+    """
+    key = "{0}{1}".format(hdfs_client.url, hdfs_path).encode("utf-8")
+    return os.path.join(os.path.expanduser(journal_dir), "{0}.json".format(hashlib.sha1(key).hexdigest()))
+
+def _load_journal(journal_file):
+    try:
+        with open(journal_file) as reader:
+            return json.load(reader)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _save_journal(journal_file, journal):
+    directory = os.path.dirname(journal_file)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(journal_file + ".tmp", "w") as writer:
+        json.dump(journal, writer)
+    os.rename(journal_file + ".tmp", journal_file)
+
+def _read_range(reader, length, piece_size=64 * 1024):
+    """
+    Yields the next `length` bytes of a file in pieces, so that a chunk is streamed without holding it in memory.
+    """
+    while length > 0:
+        piece = reader.read(min(piece_size, length))
+        if not piece:
+            break
+        length -= len(piece)
+        yield piece
+
+def _verified_length(hdfs_client, hdfs_path, local_path):
+    """
+    Returns the length of a partially uploaded HDFS file if its content is the same as the start of the local
+    file, comparing the checksum HDFS computes for the file with the same checksum of the local prefix.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: partially uploaded HDFS file
+    :param local_path: local file being uploaded
+    :return: number of bytes already uploaded, None if the upload has to start again.
+    """
+    status = hdfs_client.status(hdfs_path, strict=False)
+    if status is None or status['type'] != 'FILE' or status['length'] > os.path.getsize(local_path):
+        return None
+    if status['length'] == 0:
+        return 0
+    algorithm, bytes_per_crc, checksum_bytes = _parse_hdfs_checksum(hdfs_client.checksum(hdfs_path))
+    local_checksum = _hdfs_style_checksum(local_path, algorithm, bytes_per_crc, status['blockSize'],
+                                          length=status['length'])
+    return status['length'] if local_checksum == checksum_bytes else None
+
+def _write_file_resumable(hdfs_client, hdfs_path, local_path, overwrite=False, journal_dir=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Uploads a local file in chunks, one CREATE followed by one APPEND per chunk, to a temporary file that is
+    renamed into place at the end. A local journal remembers the temporary file and the local file version, so
+    that after a failure the next run continues after the part already in HDFS, once its checksum is verified.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param overwrite: if overwrite is set to True, an existing file is replaced.
+    :param journal_dir: local directory of the upload journals
+    :param chunk_size: number of bytes written per request
+    """
+    journal_file = _journal_file(journal_dir, hdfs_client, hdfs_path)
+    local_key = list(_local_file_key(os.stat(local_path)))
+    journal = _load_journal(journal_file)
+    offset = None
+    if journal is not None and journal['local'] == local_key:
+        offset = _verified_length(hdfs_client, journal['temp_path'], local_path)
+    else:
+        if journal is not None:
+            # part of an older version of the local file
+            hdfs_client.delete(journal['temp_path'])
+        journal = {'path': hdfs_path, 'local': local_key,
+                   'temp_path': "{0}.temp-{1}".format(hdfs_path, int(time.time() * 1e6))}
+    temp_path = journal['temp_path']
+
+    with open(local_path, "rb") as reader:
+        if offset is None:
+            journal['offset'] = 0
+            _save_journal(journal_file, journal)
+            hdfs_client.write(temp_path, data=_read_range(reader, chunk_size), overwrite=True)
+            offset = reader.tell()
+        else:
+            reader.seek(offset)
+        while offset < local_key[2]:
+            journal['offset'] = offset
+            _save_journal(journal_file, journal)
+            hdfs_client.write(temp_path, data=_read_range(reader, chunk_size), append=True)
+            offset = reader.tell()
+
+    if overwrite:
+        _replace_file(hdfs_client, temp_path, hdfs_path)
+    else:
+        hdfs_client.rename(temp_path, hdfs_path)
+    os.remove(journal_file)
+
+def upload_localfile(module, hdfs_client, hdfs_path=None, local_path=None, manifest=None, write_options=None):
+    """
+    Uploads a local file in the HDFS directory. It checks if the file exists or not in the hdfs_path.
+    If it doesn't exist, then uploads the file. If the file exists, then it checks if the content has changed.
+    If the content hasn't changed, then it doesn't uploads the file. If the content has changed, overwrites the existing file.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path
+    :param local_path: local file path
+    :param manifest: checksum manifest of earlier runs, if enabled
+    :param write_options: keyword arguments of _write_file, e.g. journal_dir and chunk_size of resumable uploads
+    :return: False if the uploaded operation is not successful, otherwise it returns the HDFS path..
+    """
+    if hdfs_path is None:
+        module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
+    if local_path is None:
+        module.fail_json(path=local_path, msg="local path should not be empty.")
+
+    local_file_status = os.path.isfile(local_path)
+    hdfs_dir_status = hdfs_client.status(hdfs_path, strict=False)
+
+    if hdfs_dir_status is not None and hdfs_dir_status['type'] == 'DIRECTORY' and local_file_status is True:
+        file_name = local_path.split("/")[-1]
+        hdfs_file_path = os.path.join(hdfs_path, file_name)
+        hdfs_file_status = hdfs_client.status(hdfs_file_path, strict=False)
+        if hdfs_file_status is None:
+            try:
+                if _is_check_mode(module):
+                    return _plan_upload(module, hdfs_client, hdfs_file_path, local_path)
+                return _upload_file(hdfs_client, hdfs_file_path, local_path, manifest=manifest,
+                                    write_options=write_options)
+            except (HdfsError, Exception) as e:
+                module.fail_json(path=hdfs_path, local_path=local_path, msg="{0}".format(e))
+        else:
+            try:
+                if _is_check_mode(module):
+                    uploaded = _plan_upload(module, hdfs_client, hdfs_file_path, local_path, status=hdfs_file_status,
+                                            manifest=manifest)
+                else:
+                    uploaded = _upload_file(hdfs_client, hdfs_file_path, local_path, status=hdfs_file_status,
+                                            manifest=manifest, write_options=write_options)
+            except (HdfsError, Exception) as e:
+                module.fail_json(path=hdfs_path, msg="{0}".format(e))
+            if not uploaded:
+                module.exit_json(changed=False,
+                                 local_path=local_path,
+                                 path=hdfs_file_path,
+                                 msg="content of the local file and the file in HDFS is same. Skipping upload.")
+            else:
+                module.exit_json(changed=True,
+                                 local_path=local_path,
+                                 path=hdfs_file_path,
+                                 msg="content of the local file and the file in HDFS is different. Overwriting the file.")
+                return True
+    else:
+        module.fail_json(path=hdfs_path, local_path=local_path,
+                         msg="either HDFS path provided is not a directory or local file provided is not a file.")
+
+def _remote_tree(module, hdfs_client, hdfs_path):
+    """
+    Collects the FileStatus of everything below a HDFS directory, keyed by the path relative to the directory.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS directory
+    :return: dictionary of relative path to FileStatus, empty if the directory doesn't exist.
+    """
+    status = hdfs_client.status(hdfs_path, strict=False)
+    if status is None:
+        return {}
+    if status['type'] != 'DIRECTORY':
+        module.fail_json(path=hdfs_path, msg="{0} already exists and is not a directory.".format(hdfs_path))
+    offset = len(hdfs_path.rstrip("/")) + 1
+    return dict((path[offset:], file_status) for path, file_status in _walk_tree(hdfs_client, hdfs_path))
+
+def upload_localdir(module, hdfs_client, hdfs_path=None, local_path=None, parallelism=1, max_bytes_in_flight=None,
+                    manifest=None, write_options=None):
+    """
+    Mirrors a local directory into the HDFS directory, e.g. /home/sayed/conf is uploaded to <hdfs_path>/conf.
+    Files that don't exist in HDFS or whose content has changed are uploaded concurrently, up to `parallelism`
+    files and `max_bytes_in_flight` bytes at a time. Missing directories are created in one batch beforehand.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path
+    :param local_path: local directory path
+    :param parallelism: maximum number of files uploaded at the same time
+    :param max_bytes_in_flight: maximum number of bytes uploaded at the same time
+    :param manifest: checksum manifest of earlier runs, if enabled
+    :param write_options: keyword arguments of _write_file, e.g. journal_dir and chunk_size of resumable uploads
+    :return: dictionary with the number of uploaded and unchanged files, the uploaded bytes and created directories.
+    """
+    return sync_localdir(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path, checksum=True,
+                         preserve_times=False, parallelism=parallelism, max_bytes_in_flight=max_bytes_in_flight,
+                         manifest=manifest, write_options=write_options)
+
+def _extra_paths(remote, local_paths):
+    """
+    Finds the HDFS paths that don't exist locally, only the top-most of a tree that doesn't exist locally.
+    :param remote: dictionary of relative path to FileStatus of the HDFS tree
+    :param local_paths: relative paths of the local files and directories
+    :return: dictionary of relative path to the number of bytes below the path.
+    """
+    extras = {}
+    for rel_path in sorted(remote):
+        if rel_path in local_paths:
+            continue
+        parts = rel_path.split("/")
+        top = next(("/".join(parts[:index]) for index in range(1, len(parts))
+                    if "/".join(parts[:index]) in extras), rel_path)
+        extras[top] = extras.get(top, 0) + remote[rel_path]['length']
+    return extras
+
+def sync_localdir(module, hdfs_client, hdfs_path=None, local_path=None, delete=False, permission=None, owner=None,
+                  group=None, checksum=False, preserve_times=True, parallelism=1, max_bytes_in_flight=None,
+                  manifest=None, write_options=None):
+    """
+    Makes a HDFS directory a mirror of a local directory, e.g. /home/sayed/conf is synced to <hdfs_path>/conf.
+    The HDFS tree is read with one listing per directory and compared with the local tree: like rsync, files with
+    the same size and modification time are unchanged, unless `checksum` is set. Files of the same size and a
+    different modification time are compared by checksum. Missing directories are created in one batch, extra
+    paths deleted if `delete` is set, changed files uploaded and attributes fixed, up to `parallelism` at a time.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path
+    :param local_path: local directory path
+    :param delete: if delete is set to True, files and directories that don't exist locally are deleted.
+    :param permission: permission (in octal string) of every file of the mirror, if set. Directories get the
+                       execute bits where the read bits are set.
+    :param owner: owner of every file and directory of the mirror, if set
+    :param group: group of every file and directory of the mirror, if set
+    :param checksum: if checksum is set to True, files of the same size are always compared by checksum.
+    :param preserve_times: if preserve_times is set to True, uploaded files get the modification time of the local file.
+    :param parallelism: maximum number of concurrent requests
+    :param max_bytes_in_flight: maximum number of bytes uploaded at the same time
+    :param manifest: checksum manifest of earlier runs, if enabled
+    :param write_options: keyword arguments of _write_file, e.g. journal_dir and chunk_size of resumable uploads
+    :return: dictionary with the count and bytes of every category of the report, and the totals of the uploads.
+    """
+    if hdfs_path is None:
+        module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
+    if local_path is None:
+        module.fail_json(path=local_path, msg="local path should not be empty.")
+    if permission is not None:
+        permission = permission[1:] if permission.startswith('0') else permission
+        if not re.search(r"(^[0-7]{3}$)", permission):
+            module.fail_json(path=hdfs_path, msg="mode '{0}' does not match the expected pattern.".format(permission))
+
+    # directories can be listed where files can be read, e.g. 0644 is 0755 for directories
+    directory_permission = None if permission is None else \
+        "".join(str(int(digit) | (1 if int(digit) & 4 else 0)) for digit in permission)
+
+    hdfs_dir_status = hdfs_client.status(hdfs_path, strict=False)
+    if hdfs_dir_status is None or hdfs_dir_status['type'] != 'DIRECTORY' or not os.path.isdir(local_path):
+        module.fail_json(path=hdfs_path, local_path=local_path,
+                         msg="either HDFS path provided is not a directory or local path provided is not a directory.")
+
+    local_root = os.path.abspath(local_path)
+    hdfs_root = os.path.join(hdfs_path, os.path.basename(local_root))
+    root_status = hdfs_client.status(hdfs_root, strict=False)
+    remote = _remote_tree(module, hdfs_client, hdfs_root)
+
+    # missing directories, only the deepest ones need a MKDIRS as it creates the parents as well
+    missing_dirs = set()
+    existing_dirs = []
+    uploads = []
+    local_paths = set()
+    for dir_path, dir_names, file_names in os.walk(local_root):
+        rel_dir = os.path.relpath(dir_path, local_root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir
+        local_paths.add(rel_dir)
+        status = remote.get(rel_dir) if rel_dir else root_status
+        if status is not None and status['type'] != 'DIRECTORY':
+            if not delete:
+                module.fail_json(path=os.path.join(hdfs_root, rel_dir), local_path=dir_path,
+                                 msg="{0} is a file in HDFS.".format(os.path.join(hdfs_root, rel_dir)))
+            local_paths.discard(rel_dir)
+            status = None
+        if status is None:
+            missing_dirs.add(rel_dir)
+        else:
+            existing_dirs.append((os.path.join(hdfs_root, rel_dir).rstrip("/"), status))
+        for file_name in file_names:
+            local_file = os.path.join(dir_path, file_name)
+            rel_file = (rel_dir + "/" + file_name).lstrip("/")
+            status = remote.get(rel_file)
+            local_paths.add(rel_file)
+            if status is not None and status['type'] == 'DIRECTORY':
+                if not delete:
+                    module.fail_json(path=os.path.join(hdfs_root, rel_file), local_path=local_file,
+                                     msg="{0} is a directory in HDFS.".format(os.path.join(hdfs_root, rel_file)))
+                local_paths.discard(rel_file)
+                status = None
+            uploads.append((local_file, os.path.join(hdfs_root, rel_file), os.path.getsize(local_file), status))
+    parents = set("/".join(rel_dir.split("/")[:-1]) for rel_dir in missing_dirs if rel_dir)
+    leaf_dirs = [os.path.join(hdfs_root, rel_dir).rstrip("/") for rel_dir in missing_dirs if rel_dir not in parents]
+    extras = _extra_paths(remote, local_paths) if delete else {}
+
+    report = dict((category, {'count': 0, 'bytes': 0}) for category in SYNC_CATEGORIES)
+    report['directories']['count'] = len(missing_dirs)
+    report_lock = threading.Lock()
+    budget = _ByteBudget(max_bytes_in_flight or DEFAULT_MAX_BYTES_IN_FLIGHT)
+
+    def _count(category, size=0):
+        with report_lock:
+            report[category]['count'] += 1
+            report[category]['bytes'] += size
+
+    def _fix_attributes(path, status=None, mode=permission):
+        fixed = False
+        if mode is not None and (status is None or status['permission'] != mode):
+            if not _planned(module, "set_permission", path, permission=mode):
+                hdfs_client.set_permission(path, permission=mode)
+            fixed = True
+        if (owner is not None and (status is None or status['owner'] != owner)) or \
+                (group is not None and (status is None or status['group'] != group)):
+            if not _planned(module, "set_owner", path, owner=owner, group=group):
+                hdfs_client.set_owner(path, owner=owner, group=group)
+            fixed = True
+        return fixed
+
+    def _fix_directory(directory):
+        path, status = directory
+        if _fix_attributes(path, status, mode=directory_permission) and status is not None:
+            _count('attributes')
+
+    def _delete(extra):
+        rel_path, size = extra
+        if not _planned(module, "delete", os.path.join(hdfs_root, rel_path), recursive=True, bytes=size):
+            hdfs_client.delete(os.path.join(hdfs_root, rel_path), recursive=True)
+        _count('deleted', size)
+
+    def _upload(upload):
+        local_file, hdfs_file, size, status = upload
+        local_stat = os.stat(local_file)
+        if status is not None and not checksum and status['length'] == size and \
+                status['modificationTime'] == int(local_stat.st_mtime * 1000):
+            uploaded = False
+        elif status is not None and manifest is not None and \
+                manifest.is_synced(hdfs_client.url, hdfs_file, local_stat, status):
+            uploaded = False
+        elif _is_check_mode(module):
+            uploaded = _plan_upload(module, hdfs_client, hdfs_file, local_file, status=status, manifest=manifest)
+        else:
+            reserved = budget.acquire(size)
+            try:
+                uploaded = _upload_file(hdfs_client, hdfs_file, local_file, status=status, manifest=manifest,
+                                        write_options=write_options)
+            finally:
+                budget.release(reserved)
+        if not uploaded:
+            _count('unchanged', size)
+            if _fix_attributes(hdfs_file, status):
+                _count('attributes')
+            return
+        if preserve_times and not _is_check_mode(module):
+            hdfs_client.set_times(hdfs_file, modification_time=int(local_stat.st_mtime * 1000))
+        _fix_attributes(hdfs_file)
+        _count('created' if status is None else 'updated', size)
+
+    try:
+        _run_streaming(parallelism, _delete, sorted(extras.items()))
+        _run_concurrently(parallelism, lambda path: _planned(module, "mkdir", path) or hdfs_client.makedirs(path),
+                          leaf_dirs)
+        _run_streaming(parallelism, _fix_directory, existing_dirs +
+                       [(os.path.join(hdfs_root, rel_dir).rstrip("/"), None) for rel_dir in missing_dirs])
+        _run_streaming(parallelism, _upload, uploads)
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_root, local_path=local_path, msg="{0}".format(e))
+
+    return {'report': report,
+            'uploaded': report['created']['count'] + report['updated']['count'],
+            'unchanged': report['unchanged']['count'],
+            'bytes': report['created']['bytes'] + report['updated']['bytes'],
+            'directories': len(missing_dirs),
+            'changed': any(report[category]['count'] for category in SYNC_CATEGORIES if category != 'unchanged'),
+            'path': hdfs_root}
+
+def _pwrite(fd, data, offset, lock=threading.Lock()):
+    """
+    Writes data at an offset of a file opened with os.open, without moving a file position shared with other threads.
+    """
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
+
+def _read_file(hdfs_client, hdfs_path, local_path, status, parts=1, manifest=None):
+    """
+    Downloads a HDFS file to a local file path. Up to `parts` block aligned ranges of the file are read at the same
+    time with ranged OPEN requests and written at their offset into a preallocated temporary file next to the
+    local path. Every range is hashed on the way, and the temporary file only replaces the local path once the
+    combined checksum matches the checksum HDFS computed for the file.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local file path
+    :param status: FileStatus of the HDFS file
+    :param parts: maximum number of ranges read at the same time
+    :param manifest: checksum manifest, if enabled
+    """
+    length = status['length']
+    block_size = status['blockSize'] or DEFAULT_BLOCK_SIZE
+    blocks = (length + block_size - 1) // block_size
+    range_size = max((blocks + parts - 1) // parts, 1) * block_size
+    ranges = [(offset, min(range_size, length - offset)) for offset in range(0, length, range_size)]
+    remote = _parse_hdfs_checksum(hdfs_client.checksum(hdfs_path)) if length else None
+    checksums = [_fast_checksum((remote[0], remote[1], block_size)) if remote else None for _ in ranges]
+    if None in checksums or (len(ranges) > 1 and checksums[0].composite):
+        # verified from the local file once written
+        checksums = []
+
+    temp_path = "{0}.temp-{1}".format(local_path, int(time.time() * 1e6))
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            if length and hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, length)
+            else:
+                os.ftruncate(fd, length)
+
+            def _read_range(index):
+                offset, size = ranges[index]
+                position = offset
+                with hdfs_client.read(hdfs_path, offset=offset, length=size, chunk_size=PIPELINE_CHUNK_SIZE) as reader:
+                    for chunk in reader:
+                        if checksums:
+                            checksums[index].update(chunk)
+                        _pwrite(fd, chunk, position)
+                        position += len(chunk)
+                if position != offset + size:
+                    raise HdfsError("read {0} bytes of {1} at offset {2}, expected {3}.".format(
+                        position - offset, hdfs_path, offset, size))
+
+            with _METRICS.phase("transfer"):
+                _run_concurrently(parts, _read_range, range(len(ranges)))
+        finally:
+            os.close(fd)
+
+        if checksums:
+            if len(checksums) == 1:
+                local_checksum = checksums[0].hexdigest()
+            else:
+                local_checksum = hashlib.md5(b"".join(digest for checksum in checksums
+                                                      for digest in checksum.block_digests())).hexdigest()
+            if local_checksum != remote[2]:
+                raise HdfsError("checksum of {0} doesn't match {1} after the download.".format(local_path, hdfs_path))
+        elif length and not _same_content(hdfs_client, hdfs_path, temp_path, status):
+            raise HdfsError("content of {0} doesn't match {1} after the download.".format(local_path, hdfs_path))
+        os.rename(temp_path, local_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    if manifest is not None:
+        local_stat = os.stat(local_path)
+        if checksums:
+            manifest.store_checksum(local_stat, _manifest_key(remote[0], remote[1], block_size), remote[2])
+        manifest.store_synced(hdfs_client.url, hdfs_path, local_stat, status)
+
+def download_hdfsfile(module, hdfs_client, hdfs_path=None, local_path=None, parallelism=1, manifest=None):
+    """
+    Downloads a HDFS file in a local directory, e.g. /apps/conf/hive-site.xml is downloaded to
+    <local_path>/hive-site.xml. If the local file exists and has the same content, it's not downloaded.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS file path
+    :param local_path: local directory path
+    :param parallelism: maximum number of ranges of the file read at the same time
+    :param manifest: checksum manifest of earlier runs, if enabled
+    :return: dictionary with changed, the local file path and the downloaded bytes.
+    """
+    if hdfs_path is None:
+        module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
+    if local_path is None or not os.path.isdir(local_path):
+        module.fail_json(path=hdfs_path, local_path=local_path, msg="local path provided is not a directory.")
+
+    local_file = os.path.join(local_path, os.path.basename(hdfs_path.rstrip("/")))
+    try:
+        status = hdfs_client.status(hdfs_path)
+        if os.path.isfile(local_file) and _same_content(hdfs_client, hdfs_path, local_file, status, manifest):
+            return dict(changed=False, local_path=local_file, bytes=0)
+        if not _planned(module, "download", hdfs_path, local_path=local_file, bytes=status['length']):
+            _read_file(hdfs_client, hdfs_path, local_file, status, parts=parallelism, manifest=manifest)
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_path, local_path=local_file, msg="{0}".format(e))
+    return dict(changed=True, local_path=local_file, bytes=status['length'])
+
+def download_hdfsdir(module, hdfs_client, hdfs_path=None, local_path=None, parallelism=1, manifest=None):
+    """
+    Mirrors a HDFS directory into a local directory, e.g. /apps/conf is downloaded to <local_path>/conf.
+    The HDFS tree is walked one directory listing at a time and files that don't exist locally or whose content
+    has changed are downloaded, up to `parallelism` at the same time.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS directory
+    :param local_path: local directory path
+    :param parallelism: maximum number of files downloaded at the same time
+    :param manifest: checksum manifest of earlier runs, if enabled
+    :return: dictionary with the number of downloaded and unchanged files, the downloaded bytes and created directories.
+    """
+    if hdfs_path is None:
+        module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
+    if local_path is None or not os.path.isdir(local_path):
+        module.fail_json(path=hdfs_path, local_path=local_path, msg="local path provided is not a directory.")
+
+    hdfs_root = hdfs_path.rstrip("/") or "/"
+    local_root = os.path.join(local_path, os.path.basename(hdfs_root))
+    summary = {'downloaded': 0, 'unchanged': 0, 'bytes': 0, 'directories': 0}
+    summary_lock = threading.Lock()
+
+    def _make_directory(local_dir):
+        if not os.path.isdir(local_dir):
+            if not _planned(module, "local_mkdir", local_dir):
+                os.makedirs(local_dir)
+            summary['directories'] += 1
+
+    def _download(download):
+        hdfs_file, status = download
+        local_file = os.path.join(local_root, os.path.relpath(hdfs_file, hdfs_root))
+        if os.path.isfile(local_file) and _same_content(hdfs_client, hdfs_file, local_file, status, manifest):
+            with summary_lock:
+                summary['unchanged'] += 1
+            return
+        if not _planned(module, "download", hdfs_file, local_path=local_file, bytes=status['length']):
+            _read_file(hdfs_client, hdfs_file, local_file, status, manifest=manifest)
+        with summary_lock:
+            summary['downloaded'] += 1
+            summary['bytes'] += status['length']
+
+    def _files():
+        # directories are walked before anything below them, so parents are created first
+        for path, status in _walk_tree(hdfs_client, hdfs_root):
+            if status['type'] == 'DIRECTORY':
+                _make_directory(os.path.join(local_root, os.path.relpath(path, hdfs_root)))
+            else:
+                yield path, status
+
+    try:
+        _make_directory(local_root)
+        _run_streaming(parallelism, _download, _files())
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_root, local_path=local_root, msg="{0}".format(e))
+
+    summary['changed'] = summary['downloaded'] > 0 or summary['directories'] > 0
+    summary['local_path'] = local_root
+    return summary
 
 def create_directory(module, hdfs_client, hdfs_path):
     """
@@ -323,27 +2217,54 @@ def create_directory(module, hdfs_client, hdfs_path):
     # remove "/" at end, if present
     hdfs_path = hdfs_path[:len(hdfs_path)-1] if hdfs_path.endswith("/") else hdfs_path
 
-    # collect dir_name and parent directory path from the HDFS path
-    dir_name = hdfs_path.split("/")[-1]
-    parent_dir = "/".join(hdfs_path.split("/")[:-1])
-    files_list = hdfs_client.list(parent_dir)
-    # checks if directory name already exists
-    if dir_name in files_list:
+    # checks if the path already exists, a single lookup instead of listing the parent directory
+    if hdfs_client.status(hdfs_path, strict=False) is not None:
         return False
     else:
         try:
-            hdfs_client.makedirs(hdfs_path)
+            if not _planned(module, "mkdir", hdfs_path):
+                hdfs_client.makedirs(hdfs_path)
             return True
         except (HdfsError, Exception) as e:
             module.fail_json(path=hdfs_path, msg="{0}".format(e))
 
-def remove(module, hdfs_client, hdfs_path=None, recursive=False):
+def _move_to_trash(hdfs_client, hdfs_path, limiter=None):
+    """
+    Moves a file or directory to <trash root>/Current/<path>, the same way "hdfs dfs -rm" does without -skipTrash.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path
+    :param limiter: _RateLimiter acquired before every NameNode call, if any
+    :return: False if the path doesn't exist, otherwise it returns True.
+    """
+    acquire = limiter.acquire if limiter is not None else (lambda: None)
+    acquire()
+    if hdfs_client.status(hdfs_path, strict=False) is None:
+        return False
+    try:
+        acquire()
+        trash_root = _get_trash_root(hdfs_client, hdfs_path).json()["Path"]
+    except HdfsError:
+        # clusters older than Hadoop 2.8 don't support GETTRASHROOT, resolving the home directory is a call too
+        acquire()
+        trash_root = hdfs_client.resolve(".Trash")
+    trash_path = os.path.join(trash_root, "Current", hdfs_path.lstrip("/"))
+    acquire()
+    hdfs_client.makedirs(os.path.dirname(trash_path))
+    acquire()
+    if hdfs_client.status(trash_path, strict=False) is not None:
+        trash_path = "{0}{1}".format(trash_path, int(time.time() * 1000))
+    acquire()
+    hdfs_client.rename(hdfs_path, trash_path)
+    return True
+
+def remove(module, hdfs_client, hdfs_path=None, recursive=False, skip_trash=True):
     """
     Removes a file or a directory if the HDFS path exists.
     :param module: Ansible module
     :param hdfs_client: HDFS client
     :param hdfs_path: HDFS path
     :param recursive: if recursive is set to True, it recursively delete's subdirectories.
+    :param skip_trash: if skip_trash is set to False, the path is moved to the trash instead of being deleted.
     :return: False if the remove operation is not successful, otherwise it returns True.
     """
     if hdfs_path is None:
@@ -352,17 +2273,340 @@ def remove(module, hdfs_client, hdfs_path=None, recursive=False):
     # remove "/" at end, if present
     hdfs_path = hdfs_path[:len(hdfs_path) - 1] if hdfs_path.endswith("/") else hdfs_path
     try:
+        if _is_check_mode(module):
+            return hdfs_client.status(hdfs_path, strict=False) is not None and \
+                _planned(module, "delete" if skip_trash else "trash", hdfs_path, recursive=recursive)
+        if not skip_trash:
+            return _move_to_trash(hdfs_client, hdfs_path)
         return hdfs_client.delete(hdfs_path, recursive=recursive)
     except (HdfsError, Exception) as e:
         module.fail_json(path=hdfs_path, msg="{0}".format(e))
 
-def run(module, hdfs_client):
+def _expand_glob(hdfs_client, hdfs_path):
     """
-    Run's the HDFS Ansible module operations and performs operations with the given HDFS command.
+    Finds the paths matching a glob pattern, e.g. /data/*/dt=2018-0[1-6]-*. Components without glob characters
+    are looked up directly, only the parents of components with glob characters are listed.
+    :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path with glob characters
+    :return: generator of (path, FileStatus) tuples.
+    """
+    parts = [part for part in hdfs_path.split("/") if part]
+
+    def _expand(base, index, status):
+        if index == len(parts):
+            yield base, status
+            return
+        if not GLOB_CHARACTERS.search(parts[index]):
+            literal = index
+            while literal < len(parts) and not GLOB_CHARACTERS.search(parts[literal]):
+                literal += 1
+            path = os.path.join(base, *parts[index:literal])
+            child_status = hdfs_client.status(path, strict=False)
+            if child_status is not None:
+                for match in _expand(path, literal, child_status):
+                    yield match
+            return
+        if status is not None and status['type'] != 'DIRECTORY':
+            return
+        for name, child_status in _list_directory(hdfs_client, base):
+            if fnmatch.fnmatchcase(name, parts[index]):
+                for match in _expand(os.path.join(base, name), index + 1, child_status):
+                    yield match
+
+    return _expand("/", 0, None)
+
+def remove_matching(module, hdfs_client, hdfs_path=None, recursive=False, matches=None, skip_trash=True,
+                    parallelism=1, rate_limit=None):
+    """
+    Removes every file or directory that matches a glob pattern and the filters.
+    Deletes run concurrently, up to `parallelism` at a time and at most `rate_limit` NameNode calls per second.
     :param module: Ansible module
     :param hdfs_client: HDFS client
+    :param hdfs_path: HDFS path, with glob characters
+    :param recursive: if recursive is set to True, matching directories are deleted with everything below them.
+    :param matches: function taking a path and its FileStatus, returns True for the paths to remove
+    :param skip_trash: if skip_trash is set to False, the paths are moved to the trash instead of being deleted.
+    :param parallelism: maximum number of concurrent deletes
+    :param rate_limit: maximum number of NameNode calls per second, None for no limit
+    :return: dictionary with the number of removed paths, the bytes freed and the duration in seconds.
+    """
+    if hdfs_path is None:
+        module.fail_json(path=hdfs_path, msg="HDFS path should not be empty.")
+    matches = matches or (lambda path, status: True)
+    start = time.time()
+    limiter = _RateLimiter(rate_limit)
+    summary = {'deleted': 0, 'bytes': 0}
+    summary_lock = threading.Lock()
+
+    def _remove(match):
+        path, status = match
+        size = status['length']
+        if status['type'] == 'DIRECTORY' and recursive:
+            limiter.acquire()
+            size = hdfs_client.content(path)['length']
+        if _planned(module, "delete" if skip_trash else "trash", path, recursive=recursive, bytes=size):
+            deleted = True
+        elif skip_trash:
+            limiter.acquire()
+            deleted = hdfs_client.delete(path, recursive=recursive)
+        else:
+            deleted = _move_to_trash(hdfs_client, path, limiter)
+        if deleted:
+            with summary_lock:
+                summary['deleted'] += 1
+                summary['bytes'] += size
+
+    try:
+        _run_streaming(parallelism, _remove,
+                       (match for match in _expand_glob(hdfs_client, hdfs_path) if matches(*match)))
+    except (HdfsError, Exception) as e:
+        module.fail_json(path=hdfs_path, deleted=summary['deleted'], bytes=summary['bytes'], msg="{0}".format(e))
+    summary['duration'] = round(time.time() - start, 3)
+    return summary
+
+class _CachingClient(object):
+    """
+    Wraps the HDFS client and memoizes FileStatus, directory listings and checksums for the duration of a run.
+    Statuses of the entries of a cached listing are cached as well. Writes through the client update or drop the
+    cached entries of the paths they touch. Everything that isn't cached is delegated to the wrapped client.
+
+    Existence checks are point lookups (GETFILESTATUS). Once a directory got more lookups than it would take pages
+    to list it, a name index of the directory is built from LISTSTATUS_BATCH and answers the lookups of names
+    that don't exist without a remote call.
+    """
+    _MISSING = object()
+
+    def __init__(self, hdfs_client):
+        self._client = hdfs_client
+        self._lock = threading.Lock()
+        self._statuses = {}
+        self._listings = {}
+        self._checksums = {}
+        self._indexes = {}
+        self._index_locks = {}
+        self._lookups = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @staticmethod
+    def _normalize(hdfs_path):
+        return hdfs_path.rstrip("/") or "/"
+
+    def _cached(self, cache, hdfs_path):
+        with self._lock:
+            value = cache.get(hdfs_path)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def _invalidate(self, *hdfs_paths):
+        """
+        Drops everything cached for the paths, the paths below them and their parent directories.
+        """
+        with self._lock:
+            for cache in (self._statuses, self._listings, self._checksums):
+                for cached_path in list(cache):
+                    if any(_paths_overlap(cached_path, self._normalize(path)) for path in hdfs_paths):
+                        del cache[cached_path]
+
+    def _update_indexes(self, hdfs_path, exists):
+        """
+        Adds a path that was just created, with its parent directories, to the name indexes, or removes a deleted
+        path from the index of its parent. Indexes of the path itself and below it are dropped in both cases.
+        """
+        hdfs_path = self._normalize(hdfs_path)
+        with self._lock:
+            for indexed_path in list(self._indexes):
+                if _paths_overlap(indexed_path, hdfs_path) and len(indexed_path) >= len(hdfs_path):
+                    del self._indexes[indexed_path]
+            if exists:
+                path = hdfs_path
+                while path != "/":
+                    parent, name = os.path.split(path)
+                    if parent in self._indexes:
+                        self._indexes[parent].add(name)
+                    path = parent
+            else:
+                parent, name = os.path.split(hdfs_path)
+                if parent in self._indexes:
+                    self._indexes[parent].discard(name)
+
+    def _name_index(self, parent):
+        """
+        Returns the names in a directory, or None as long as point lookups are cheaper than listing it.
+        """
+        with self._lock:
+            if parent in self._indexes:
+                return self._indexes[parent]
+            lookups = self._lookups[parent] = self._lookups.get(parent, 0) + 1
+            if lookups < NAME_INDEX_MIN_LOOKUPS:
+                return None
+        parent_status = self.status(parent, strict=False)
+        if parent_status is None or parent_status['type'] != 'DIRECTORY' or \
+                lookups < parent_status.get('childrenNum', 0) // LISTING_PAGE_SIZE:
+            return None
+        with self._lock:
+            build_lock = self._index_locks.setdefault(parent, threading.Lock())
+        with build_lock:
+            if parent not in self._indexes:
+                try:
+                    names = set(name for name, _ in _list_directory(self._client, parent))
+                except HdfsError:
+                    return None
+                with self._lock:
+                    self._indexes[parent] = names
+            return self._indexes[parent]
+
+    def statistics(self):
+        """
+        Returns the number of remote metadata calls saved by the cache and the ones that were still needed.
+        """
+        return {'remote_calls_saved': self.hits, 'remote_calls': self.misses}
+
+    def status(self, hdfs_path, strict=True):
+        hdfs_path = self._normalize(hdfs_path)
+        status = self._cached(self._statuses, hdfs_path)
+        if status is None and hdfs_path != "/":
+            parent, name = os.path.split(hdfs_path)
+            index = self._name_index(parent)
+            if index is not None and name not in index:
+                with self._lock:
+                    self._statuses[hdfs_path] = status = self._MISSING
+                    self.misses -= 1
+                    self.hits += 1
+        if status is None:
+            try:
+                status = self._client.status(hdfs_path, strict=strict)
+            except HdfsError as e:
+                if getattr(e, "exception", None) == "FileNotFoundException":
+                    with self._lock:
+                        self._statuses[hdfs_path] = self._MISSING
+                raise
+            with self._lock:
+                self._statuses[hdfs_path] = self._MISSING if status is None else status
+        if status is self._MISSING:
+            if strict:
+                raise HdfsError("File does not exist: %s", hdfs_path, exception="FileNotFoundException")
+            return None
+        return status
+
+    def list(self, hdfs_path, status=False):
+        hdfs_path = self._normalize(hdfs_path)
+        listing = self.cached_listing(hdfs_path)
+        if listing is None:
+            listing = self._client.list(hdfs_path, status=True)
+            with self._lock:
+                self._listings[hdfs_path] = listing
+                for name, file_status in listing:
+                    self._statuses[os.path.join(hdfs_path, name)] = file_status
+        if status:
+            return list(listing)
+        return [name for name, _ in listing]
+
+    def cached_listing(self, hdfs_path):
+        """
+        Returns the cached listing of a directory as (name, FileStatus) tuples, None if it isn't cached.
+        """
+        return self._cached(self._listings, self._normalize(hdfs_path))
+
+    def checksum(self, hdfs_path):
+        hdfs_path = self._normalize(hdfs_path)
+        checksum = self._cached(self._checksums, hdfs_path)
+        if checksum is None:
+            checksum = self._client.checksum(hdfs_path)
+            with self._lock:
+                self._checksums[hdfs_path] = checksum
+        return checksum
+
+    def set_owner(self, hdfs_path, owner=None, group=None):
+        self._client.set_owner(hdfs_path, owner=owner, group=group)
+        with self._lock:
+            status = self._statuses.get(self._normalize(hdfs_path))
+            if status is not None and status is not self._MISSING:
+                status.update(dict((key, value) for key, value in (("owner", owner), ("group", group)) if value))
+
+    def set_permission(self, hdfs_path, permission):
+        self._client.set_permission(hdfs_path, permission=permission)
+        with self._lock:
+            status = self._statuses.get(self._normalize(hdfs_path))
+            if status is not None and status is not self._MISSING:
+                status["permission"] = "{0:o}".format(int(permission, 8))
+
+    def set_times(self, hdfs_path, **kwargs):
+        self._invalidate(hdfs_path)
+        return self._client.set_times(hdfs_path, **kwargs)
+
+    def makedirs(self, hdfs_path, **kwargs):
+        self._invalidate(hdfs_path)
+        self._update_indexes(hdfs_path, exists=True)
+        return self._client.makedirs(hdfs_path, **kwargs)
+
+    def delete(self, hdfs_path, **kwargs):
+        self._invalidate(hdfs_path)
+        self._update_indexes(hdfs_path, exists=False)
+        return self._client.delete(hdfs_path, **kwargs)
+
+    def rename(self, hdfs_src_path, hdfs_dst_path):
+        self._invalidate(hdfs_src_path, hdfs_dst_path)
+        self._update_indexes(hdfs_src_path, exists=False)
+        self._update_indexes(hdfs_dst_path, exists=True)
+        return self._client.rename(hdfs_src_path, hdfs_dst_path)
+
+    def write(self, hdfs_path, *args, **kwargs):
+        self._invalidate(hdfs_path)
+        self._update_indexes(hdfs_path, exists=True)
+        with _METRICS.phase("transfer"):
+            return self._client.write(hdfs_path, *args, **kwargs)
+
+    def upload(self, hdfs_path, local_path, **kwargs):
+        self._invalidate(hdfs_path)
+        self._update_indexes(hdfs_path, exists=True)
+        with _METRICS.phase("transfer"):
+            return self._client.upload(hdfs_path, local_path, **kwargs)
+
+class _ResultModule(object):
+    """
+    Stands in for the Ansible module and adds information about the whole run to the result it exits with.
+    """
+    def __init__(self, module, run_results, plan=None):
+        self._module = module
+        self._run_results = run_results
+        self.plan = plan
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def exit_json(self, **kwargs):
+        kwargs.update(self._run_results())
+        self._module.exit_json(**kwargs)
+
+    def fail_json(self, **kwargs):
+        kwargs.update(self._run_results())
+        self._module.fail_json(**kwargs)
+
+def _write_options(params):
+    """
+    Returns the keyword arguments of _write_file for the uploads of "put" and "sync": journal_dir and chunk_size
+    of resumable uploads, if enabled.
+    """
+    if params.get("resumable"):
+        return dict(journal_dir=params.get("upload_journal") or DEFAULT_UPLOAD_JOURNAL,
+                    chunk_size=params.get("chunk_size"))
+    return {}
+
+def _run_command(module, hdfs_client, params):
+    """
+    Performs a single HDFS command with the given parameters.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param params: command, path and the command specific options
+    :return: result dictionary with changed, path and msg.
     """
-    params = module.params
     command = params['command']
     recurse = params['recurse']
     hdfs_path = params["path"]
@@ -370,100 +2614,1124 @@ def run(module, hdfs_client):
     group = params["group"]
     permission = params["permission"]
     local_path = params["local_path"]
+    parallelism = max(params.get("parallelism") or 1, 1)
+    manifest = _open_manifest(params.get("checksum_manifest"), params.get("checksum_manifest_size"))
 
-    if command == "rm":
-        result = remove(module, hdfs_client, hdfs_path=hdfs_path, recursive=recurse)
+    if command == "rm" and (GLOB_CHARACTERS.search(hdfs_path) or any(params.get(option) for option in FILTER_OPTIONS)):
+        try:
+            # owner and group are the new owner and group of other entries of `operations`, never rm filters
+            matches = _path_filter(dict((option, params.get(option)) for option in FILTER_OPTIONS))
+        except (ValueError, re.error) as e:
+            module.fail_json(path=hdfs_path, msg="{0}".format(e))
+        result = remove_matching(module, hdfs_client, hdfs_path=hdfs_path, recursive=recurse, matches=matches,
+                                 skip_trash=not params.get("trash"), parallelism=parallelism,
+                                 rate_limit=params.get("rate_limit"))
+        return dict(changed=result['deleted'] > 0,
+                    path=hdfs_path,
+                    deleted=result['deleted'],
+                    bytes=result['bytes'],
+                    duration=result['duration'],
+                    msg="{0} {1} paths, freeing {2} bytes in {3} seconds.".format(
+                        "moved to trash" if params.get("trash") else "deleted",
+                        result['deleted'], result['bytes'], result['duration']))
+
+    elif command == "rm":
+        result = remove(module, hdfs_client, hdfs_path=hdfs_path, recursive=recurse,
+                        skip_trash=not params.get("trash"))
         if result == False:
-            module.exit_json(changed=False,
-                             path=hdfs_path,
-                             msg="no such file or directory.")
+            return dict(changed=False,
+                        path=hdfs_path,
+                        msg="no such file or directory.")
         elif result == True:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="deleted: {0}".format(hdfs_path))
+            return dict(changed=True,
+                        path=hdfs_path,
+                        msg="deleted: {0}".format(hdfs_path))
 
     elif command == "chown":
-        result = change_owner(module, hdfs_client, hdfs_path=hdfs_path, owner=owner)
-        if result['changed'] == False:
-            module.exit_json(changed=False,
-                             path=hdfs_path,
-                             msg="previous owner: '{0}', current owner: '{1}'.".format(result['current'], result['new']))
-        elif result['changed'] == True:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="previous owner: '{0}', current owner: '{1}'.".format(result['current'], result['new']))
+        result = change_owner(module, hdfs_client, hdfs_path=hdfs_path, owner=owner,
+                        recurse=recurse, parallelism=parallelism)
+        return dict(changed=result['changed'],
+                    path=hdfs_path,
+                    updated=result['updated'],
+                    msg="previous owner: '{0}', current owner: '{1}'.".format(result['current'], result['new']))
 
     elif command == "chgrp":
-        result = change_group(module, hdfs_client, hdfs_path=hdfs_path, group=group)
-        if result['changed'] == False:
-            module.exit_json(changed=False,
-                             path=hdfs_path,
-                             msg="previous group: '{0}', current group: '{1}'.".format(result['current'], result['new']))
-        elif result['changed'] == True:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="previous group: '{0}', current group: '{1}'.".format(result['current'], result['new']))
+        result = change_group(module, hdfs_client, hdfs_path=hdfs_path, group=group,
+                        recurse=recurse, parallelism=parallelism)
+        return dict(changed=result['changed'],
+                    path=hdfs_path,
+                    updated=result['updated'],
+                    msg="previous group: '{0}', current group: '{1}'.".format(result['current'], result['new']))
 
     elif command == "chmod":
-        result = change_permission(module, hdfs_client, hdfs_path=hdfs_path, permission=permission)
-        if result['changed'] == False:
-            module.exit_json(changed=False,
-                             path=hdfs_path,
-                             msg="previous permission: '{0}', current permission: '{1}'.".format(result['current'], result['new']))
-        elif result['changed'] == True:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="previous permission: '{0}', current permission: '{1}'.".format(result['current'], result['new']))
+        result = change_permission(module, hdfs_client, hdfs_path=hdfs_path, permission=permission,
+                        recurse=recurse, parallelism=parallelism)
+        return dict(changed=result['changed'],
+                    path=hdfs_path,
+                    updated=result['updated'],
+                    msg="previous permission: '{0}', current permission: '{1}'.".format(result['current'], result['new']))
 
     elif command == "put":
+        write_options = _write_options(params)
+        if local_path is not None and os.path.isdir(local_path):
+            result = upload_localdir(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path,
+                                     parallelism=parallelism, max_bytes_in_flight=params.get("max_bytes_in_flight"),
+                                     manifest=manifest, write_options=write_options)
+            return dict(changed=result['changed'],
+                        path=result['path'],
+                        local_path=local_path,
+                        uploaded=result['uploaded'],
+                        unchanged=result['unchanged'],
+                        bytes=result['bytes'],
+                        msg="uploaded {0} files ({1} bytes), {2} unchanged, created {3} directories."
+                            .format(result['uploaded'], result['bytes'], result['unchanged'], result['directories']))
         file_name = local_path.split("/")[-1]
         file_path = os.path.join(hdfs_path, file_name)
-        uploaded = upload_localfile(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path)
+        if params.get("parallel_upload") and not params.get("resumable"):
+            write_options = dict(parts=parallelism, block_size=params.get("block_size"))
+        uploaded = upload_localfile(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path,
+                                    manifest=manifest, write_options=write_options)
         if uploaded:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="uploaded: {0} .".format(file_path))
+            return dict(changed=True,
+                        path=hdfs_path,
+                        msg="uploaded: {0} .".format(file_path))
+
+    elif command == "sync":
+        result = sync_localdir(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path,
+                               delete=params.get("delete"), permission=permission, owner=owner, group=group,
+                               checksum=params.get("checksum"), parallelism=parallelism,
+                               max_bytes_in_flight=params.get("max_bytes_in_flight"), manifest=manifest,
+                               write_options=_write_options(params))
+        report = result['report']
+        return dict(changed=result['changed'],
+                    path=result['path'],
+                    local_path=local_path,
+                    report=report,
+                    msg="created {0} files, updated {1}, {2} unchanged, deleted {3} paths, fixed the attributes of {4}, "
+                        "created {5} directories.".format(report['created']['count'], report['updated']['count'],
+                                                          report['unchanged']['count'], report['deleted']['count'],
+                                                          report['attributes']['count'],
+                                                          report['directories']['count']))
+
+    elif command == "get":
+        status = hdfs_client.status(hdfs_path, strict=False)
+        if status is None:
+            module.fail_json(path=hdfs_path, msg="no such file or directory.")
+        if status['type'] == 'DIRECTORY':
+            result = download_hdfsdir(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path,
+                                      parallelism=parallelism, manifest=manifest)
+            return dict(changed=result['changed'],
+                        path=hdfs_path,
+                        local_path=result['local_path'],
+                        downloaded=result['downloaded'],
+                        unchanged=result['unchanged'],
+                        bytes=result['bytes'],
+                        msg="downloaded {0} files ({1} bytes), {2} unchanged, created {3} directories."
+                            .format(result['downloaded'], result['bytes'], result['unchanged'], result['directories']))
+        result = download_hdfsfile(module, hdfs_client, hdfs_path=hdfs_path, local_path=local_path,
+                                   parallelism=parallelism, manifest=manifest)
+        return dict(changed=result['changed'],
+                    path=hdfs_path,
+                    local_path=result['local_path'],
+                    bytes=result['bytes'],
+                    msg="downloaded: {0} .".format(result['local_path']) if result['changed'] else
+                        "content of the local file and the file in HDFS is same. Skipping download.")
+
+    elif command in ("ls", "find"):
+        if command == "ls":
+            max_depth = params.get("max_depth") or (0 if recurse else 1)
+        else:
+            max_depth = params.get("max_depth") or 0
+        try:
+            matches = _path_filter(params)
+        except (ValueError, re.error) as e:
+            module.fail_json(path=hdfs_path, msg="{0}".format(e))
+        result = find_paths(module, hdfs_client, hdfs_path=hdfs_path, max_depth=max_depth, matches=matches,
+                            include_root=command == "find", count_only=params.get("count_only"),
+                            output_file=params.get("output_file"))
+        result.update(changed=False,
+                      path=hdfs_path,
+                      msg="found {0} files and {1} directories ({2} bytes).".format(result['files'],
+                                                                                  result['directories'],
+                                                                                  result['bytes']))
+        return result
 
     elif command == "mkdir":
         created_dir = create_directory(module, hdfs_client, hdfs_path)
         if created_dir == False:
-            module.exit_json(changed=False,
-                             path=hdfs_path,
-                             msg="directory already exists.")
+            return dict(changed=False,
+                        path=hdfs_path,
+                        msg="directory already exists.")
         elif created_dir == True:
-            module.exit_json(changed=True,
-                             path=hdfs_path,
-                             msg="created directory.")
+            return dict(changed=True,
+                        path=hdfs_path,
+                        msg="created directory.")
 
-def main():
+def run(module, hdfs_client):
     """
-    Main entry point of the execution.
+    Run's the HDFS Ansible module operations and performs operations with the given HDFS command.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    """
+    with _METRICS.phase("client_init"):
+        order = _use_active_namenode(module, hdfs_client)
+    retries = module.params.get("retries")
+    _share_session(hdfs_client, max(module.params.get("parallelism") or 1, 1),
+                   retries=DEFAULT_RETRIES if retries is None else retries)
+    caching_client = _CachingClient(hdfs_client)
+    plan = _ChangePlan()
+    check_mode = _is_check_mode(module)
+    result_module = _ResultModule(module,
+                                  lambda: dict({"metadata_cache": caching_client.statistics(),
+                                                "metrics": _METRICS.summary()},
+                                               **({"plan": plan.entries} if check_mode else {})),
+                                  plan=plan)
+    try:
+        if module.params.get("operations"):
+            run_operations(result_module, caching_client)
+            return
+
+        result = _run_command(result_module, caching_client, module.params)
+        if result is not None:
+            result_module.exit_json(**result)
+    finally:
+        _remember_active_namenode(module, hdfs_client, order)
+
+class _OperationExit(Exception):
+    """
+    Raised instead of exiting the process when a single entry of `operations` calls exit_json or fail_json.
+    """
+    def __init__(self, result):
+        super(_OperationExit, self).__init__(result.get("msg"))
+        self.result = result
+
+class _OperationModule(object):
+    """
+    Stands in for the Ansible module while one entry of `operations` runs.
+    exit_json and fail_json end only that entry, everything else is delegated to the real module.
+    """
+    def __init__(self, module, params):
+        self._module = module
+        self.params = params
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def exit_json(self, **kwargs):
+        kwargs.setdefault("changed", False)
+        raise _OperationExit(kwargs)
+
+    def fail_json(self, **kwargs):
+        kwargs["failed"] = True
+        raise _OperationExit(kwargs)
+
+def _run_concurrently(parallelism, func, items):
+    """
+    Applies func to every item using at most `parallelism` threads.
+    :param parallelism: maximum number of threads
+    :param func: function to run for every item
+    :param items: items to process
+    :return: list of results in the order of the items.
+    """
+    items = list(items)
+    if parallelism <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(parallelism, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+def _run_streaming(parallelism, func, items):
+    """
+    Applies func to every item of a possibly huge iterable using at most `parallelism` threads.
+    Items are only taken from the iterable as fast as the threads work through them.
+    :param parallelism: maximum number of threads
+    :param func: function to run for every item
+    :param items: iterable of items to process
+    :return: number of processed items. The first error raised by func is raised again.
+    """
+    errors = []
+    if parallelism <= 1:
+        count = 0
+        for item in items:
+            func(item)
+            count += 1
+        return count
+
+    slots = threading.BoundedSemaphore(parallelism * 2)
+
+    def _call(item):
+        try:
+            func(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    count = 0
+    pool = ThreadPool(parallelism)
+    try:
+        for item in items:
+            if errors:
+                break
+            slots.acquire()
+            pool.apply_async(_call, (item,))
+            count += 1
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise errors[0]
+    return count
+
+class _ByteBudget(object):
+    """
+    Bounds the number of bytes in flight across threads.
+    An item larger than the whole budget is let through on its own.
+    """
+    def __init__(self, limit):
+        self._limit = limit
+        self._available = limit
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self._limit)
+        with self._condition:
+            while self._available < size:
+                self._condition.wait()
+            self._available -= size
+        return size
+
+    def release(self, size):
+        with self._condition:
+            self._available += size
+            self._condition.notify_all()
+
+class _RateLimiter(object):
+    """
+    Spaces calls out across threads to at most `rate` calls per second. No limit if rate is not set.
+    """
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0
+        self._next = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.time()
+            wait = self._next - now
+            self._next = max(self._next, now) + self._interval
+        if wait > 0:
+            time.sleep(wait)
+
+class _ConcurrencyLimit(object):
+    """
+    Limits the number of concurrent requests with AIMD: the limit grows by one after a full window of requests
+    answered quickly, and shrinks by half when a request is throttled or by a tenth when the latency of an operation
+    climbs above LATENCY_TOLERANCE times its usual latency. It shrinks at most once per round trip, so that the
+    requests already in flight when the cluster pushed back don't collapse it.
+    """
+    def __init__(self, initial, maximum):
+        self._maximum = max(maximum, 1)
+        self.limit = float(min(max(initial, 1), self._maximum))
+        self._in_flight = 0
+        self._latencies = {}
+        self._decreased = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, operation, latency, throttled=False):
+        """
+        Releases a request and adapts the limit to how it went.
+        :param operation: WebHDFS operation of the request
+        :param latency: seconds until the response arrived
+        :param throttled: if the request was throttled
+        """
+        with self._condition:
+            self._in_flight -= 1
+            usual = self._latencies.get(operation)
+            now = time.time()
+            if throttled or (usual is not None and latency > LATENCY_TOLERANCE * usual):
+                if now - self._decreased > (usual or latency):
+                    self.limit = max(1.0, self.limit * (0.5 if throttled else 0.9))
+                    self._decreased = now
+            else:
+                self.limit = min(float(self._maximum), self.limit + 1.0 / self.limit)
+            if not throttled:
+                # lowest latency seen, slowly following the latency up if it stays higher
+                self._latencies[operation] = latency if usual is None else min(latency, usual + (latency - usual) / 100)
+            self._condition.notify_all()
+
+class _Metrics(object):
+    """
+    Collects the wall time of every phase of a run along with the HTTP requests, bytes and retries it took.
+    Calls of the same phase running concurrently in several threads are timed once: the wall time of a phase
+    is the time during which at least one call of it was running.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Starts the metrics of a new run, e.g. of the next request served by a persistent worker.
+        """
+        with self._lock:
+            self._started = time.time()
+            self._seconds = dict((phase, 0.0) for phase in METRICS_PHASES)
+            self._active = {}
+            self.requests = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.retries = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the wrapped block as part of the given phase.
+        """
+        with self._lock:
+            count, since = self._active.get(name, (0, time.time()))
+            self._active[name] = (count + 1, since)
+        try:
+            yield
+        finally:
+            with self._lock:
+                count, since = self._active.pop(name)
+                if count > 1:
+                    self._active[name] = (count - 1, since)
+                else:
+                    self._seconds[name] = self._seconds.get(name, 0.0) + time.time() - since
+
+    def record(self, operation, sent=0, received=0, retries=0, attempts=1):
+        """
+        Counts the HTTP requests sent for a request of the given WebHDFS operation.
+        """
+        with self._lock:
+            self.requests[operation] = self.requests.get(operation, 0) + attempts
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.retries += retries
+
+    def sent(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def summary(self):
+        """
+        Returns the metrics of the run so far, as reported in the module result.
+        """
+        now = time.time()
+        with self._lock:
+            seconds = dict(self._seconds)
+            for name, (_, since) in self._active.items():
+                seconds[name] = seconds.get(name, 0.0) + now - since
+            seconds["total"] = now - self._started
+            return {"seconds": dict((name, round(value, 3)) for name, value in seconds.items()),
+                    "requests": sum(self.requests.values()),
+                    "requests_by_operation": dict(self.requests),
+                    "bytes_sent": self.bytes_sent,
+                    "bytes_received": self.bytes_received,
+                    "retries": self.retries}
+
+_METRICS = _Metrics()
+
+class _MeteredAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTP adapter shared by all the requests of a run. It times every request in the phase of its WebHDFS operation
+    and counts it in the metrics. Requests to the NameNode are scheduled: they wait for a slot of the concurrency
+    limit, and the ones the NameNode throttles are sent again after a jittered exponential backoff.
+    """
+    def __init__(self, metrics, failover=False, namenode_urls=(), limit=None, retries=DEFAULT_RETRIES, **kwargs):
+        self._metrics = metrics
+        self._failover = failover
+        self._namenode_urls = tuple(url.rstrip("/") + "/" for url in namenode_urls)
+        self._limit = limit
+        self._retries = retries
+        super(_MeteredAdapter, self).__init__(**kwargs)
+
+    @staticmethod
+    def _throttled(response):
+        return response.status_code in THROTTLED_STATUSES or \
+            (response.status_code >= 400 and THROTTLED_EXCEPTION in response.content)
+
+    @staticmethod
+    def _backoff(attempt, response):
+        """
+        Returns the seconds to wait before the given retry: a random time up to the exponential backoff ("full
+        jitter") so that the threads throttled at the same time don't all come back at the same time, but at least
+        what the NameNode asked for with Retry-After.
+        """
+        backoff = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+        try:
+            return max(backoff, min(float(response.headers.get("Retry-After", 0)), RETRY_BACKOFF_MAX))
+        except ValueError:
+            return backoff
+
+    def _send_scheduled(self, request, operation, **kwargs):
+        """
+        Sends a NameNode request within the concurrency limit, retrying it while it's throttled.
+        :return: response and number of retries.
+        """
+        # bodies that were streamed can't be sent again
+        retries = self._retries if request.body is None or isinstance(request.body, bytes) else 0
+        attempt = 0
+        while True:
+            self._limit.acquire()
+            started = time.time()
+            throttled = False
+            try:
+                response = super(_MeteredAdapter, self).send(request, **kwargs)
+                throttled = self._throttled(response)
+            finally:
+                self._limit.release(operation, time.time() - started, throttled)
+            if not throttled or attempt >= retries:
+                return response, attempt
+            response.close()
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    def _counted(self, body):
+        for chunk in body:
+            self._metrics.sent(len(chunk))
+            yield chunk
+
+    def send(self, request, **kwargs):
+        match = WEBHDFS_OPERATION.search(request.url)
+        operation = match.group(1).upper() if match else "OTHER"
+        sent = 0
+        if request.body is not None:
+            if "Content-Length" in request.headers:
+                sent = int(request.headers["Content-Length"])
+            else:
+                # chunked upload, counted as it is sent
+                request.body = self._counted(request.body)
+        with self._metrics.phase(OPERATION_PHASES.get(operation, "update")):
+            if self._limit is not None and request.url.startswith(self._namenode_urls):
+                response, scheduled_retries = self._send_scheduled(request, operation, **kwargs)
+            else:
+                response, scheduled_retries = super(_MeteredAdapter, self).send(request, **kwargs), 0
+        if "Content-Length" in response.headers:
+            received = int(response.headers["Content-Length"])
+        else:
+            received = 0 if kwargs.get("stream") else len(response.content)
+        retries = scheduled_retries + len(getattr(getattr(response.raw, "retries", None), "history", None) or ())
+        if self._failover and response.status_code >= 400 and \
+                any(exception in response.content for exception in (b"StandbyException", THROTTLED_EXCEPTION)):
+            # the hdfs client tries the next NameNode
+            retries += 1
+        self._metrics.record(operation, sent=sent, received=received, retries=retries,
+                             attempts=1 + scheduled_retries)
+        return response
+
+def _share_session(hdfs_client, parallelism, retries=DEFAULT_RETRIES):
+    """
+    Sizes the connection pool of the client's HTTP session so that all the threads reuse its connections,
+    schedules its NameNode requests and counts its requests in the metrics of the run.
+    :param hdfs_client: HDFS client
+    :param parallelism: number of threads sharing the client
+    :param retries: number of times a throttled NameNode request is sent again
+    """
+    # a client kept by a persistent worker keeps its connections and the limit learned by its earlier runs
+    if getattr(hdfs_client, "_shared_session", None) == (parallelism, retries):
+        return
+    hdfs_client._shared_session = (parallelism, retries)
+    # entries of `operations` may each run their own pool of threads
+    limit = _ConcurrencyLimit(parallelism, parallelism * parallelism)
+    adapter = _MeteredAdapter(_METRICS, failover=len(hdfs_client.urls) > 1, namenode_urls=hdfs_client.urls,
+                              limit=limit, retries=retries, pool_connections=parallelism,
+                              pool_maxsize=parallelism * parallelism)
+    hdfs_client._session.mount("http://", adapter)
+    hdfs_client._session.mount("https://", adapter)
+
+def _namenode_urls(webhdfs_url):
+    """
+    Returns the NameNode URLs of the webhdfs_url option, a list of URLs or a string of URLs separated by semicolons.
+    """
+    if not isinstance(webhdfs_url, list):
+        webhdfs_url = [webhdfs_url]
+    return [url.strip() for entry in webhdfs_url for url in str(entry).split(";") if url.strip()]
+
+def _probe_namenode(hdfs_client, url):
+    """
+    Finds the HA state of a NameNode with a GETFILESTATUS of the root directory. The probe is counted in the metrics
+    but its standby answer isn't a retry.
+    :param hdfs_client: HDFS client, its session is used for the request
+    :param url: WebHDFS URL of the NameNode
+    :return: one of NAMENODE_STATES.
+    """
+    try:
+        response = hdfs_client._session.get("{0}/webhdfs/v1/?op=GETFILESTATUS".format(url.rstrip("/")),
+                                            timeout=NAMENODE_TIMEOUT)
+    except requests.exceptions.RequestException:
+        return "unreachable"
+    _METRICS.record("GETFILESTATUS", received=len(response.content))
+    if response.ok:
+        return "active"
+    if b"StandbyException" in response.content:
+        return "standby"
+    return "unknown"
+
+def _load_cache_file(cache_file):
+    try:
+        with open(cache_file) as cache:
+            return json.load(cache)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _update_cache_file(cache_file, key, entry):
+    """
+    Stores an entry of a JSON cache file shared by the tasks of all the hosts, or removes it if entry is None.
+    The file is only readable by its owner and replaced atomically, as other tasks may update it at the same time.
+    """
+    cache = _load_cache_file(cache_file)
+    if entry is None:
+        cache.pop(key, None)
+    else:
+        cache[key] = entry
+    directory = os.path.dirname(cache_file)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_file = "{0}.temp-{1}-{2}".format(cache_file, os.getpid(), threading.current_thread().ident)
+    with os.fdopen(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as output:
+        json.dump(cache, output)
+    os.rename(temp_file, cache_file)
+
+def _use_active_namenode(module, hdfs_client):
+    """
+    Makes the HDFS client of a HA cluster send its requests to the active NameNode first. The order is taken from
+    the NameNode cache while it's fresh, otherwise all the NameNodes are probed at the same time.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client with several NameNode URLs
+    :return: the order the NameNodes are tried in, None for a single NameNode.
+    """
+    urls = list(hdfs_client.urls)
+    if len(urls) < 2:
+        return None
+    cache_file = os.path.expanduser(module.params.get("namenode_cache") or DEFAULT_NAMENODE_CACHE)
+    ttl = module.params.get("namenode_cache_ttl")
+    ttl = DEFAULT_NAMENODE_CACHE_TTL if ttl is None else ttl
+    key = ";".join(sorted(urls))
+    cached = _load_cache_file(cache_file).get(key)
+    if cached and time.time() - cached.get("checked", 0) < ttl and sorted(cached.get("order", [])) == sorted(urls):
+        order = cached["order"]
+    else:
+        states = _run_concurrently(len(urls), lambda url: _probe_namenode(hdfs_client, url), urls)
+        order = [url for _, url in sorted(zip(states, urls), key=lambda item: NAMENODE_STATES.index(item[0]))]
+        try:
+            _update_cache_file(cache_file, key, {"order": order, "checked": time.time()})
+        except (IOError, OSError):
+            pass
+    with hdfs_client._lock:
+        hdfs_client._urls.clear()
+        hdfs_client._urls.extend(order)
+    return order
+
+def _remember_active_namenode(module, hdfs_client, order):
+    """
+    Updates the NameNode cache if the client failed over to another NameNode during the run.
+    """
+    if order is None or hdfs_client._urls[0] == order[0]:
+        return
+    active = hdfs_client._urls[0]
+    try:
+        _update_cache_file(os.path.expanduser(module.params.get("namenode_cache") or DEFAULT_NAMENODE_CACHE),
+                           ";".join(sorted(order)),
+                           {"order": [active] + [url for url in order if url != active], "checked": time.time()})
+    except (IOError, OSError):
+        pass
+
+class _DelegationTokenAuth(requests.auth.AuthBase):
+    """
+    Authenticates WebHDFS requests with a delegation token rather than with a SPNEGO negotiation per request.
+    The token is fetched with a single negotiation and kept in a cache file by principal and cluster, so that the
+    tasks of all the hosts reuse it until it's about to expire. A request rejected because the token was cancelled
+    or expired early is sent again, once, with a new token.
+    """
+    def __init__(self, urls, principal, cache_file, negotiate_auth, timeout=None):
+        self._urls = urls
+        self._principal = principal
+        self._cache_file = cache_file
+        self._negotiate_auth = negotiate_auth
+        self._timeout = timeout
+        self._key = "{0} {1}".format(principal, ";".join(sorted(urls)))
+        self._token = None
+        self._lock = threading.Lock()
+
+    def token(self, rejected=None):
+        """
+        Returns the delegation token, from the cache file if it holds a fresh one, otherwise a new one.
+        :param rejected: token the cluster rejected, never returned again
+        """
+        with self._lock:
+            if self._token is not None and self._token != rejected:
+                return self._token
+            entry = _load_cache_file(self._cache_file).get(self._key)
+            if entry and entry.get("token") != rejected and entry.get("expires", 0) > time.time():
+                self._token = entry["token"]
+                return self._token
+            self._token = self._fetch()
+            try:
+                _update_cache_file(self._cache_file, self._key,
+                                   {"token": self._token, "expires": time.time() + DELEGATION_TOKEN_LIFETIME})
+            except (IOError, OSError):
+                pass
+            return self._token
+
+    def _fetch(self):
+        session = requests.Session()
+        session.auth = self._negotiate_auth
+        client = Client(";".join(self._urls), timeout=self._timeout, session=session)
+        # the short name of the principal, e.g. hdfs for hdfs/host@REALM, may renew the token
+        response = _get_delegation_token(client, "/", renewer=self._principal.split("@")[0].split("/")[0])
+        _METRICS.record("GETDELEGATIONTOKEN", received=len(response.content), attempts=len(response.history) + 1)
+        return response.json()["Token"]["urlString"]
+
+    def __call__(self, request):
+        # requests redirected to a DataNode already carry the token
+        if "delegation=" not in request.url:
+            request.prepare_url(request.url, {"delegation": self.token()})
+        request.register_hook("response", self._retry_rejected)
+        return request
+
+    def _retry_rejected(self, response, **kwargs):
+        request = response.request
+        rejected = DELEGATION_PARAMETER.search(request.url)
+        if response.status_code not in (401, 403) or rejected is None or getattr(request, "token_retried", False) \
+                or INVALID_TOKEN_EXCEPTION not in response.content \
+                or not (request.body is None or isinstance(request.body, bytes)):
+            return response
+        token = self.token(rejected=requests.utils.unquote(rejected.group(2)))
+        retry = request.copy()
+        retry.prepare_url(DELEGATION_PARAMETER.sub(r"\1", request.url).rstrip("?&"), {"delegation": token})
+        retry.token_retried = True
+        response.close()
+        retried = response.connection.send(retry, **kwargs)
+        retried.history.append(response)
+        retried.request = retry
+        return retried
+
+def _default_principal(module):
+    """
+    Returns the default principal of the Kerberos credential cache, or the user name if klist can't tell.
+    """
+    klist = module.get_bin_path("klist")
+    if klist:
+        rc, out, _ = module.run_command([klist])
+        match = re.search(r"Default principal:\s*(\S+)", out or "")
+        if rc == 0 and match:
+            return match.group(1)
+    return getpass.getuser()
+
+def _kerberos_client(module, webhdfs_url, timeout=None, negotiate_auth=None):
+    """
+    Creates a HDFS client for a kerberized cluster, authenticating with a cached delegation token.
+    :param module: Ansible module
+    :param webhdfs_url: NameNode URLs separated by semicolons
+    :param timeout: timeout of the requests
+    :param negotiate_auth: requests auth for the SPNEGO negotiation, HTTPKerberosAuth by default
+    :return: HDFS client.
+    """
+    if negotiate_auth is None:
+        if not HAS_REQUESTS_KERBEROS:
+            module.fail_json(msg="requests-kerberos is required for authentication=kerberos.")
+        negotiate_auth = HTTPKerberosAuth(mutual_authentication=OPTIONAL)
+    session = requests.Session()
+    session.auth = _DelegationTokenAuth(_namenode_urls(webhdfs_url),
+                                        module.params.get("principal") or _default_principal(module),
+                                        os.path.expanduser(module.params.get("delegation_token_cache") or
+                                                           DEFAULT_DELEGATION_TOKEN_CACHE),
+                                        negotiate_auth, timeout=timeout)
+    return Client(webhdfs_url, timeout=timeout, session=session)
+
+def _glob_prefix(hdfs_path):
+    """
+    Returns the part of a HDFS path before its first component with glob characters, every path it matches is
+    below it. A path without glob characters is returned as is.
+    """
+    parts = hdfs_path.split("/")
+    for index, part in enumerate(parts):
+        if GLOB_CHARACTERS.search(part):
+            return "/".join(parts[:index]) or "/"
+    return hdfs_path
+
+def _paths_overlap(path, other_path):
+    """
+    Checks if one of the HDFS paths is the same as or is nested under the other one. A glob pattern, e.g. of "rm",
+    overlaps everything below its non-glob prefix.
+    """
+    path = _glob_prefix(path).rstrip("/") + "/"
+    other_path = _glob_prefix(other_path).rstrip("/") + "/"
+    return path.startswith(other_path) or other_path.startswith(path)
+
+def _group_operations(operations):
+    """
+    Groups the operations into chains whose entries touch overlapping paths.
+    Entries of a chain keep their order and run one after the other, separate chains are independent.
+    :param operations: list of operation parameters
+    :return: list of chains, each one a list of indexes into operations.
+    """
+    chains = []
+    for index, operation in enumerate(operations):
+        overlapping = [chain for chain in chains
+                       if any(_paths_overlap(operation["path"], operations[i]["path"]) for i in chain)]
+        merged = sorted([i for chain in overlapping for i in chain] + [index])
+        chains = [chain for chain in chains if chain not in overlapping] + [merged]
+    return chains
+
+def _operation_params(module, operation):
+    """
+    Builds the parameters of one entry of `operations`. Options missing in the entry fall back to the module options.
+    :param module: Ansible module
+    :param operation: entry of `operations`
+    :return: parameters for the command of the entry.
+    """
+    if not isinstance(operation, dict):
+        module.fail_json(msg="operations entries should be dictionaries, got: {0}".format(operation))
+    unknown = set(operation) - set(OPERATION_OPTIONS)
+    if unknown:
+        module.fail_json(msg="unsupported options in operations entry: {0}".format(", ".join(sorted(unknown))))
+    if operation.get("command") not in COMMANDS:
+        module.fail_json(msg="command of operations entry should be one of: {0}, got: {1}"
+                         .format(", ".join(COMMANDS), operation.get("command")))
+    if not operation.get("path"):
+        module.fail_json(msg="path of operations entry should not be empty.")
+
+    params = dict(module.params)
+    params.pop("operations", None)
+    params.update(operation)
+    params["recurse"] = boolean(params["recurse"]) if params["recurse"] is not None else False
+    return params
+
+def _run_operation(module, hdfs_client, params):
+    """
+    Runs one entry of `operations` and collects its result instead of exiting.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    :param params: parameters of the entry
+    :return: result dictionary of the entry.
+    """
+    try:
+        result = _run_command(_OperationModule(module, params), hdfs_client, params)
+    except _OperationExit as e:
+        result = e.result
+    except (HdfsError, Exception) as e:
+        result = dict(failed=True, msg="{0}".format(e))
+    result = dict(result or {})
+    result.setdefault("changed", False)
+    result.setdefault("path", params["path"])
+    result["command"] = params["command"]
+    return result
+
+def run_operations(module, hdfs_client):
+    """
+    Runs all the entries of `operations` over the same HDFS client.
+    Entries on unrelated paths run concurrently, up to `parallelism` at a time.
+    :param module: Ansible module
+    :param hdfs_client: HDFS client
+    """
+    parallelism = max(module.params.get("parallelism") or 1, 1)
+    operations = [_operation_params(module, operation) for operation in module.params["operations"]]
+    results = [None] * len(operations)
+
+    def _run_chain(chain):
+        for index in chain:
+            results[index] = _run_operation(module, hdfs_client, operations[index])
+
+    _run_concurrently(parallelism, _run_chain, _group_operations(operations))
+
+    changed = any(result["changed"] for result in results)
+    failed = [result for result in results if result.get("failed")]
+    if failed:
+        module.fail_json(changed=changed, results=results,
+                         msg="{0} of {1} operations failed.".format(len(failed), len(results)))
+    module.exit_json(changed=changed, results=results,
+                     msg="{0} operations, {1} changed.".format(len(results),
+                                                               len([r for r in results if r["changed"]])))
+
+class _WorkerModule(AnsibleModule):
+    """
+    Ansible module of a request served by a persistent worker. exit_json and fail_json end the request with the
+    result sent back to the module that forwarded it, instead of exiting the worker.
+    """
+    def exit_json(self, **kwargs):
+        kwargs.setdefault("changed", False)
+        raise _OperationExit(kwargs)
+
+    def fail_json(self, msg=None, **kwargs):
+        kwargs.update(failed=True, msg=msg)
+        raise _OperationExit(kwargs)
+
+def _worker_socket(worker_dir=DEFAULT_WORKER_DIR):
+    """
+    Returns the socket of the persistent worker of the current user and version of the module.
+    A new version of the module starts its own worker, the old one exits once it's idle.
+    """
+    try:
+        source = inspect.getsource(sys.modules[__name__])
+    except (IOError, OSError, TypeError):
+        source = ""
+    version = hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(os.path.expanduser(worker_dir), "hdfs_operations-{0}.sock".format(version))
+
+def _read_all(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(64 * 1024)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+def _call_worker(socket_path, args):
+    """
+    Sends the module arguments of a request to a persistent worker and returns its result.
+    The arguments are only sent once the worker takes the request, so a worker that doesn't within
+    WORKER_READY_TIMEOUT seconds, e.g. stuck in the request of another task, never runs it.
+    Raises socket.error, socket.timeout included, if no worker takes the request, and ValueError if the worker
+    ends without a result.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(WORKER_READY_TIMEOUT)
+        connection.connect(socket_path)
+        if connection.recv(len(WORKER_READY)) != WORKER_READY:
+            raise socket.error("the persistent worker closed the connection.")
+        connection.sendall(json.dumps(args).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        connection.settimeout(WORKER_RESULT_TIMEOUT)
+        try:
+            return json.loads(_read_all(connection).decode("utf-8"))
+        except socket.timeout:
+            # the worker may still be running the request, it isn't run a second time
+            return dict(failed=True, msg="the persistent worker didn't return the result within {0} seconds."
+                        .format(WORKER_RESULT_TIMEOUT))
+    finally:
+        connection.close()
+
+def _worker_listening(socket_path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        connection.close()
+
+def _serve_request(clients, args):
+    """
+    Runs one request of a persistent worker, with the warm client of its cluster.
+    :param clients: HDFS clients of the worker by cluster, authentication and session settings
+    :param args: module arguments of the request
+    :return: result of the request.
+    """
+    _METRICS.reset()
+    basic._ANSIBLE_ARGS = json.dumps({"ANSIBLE_MODULE_ARGS": args}).encode("utf-8")
+    try:
+        with _METRICS.phase("client_init"):
+            module = _WorkerModule(**_module_spec())
+            params = module.params
+            key = json.dumps([_namenode_urls(params["webhdfs_url"]), params["authentication"], params["principal"],
+                              params["delegation_token_cache"], params["parallelism"], params["retries"]])
+            if key not in clients:
+                clients[key] = _create_client(module)
+        run(module, clients[key])
+    except _OperationExit as e:
+        return e.result
+    except Exception as e:
+        return dict(failed=True, msg="{0}".format(e))
+    return dict(changed=False)
+
+def _serve_worker(socket_path, idle_timeout):
+    """
+    Serves the requests sent to the socket one after the other, until none comes for idle_timeout seconds.
+    The HDFS clients, with their connection pools, delegation tokens and NameNode order, are kept between requests.
+    """
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+    server.settimeout(idle_timeout)
+    clients = {}
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                break
+            with contextlib.closing(connection):
+                connection.settimeout(None)
+                try:
+                    connection.sendall(WORKER_READY)
+                    request = _read_all(connection)
+                except socket.error:
+                    # the module gave up waiting for the worker
+                    continue
+                if not request:
+                    # a module checking that the worker is listening
+                    continue
+                try:
+                    result = _serve_request(clients, json.loads(request.decode("utf-8")))
+                except SystemExit:
+                    result = dict(failed=True, msg="the request exited the persistent worker.")
+                connection.sendall(json.dumps(result).encode("utf-8"))
+    finally:
+        # no request can reach the worker once the socket is removed, the next one starts a new worker
+        os.remove(socket_path)
+        server.close()
+
+def _start_worker(socket_path, idle_timeout):
+    """
+    Starts a persistent worker detached from the module, forked with the imports the module already paid for.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            if os.fork() == 0:
+                os.chdir("/")
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in (0, 1, 2):
+                    os.dup2(devnull, fd)
+                _serve_worker(socket_path, idle_timeout)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    deadline = time.time() + WORKER_START_TIMEOUT
+    while not _worker_listening(socket_path):
+        if time.time() > deadline:
+            raise OSError("the persistent worker didn't start on {0}".format(socket_path))
+        time.sleep(0.01)
+
+def _forward_to_worker(module):
+    """
+    Runs the request of the module in the persistent worker, after starting it if it isn't running.
+    :param module: Ansible module
+    :return: result of the request, None if no worker can be used and the module runs the request itself.
+    """
+    socket_path = _worker_socket()
+    # unset options count as given to the worker, e.g. for mutually_exclusive
+    args = dict((name, value) for name, value in module.params.items() if value is not None)
+    args["_ansible_check_mode"] = module.check_mode
+    try:
+        if not _worker_listening(socket_path):
+            worker_dir = os.path.dirname(socket_path)
+            if not os.path.isdir(worker_dir):
+                os.makedirs(worker_dir, 0o700)
+            # one task starts the worker, the others wait for it
+            with open(socket_path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not _worker_listening(socket_path):
+                    _start_worker(socket_path, module.params["persistent_idle_timeout"])
+        return _call_worker(socket_path, args)
+    except ValueError:
+        return dict(failed=True, msg="the persistent worker ended before returning the result.")
+    except (IOError, OSError) as e:
+        module.warn("no persistent worker, the module runs the request itself: {0}".format(e))
+        return None
+
+def _module_spec():
+    """
+    Returns the keyword arguments of the Ansible module: the argument spec and the constraints between options.
     """
     fields = {
-        "webhdfs_url": {"required": True, "type": "str"},
-        "path": {"required": True, "type": "str"},
-        "command": {"required": True,
-                    "choices": ["rm", "chown", "chgrp", "chmod", "put", "mkdir"],
+        "webhdfs_url": {"required": True, "type": "list"},
+        "path": {"required": False, "type": "str"},
+        "command": {"required": False,
+                    "choices": COMMANDS,
                     "type": "str"},
         "recurse": {"default": False, "type": "bool"},
         "local_path": {"required": False, "type": "str"},
         "owner": {"required": False, "type": "str"},
         "group": {"required": False, "type": "str"},
         "permission": {"required": False, "type": "str"},
+        "operations": {"required": False, "type": "list"},
+        "parallelism": {"default": 8, "type": "int"},
+        "max_bytes_in_flight": {"default": DEFAULT_MAX_BYTES_IN_FLIGHT, "type": "int"},
+        "resumable": {"default": False, "type": "bool"},
+        "chunk_size": {"default": DEFAULT_CHUNK_SIZE, "type": "int"},
+        "upload_journal": {"default": DEFAULT_UPLOAD_JOURNAL, "type": "path"},
+        "parallel_upload": {"default": False, "type": "bool"},
+        "block_size": {"default": DEFAULT_BLOCK_SIZE, "type": "int"},
+        "max_depth": {"required": False, "type": "int"},
+        "pattern": {"required": False, "type": "list"},
+        "regex": {"required": False, "type": "str"},
+        "file_type": {"required": False, "choices": ["file", "directory"], "type": "str"},
+        "older_than": {"required": False, "type": "str"},
+        "newer_than": {"required": False, "type": "str"},
+        "larger_than": {"required": False, "type": "str"},
+        "smaller_than": {"required": False, "type": "str"},
+        "count_only": {"default": False, "type": "bool"},
+        "trash": {"default": False, "type": "bool"},
+        "delete": {"default": False, "type": "bool"},
+        "checksum": {"default": False, "type": "bool"},
+        "rate_limit": {"required": False, "type": "float"},
+        "retries": {"default": DEFAULT_RETRIES, "type": "int"},
+        "output_file": {"required": False, "type": "path"},
+        "checksum_manifest": {"required": False, "type": "path"},
+        "checksum_manifest_size": {"default": DEFAULT_MANIFEST_ENTRIES, "type": "int"},
+        "namenode_cache": {"default": DEFAULT_NAMENODE_CACHE, "type": "path"},
+        "namenode_cache_ttl": {"default": DEFAULT_NAMENODE_CACHE_TTL, "type": "int"},
+        "authentication": {"default": "simple", "choices": ["simple", "kerberos"], "type": "str"},
+        "principal": {"required": False, "type": "str"},
+        "delegation_token_cache": {"default": DEFAULT_DELEGATION_TOKEN_CACHE, "type": "path"},
+        # read by the action plugin, the module itself runs where it's started
+        "run_on": {"default": "host", "choices": ["controller", "host"], "type": "str"},
+        "persistent": {"default": False, "type": "bool"},
+        "persistent_idle_timeout": {"default": DEFAULT_WORKER_IDLE_TIMEOUT, "type": "int"},
     }
+    return dict(argument_spec=fields,
+                required_one_of=[["command", "operations"]],
+                mutually_exclusive=[["command", "operations"]],
+                required_together=[["command", "path"]],
+                supports_check_mode=True)
+
+def _create_client(module):
+    """
+    Creates the HDFS client of the cluster and authentication given by the module parameters.
+    """
+    webhdfs_url = ";".join(_namenode_urls(module.params["webhdfs_url"]))
+    # with several NameNodes, one that is down shouldn't hold the task up until the OS gives up connecting
+    timeout = (NAMENODE_TIMEOUT, None) if ";" in webhdfs_url else None
+    if module.params["authentication"] == "kerberos":
+        return _kerberos_client(module, webhdfs_url, timeout=timeout)
+    return InsecureClient(webhdfs_url, timeout=timeout)
+
+def main():
+    """
+    Main entry point of the execution.
+    """
+    with _METRICS.phase("client_init"):
+        module = AnsibleModule(**_module_spec())
 
-    module = AnsibleModule(argument_spec=fields, supports_check_mode=True)
+    if module.params["persistent"]:
+        result = _forward_to_worker(module)
+        if result is not None:
+            if result.get("failed"):
+                module.fail_json(**result)
+            module.exit_json(**result)
 
     try:
         params = module.params
-        webhdfs_url = params["webhdfs_url"]
+        webhdfs_url = ";".join(_namenode_urls(params["webhdfs_url"]))
 
-        hdfs_client = InsecureClient(webhdfs_url)
-        # hdfs_client = KerberosClient(webhdfs_url)
+        with _METRICS.phase("client_init"):
+            hdfs_client = _create_client(module)
         run(module, hdfs_client)
 
     except Exception as e:
         module.fail_json(msg="Unable to init WEB HDFS client for {0}: {1}".format(webhdfs_url, str(e)))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
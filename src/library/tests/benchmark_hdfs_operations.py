@@ -0,0 +1,230 @@
+"""
+Benchmarks of the hdfs_operations module against the in-process WebHDFS stand-in.
+
+Every command runs through main(), the same way Ansible runs the module, against a server with a fixed latency
+per request and a fixed bandwidth per stream. For each scenario the suite reports operations per second,
+throughput and round trips per operation. A scenario fails when it needs more round trips than its budget,
+or when a parallel transfer doesn't scale over a single stream, so performance regressions fail a local run:
+
+    python -m pytest src/library/tests/benchmark_hdfs_operations.py
+
+BENCHMARK_OUTPUT=<file> also writes the results as JSON.
+"""
+import os
+# --------
+import sys
+dirname, filename = os.path.split(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(dirname)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# --------
+
+import io
+import json
+import shutil
+import tempfile
+import time
+import unittest
+import hdfs_operations
+from ansible.module_utils import basic
+from hdfs import InsecureClient
+from webhdfs_server import WebHDFSServer
+
+# seconds added to every request, and bytes per second of every stream
+LATENCY = 0.002
+BANDWIDTH = 8 * 1024 * 1024
+
+def _run_module(args):
+    """
+    Runs the module main() in-process with the given module arguments.
+    :return: the result the module exits with.
+    """
+    basic._ANSIBLE_ARGS = json.dumps({"ANSIBLE_MODULE_ARGS": args}).encode("utf-8")
+    if hasattr(basic, "_ANSIBLE_PROFILE"):
+        basic._ANSIBLE_PROFILE = "legacy"
+    stdout = sys.stdout
+    sys.stdout = io.BytesIO() if sys.version_info[0] == 2 else io.StringIO()
+    try:
+        hdfs_operations.main()
+    except SystemExit:
+        pass
+    finally:
+        output, sys.stdout = sys.stdout.getvalue(), stdout
+    return json.loads(output)
+
+class BenchmarkHDFSOperations(unittest.TestCase):
+    results = []
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = WebHDFSServer(latency=LATENCY, bandwidth=BANDWIDTH).start()
+        cls.hdfs_client = InsecureClient(cls.server.url)
+        cls.local_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.local_dir)
+        print("\n{0:<28} {1:>6} {2:>10} {3:>12} {4:>12}".format("scenario", "ops", "ops/sec", "MB/sec",
+                                                                 "requests/op"))
+        for result in cls.results:
+            print("{scenario:<28} {ops:>6} {ops_per_second:>10.1f} {mb_per_second:>12.1f} "
+                  "{requests_per_op:>12.1f}".format(**result))
+        if os.environ.get("BENCHMARK_OUTPUT"):
+            with open(os.environ["BENCHMARK_OUTPUT"], "w") as output:
+                json.dump(cls.results, output, indent=2)
+
+    def setUp(self):
+        self.hdfs_client.delete("/bench", recursive=True)
+        self.hdfs_client.makedirs("/bench")
+
+    def _local_file(self, name, size):
+        path = os.path.join(self.local_dir, name)
+        with open(path, "wb") as file:
+            file.write(os.urandom(size))
+        return path
+
+    def _local_tree(self, name, directories, files_per_directory, size=256):
+        root = os.path.join(self.local_dir, name)
+        for directory in range(directories):
+            os.makedirs(os.path.join(root, "dir-{0}".format(directory)))
+            for index in range(files_per_directory):
+                self._local_file(os.path.join(name, "dir-{0}".format(directory), "file-{0}".format(index)), size)
+        return root
+
+    def _measure(self, scenario, args, ops=1, budget=None, transferred=0):
+        """
+        Runs the module once per entry of args and records the results of the scenario.
+        :param scenario: name of the scenario
+        :param args: list of module arguments, one per run
+        :param ops: number of operations performed by all the runs
+        :param budget: maximum number of requests per operation
+        :param transferred: number of bytes transferred by all the runs
+        :return: recorded results.
+        """
+        self.server.reset_counters()
+        start = time.time()
+        for module_args in args:
+            result = _run_module(dict(module_args, webhdfs_url=self.server.url))
+            self.assertFalse(result.get("failed"), result.get("msg"))
+        elapsed = time.time() - start
+        result = {"scenario": scenario,
+                  "ops": ops,
+                  "seconds": elapsed,
+                  "ops_per_second": ops / elapsed,
+                  "mb_per_second": transferred / elapsed / 1024 / 1024,
+                  "requests": self.server.requests,
+                  "requests_per_op": float(self.server.requests) / ops,
+                  "operations": dict(self.server.ops)}
+        self.results.append(result)
+        if budget is not None:
+            self.assertLessEqual(result["requests_per_op"], budget,
+                                 "{0} needs {1} requests per operation, more than {2}: {3}".format(
+                                     scenario, result["requests_per_op"], budget, result["operations"]))
+        return result
+
+    def test_mkdir(self):
+        self._measure("mkdir", [{"command": "mkdir", "path": "/bench/dir-{0}".format(index)} for index in range(20)],
+                      ops=20, budget=2)
+
+    def test_chown_chgrp_chmod(self):
+        self.hdfs_client.write("/bench/file", data=b"x")
+        args = []
+        for index in range(10):
+            args += [{"command": "chown", "path": "/bench/file", "owner": "user-{0}".format(index)},
+                     {"command": "chgrp", "path": "/bench/file", "group": "group-{0}".format(index)},
+                     {"command": "chmod", "path": "/bench/file", "permission": "0{0}".format(640 + index % 2)}]
+        self._measure("chown/chgrp/chmod", args, ops=30, budget=2)
+
+    def test_recursive_chmod(self):
+        for directory in range(10):
+            for index in range(20):
+                self.hdfs_client.write("/bench/tree/dir-{0}/file-{1}".format(directory, index), data=b"x")
+        self._measure("chmod recursive (211 paths)", [{"command": "chmod", "path": "/bench/tree",
+                                                       "permission": "0600", "recurse": True}],
+                      ops=211, budget=1.2)
+
+    def test_recursive_chmod_throttled(self):
+        for directory in range(10):
+            for index in range(20):
+                self.hdfs_client.write("/bench/tree/dir-{0}/file-{1}".format(directory, index), data=b"x")
+        # the NameNode turns down one request in ten
+        self.server.inject_fault(op="SETPERMISSION", count=21, status=503, exception="RetriableException", every=10)
+        self._measure("chmod recursive, throttled", [{"command": "chmod", "path": "/bench/tree",
+                                                      "permission": "0600", "recurse": True}],
+                      ops=211, budget=1.3)
+
+    def test_put_new_files(self):
+        local_files = [self._local_file("new-{0}".format(index), 64 * 1024) for index in range(10)]
+        self._measure("put new file", [{"command": "put", "path": "/bench", "local_path": local_file}
+                                       for local_file in local_files],
+                      ops=10, budget=4, transferred=10 * 64 * 1024)
+
+    def test_put_unchanged_files(self):
+        local_files = [self._local_file("same-{0}".format(index), 64 * 1024) for index in range(10)]
+        for local_file in local_files:
+            self.hdfs_client.upload("/bench", local_file)
+        self._measure("put unchanged file", [{"command": "put", "path": "/bench", "local_path": local_file}
+                                             for local_file in local_files],
+                      ops=10, budget=3)
+
+    def test_put_directory(self):
+        local_root = self._local_tree("put-tree", 10, 20)
+        self._measure("put directory (200 files)", [{"command": "put", "path": "/bench", "local_path": local_root}],
+                      ops=200, budget=2.2, transferred=200 * 256)
+        self._measure("put directory unchanged", [{"command": "put", "path": "/bench", "local_path": local_root,
+                                                   "checksum_manifest": os.path.join(self.local_dir, "manifest")}],
+                      ops=200, budget=1.2)
+
+    def test_sync_unchanged(self):
+        local_root = self._local_tree("sync-tree", 10, 20)
+        _run_module({"webhdfs_url": self.server.url, "command": "sync", "path": "/bench", "local_path": local_root})
+        # one listing per directory
+        self._measure("sync unchanged (200 files)", [{"command": "sync", "path": "/bench", "local_path": local_root}],
+                      ops=200, budget=0.1)
+
+    def test_ls_and_find(self):
+        for index in range(500):
+            self.hdfs_client.write("/bench/list/file-{0}".format(index), data=b"x")
+        self._measure("ls (500 entries)", [{"command": "ls", "path": "/bench/list", "count_only": True}],
+                      ops=500, budget=0.02)
+        self._measure("find (500 entries)", [{"command": "find", "path": "/bench", "pattern": "file-1*"}],
+                      ops=502, budget=0.02)
+
+    def test_rm(self):
+        for index in range(20):
+            self.hdfs_client.write("/bench/rm/file-{0}".format(index), data=b"x")
+        self._measure("rm", [{"command": "rm", "path": "/bench/rm/file-{0}".format(index)} for index in range(10)],
+                      ops=10, budget=1)
+        self._measure("rm glob (10 files)", [{"command": "rm", "path": "/bench/rm/file-1*"}], ops=10, budget=1.3)
+
+    def test_operations_batch(self):
+        operations = [{"command": "mkdir", "path": "/bench/batch-{0}".format(index)} for index in range(20)]
+        self._measure("operations (20 mkdir)", [{"operations": operations}], ops=20, budget=2)
+
+    def test_upload_throughput(self):
+        size = 8 * 1024 * 1024
+        local_file = self._local_file("large", size)
+        single = self._measure("put 8 MB, 1 stream", [{"command": "put", "path": "/bench", "local_path": local_file}],
+                               transferred=size)
+        self.hdfs_client.delete("/bench/large")
+        parallel = self._measure("put 8 MB, 4 parts", [{"command": "put", "path": "/bench", "local_path": local_file,
+                                                        "parallel_upload": True, "parallelism": 4,
+                                                        "block_size": 1024 * 1024}],
+                                 transferred=size)
+        self.assertGreater(parallel["mb_per_second"], single["mb_per_second"] * 1.5)
+
+    def test_download_throughput(self):
+        size = 8 * 1024 * 1024
+        self.hdfs_client.write("/bench/large", data=os.urandom(size), blocksize=1024 * 1024)
+        os.makedirs(os.path.join(self.local_dir, "single"))
+        os.makedirs(os.path.join(self.local_dir, "parallel"))
+        single = self._measure("get 8 MB, 1 stream", [{"command": "get", "path": "/bench/large", "parallelism": 1,
+                                                       "local_path": os.path.join(self.local_dir, "single")}],
+                               transferred=size)
+        parallel = self._measure("get 8 MB, 4 ranges", [{"command": "get", "path": "/bench/large", "parallelism": 4,
+                                                         "local_path": os.path.join(self.local_dir, "parallel")}],
+                                 transferred=size)
+        self.assertGreater(parallel["mb_per_second"], single["mb_per_second"] * 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,21 +3,39 @@ import os
 import sys
 dirname, filename = os.path.split(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(dirname)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # --------
 
 from hdfs import InsecureClient
-# from hdfs.ext.kerberos import KerberosClient
+from hdfs import HdfsError
+import importlib.util
+import json
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
 import unittest
 import hdfs_operations
-from mock import patch
+from mock import MagicMock, patch
+from webhdfs_server import NegotiateAuth, WebHDFSServer
 
 class Singleton(object):
     _instance = None
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(Singleton, cls).__new__(cls, *args, **kwargs)
-        cls.hdfs_client = InsecureClient('http://sandbox.hortonworks.com:50070')
-        # cls.hdfs_client = KerberosClient('http://sandbox.hortonworks.com:50070')
+            # WEBHDFS_URL runs the tests against a real cluster, e.g. http://sandbox.hortonworks.com:50070
+            cls.webhdfs_url = os.environ.get('WEBHDFS_URL')
+            if cls.webhdfs_url is None:
+                cls.server = WebHDFSServer().start()
+                cls.webhdfs_url = cls.server.url
+        if os.environ.get('WEBHDFS_KERBEROS'):
+            # a kerberized cluster, after kinit
+            from hdfs.ext.kerberos import KerberosClient
+            cls.hdfs_client = KerberosClient(cls.webhdfs_url)
+        else:
+            cls.hdfs_client = InsecureClient(cls.webhdfs_url)
         cls.hdfs_path = '/tmp/ansible-test-folder/'
 
         return cls._instance
@@ -154,4 +172,767 @@ class TestHDFSAnsible(unittest.TestCase):
 
         mock_create_directory.return_value = False
         new_dir_success = hdfs_operations.create_directory(mock_module, hdfs_client=self.hdfs_client, hdfs_path=new_hdfs_dir)
-        self.assertEqual(new_dir_success, mock_create_directory.return_value)
\ No newline at end of file
+        self.assertEqual(new_dir_success, mock_create_directory.return_value)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_run_operations(self, mock_module):
+        local_file = "dummy2"
+        with open(local_file, 'w+') as file:
+            file.write("Hello World!")
+
+        new_hdfs_dir = os.path.join(self.hdfs_path, "batch-dir")
+        other_hdfs_dir = os.path.join(self.hdfs_path, "other-dir")
+        mock_module.params = dict(command=None, path=None, local_path=None, recurse=False, owner="hdfs",
+                                  group=None, permission=None, parallelism=4,
+                                  operations=[dict(command="mkdir", path=new_hdfs_dir),
+                                              dict(command="put", path=new_hdfs_dir, local_path=local_file),
+                                              dict(command="chown", path=new_hdfs_dir),
+                                              dict(command="mkdir", path=other_hdfs_dir),
+                                              dict(command="chmod", path=other_hdfs_dir, permission="0700")])
+        hdfs_operations.run_operations(mock_module, hdfs_client=self.hdfs_client)
+
+        results = mock_module.exit_json.call_args[1]['results']
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+        self.assertEqual([result['command'] for result in results], ["mkdir", "put", "chown", "mkdir", "chmod"])
+        self.assertEqual([results[i]['changed'] for i in (0, 1, 3, 4)], [True, True, True, True])
+        self.assertEqual(self.hdfs_client.status(new_hdfs_dir)['owner'], "hdfs")
+        self.assertEqual(self.hdfs_client.status(other_hdfs_dir)['permission'], "700")
+
+        # running the same operations again changes nothing
+        hdfs_operations.run_operations(mock_module, hdfs_client=self.hdfs_client)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], False)
+
+        if os.path.exists(local_file):
+            os.remove(local_file)
+
+    def test_group_operations(self):
+        operations = [dict(path="/data/*"), dict(path="/data/x"), dict(path="/other"), dict(path="/logs/dt=*/x"),
+                      dict(path="/logs"), dict(path="*.tmp")]
+        self.assertEqual(hdfs_operations._group_operations(operations[:5]), [[0, 1], [2], [3, 4]])
+        # a pattern without a literal prefix overlaps every path
+        self.assertEqual(hdfs_operations._group_operations(operations), [[0, 1, 2, 3, 4, 5]])
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_change_recursively(self, mock_module):
+        for sub_dir in ("a", "a/b", "c"):
+            self.hdfs_client.makedirs(os.path.join(self.hdfs_path, sub_dir))
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "a/b/file"), data=b"data")
+        self.hdfs_client.set_permission(os.path.join(self.hdfs_path, "c"), permission="750")
+
+        changed_permission = hdfs_operations.change_permission(mock_module, hdfs_client=self.hdfs_client,
+                                                               hdfs_path=self.hdfs_path, permission="0750",
+                                                               recurse=True, parallelism=4)
+        self.assertEqual(changed_permission['changed'], True)
+        # "c" already had the permission
+        self.assertEqual(changed_permission['updated'], 3)
+        for sub_path in ("a", "a/b", "a/b/file", "c"):
+            self.assertEqual(self.hdfs_client.status(os.path.join(self.hdfs_path, sub_path))['permission'], "750")
+
+        changed_permission = hdfs_operations.change_permission(mock_module, hdfs_client=self.hdfs_client,
+                                                               hdfs_path=self.hdfs_path, permission="0750",
+                                                               recurse=True, parallelism=4)
+        self.assertEqual(changed_permission['changed'], False)
+        self.assertEqual(changed_permission['updated'], 0)
+
+        changed_group = hdfs_operations.change_group(mock_module, hdfs_client=self.hdfs_client,
+                                                     hdfs_path=self.hdfs_path, group="hadoop",
+                                                     recurse=True, parallelism=4)
+        self.assertEqual(changed_group['updated'], 4)
+        self.assertEqual(self.hdfs_client.status(os.path.join(self.hdfs_path, "a/b/file"))['group'], "hadoop")
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_upload_localdir_in_hdfs_path(self, mock_module):
+        local_dir = "dummy-dir"
+        for sub_dir in ("conf", "lib/ext", "empty"):
+            os.makedirs(os.path.join(local_dir, sub_dir))
+        for local_file in ("conf/site.xml", "lib/a.jar", "lib/ext/b.jar"):
+            with open(os.path.join(local_dir, local_file), 'w+') as file:
+                file.write(local_file)
+
+        uploaded = hdfs_operations.upload_localdir(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                                   local_path=local_dir, parallelism=4, max_bytes_in_flight=16)
+        self.assertEqual(uploaded['changed'], True)
+        self.assertEqual(uploaded['uploaded'], 3)
+        hdfs_dir = os.path.join(self.hdfs_path, local_dir)
+        self.assertEqual(self.hdfs_client.status(os.path.join(hdfs_dir, "empty"))['type'], "DIRECTORY")
+        with self.hdfs_client.read(os.path.join(hdfs_dir, "lib/ext/b.jar")) as reader:
+            self.assertEqual(reader.read(), b"lib/ext/b.jar")
+
+        # only the changed file is uploaded again
+        with open(os.path.join(local_dir, "lib/a.jar"), 'w+') as file:
+            file.write("lib/a.jar - changed")
+        uploaded = hdfs_operations.upload_localdir(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                                   local_path=local_dir, parallelism=4)
+        self.assertEqual((uploaded['uploaded'], uploaded['unchanged']), (1, 2))
+
+        uploaded = hdfs_operations.upload_localdir(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                                   local_path=local_dir, parallelism=4)
+        self.assertEqual(uploaded['changed'], False)
+
+        shutil.rmtree(local_dir)
+
+    @patch('hdfs_operations._checksum_from_hdfs_file')
+    def test_same_content_uses_hdfs_checksum(self, mock_checksum_from_hdfs_file):
+        local_file = "dummy3"
+        with open(local_file, 'wb') as file:
+            file.write(os.urandom(4096))
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+        self.hdfs_client.upload(hdfs_file, local_file)
+
+        self.assertEqual(hdfs_operations._same_content(self.hdfs_client, hdfs_file, local_file), True)
+
+        with open(local_file, 'r+b') as file:
+            file.seek(100)
+            file.write(b"changed")
+        self.assertEqual(hdfs_operations._same_content(self.hdfs_client, hdfs_file, local_file), False)
+        # the HDFS file is never read back
+        self.assertEqual(mock_checksum_from_hdfs_file.call_count, 0)
+
+        if os.path.exists(local_file):
+            os.remove(local_file)
+
+    @patch('hdfs_operations._hdfs_style_checksum', side_effect=hdfs_operations._hdfs_style_checksum)
+    @patch('hdfs_operations.AnsibleModule')
+    def test_upload_localfile_with_checksum_manifest(self, mock_module, mock_hdfs_style_checksum):
+        local_file = "dummy4"
+        manifest_file = "dummy4.sqlite"
+        with open(local_file, 'w+') as file:
+            file.write("Hello World!")
+        manifest = hdfs_operations._ChecksumManifest(manifest_file, max_entries=10)
+
+        uploaded = hdfs_operations.upload_localfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                                    local_path=local_file, manifest=manifest)
+        self.assertEqual(uploaded, True)
+
+        # unchanged on both sides since the upload, no checksum is computed
+        hdfs_operations.upload_localfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                         local_path=local_file, manifest=manifest)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], False)
+        self.assertEqual(mock_hdfs_style_checksum.call_count, 0)
+
+        # the HDFS file was rewritten with the same content, the local checksum was computed during the upload
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+        self.hdfs_client.upload(hdfs_file, local_file, overwrite=True)
+        self.hdfs_client.set_times(hdfs_file, modification_time=self.hdfs_client.status(hdfs_file)['modificationTime'] + 1)
+        for _ in range(2):
+            hdfs_operations.upload_localfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                             local_path=local_file, manifest=manifest)
+            self.assertEqual(mock_module.exit_json.call_args[1]['changed'], False)
+        self.assertEqual(mock_hdfs_style_checksum.call_count, 0)
+
+        for path in (local_file, manifest_file, manifest_file + "-wal", manifest_file + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    @patch('hdfs_operations._write_file', side_effect=hdfs_operations._write_file)
+    @patch('hdfs_operations.AnsibleModule')
+    def test_upload_localfile_compares_before_uploading(self, mock_module, mock_write_file):
+        local_file = "dummy7"
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+        self.hdfs_client.write(hdfs_file, data=b"x" * 4096)
+        self.hdfs_client.set_times(hdfs_file, modification_time=1000)
+
+        # same length and content, older HDFS file: compared by checksum, nothing is sent
+        with open(local_file, 'wb') as file:
+            file.write(b"x" * 4096)
+        hdfs_operations.upload_localfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                         local_path=local_file)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], False)
+        self.assertEqual(self.hdfs_client.status(hdfs_file)['modificationTime'], 1000)
+        self.assertEqual(mock_write_file.call_count, 0)
+
+        # different content, the file is replaced with the content read for the comparison
+        with open(local_file, 'wb') as file:
+            file.write(b"y" * 4096)
+        with patch('hdfs_operations.open', create=True, side_effect=open) as mock_open:
+            hdfs_operations.upload_localfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                             local_path=local_file)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+        self.assertEqual(len([args for args, kwargs in mock_open.call_args_list if args[0] == local_file]), 1)
+        with self.hdfs_client.read(hdfs_file) as reader:
+            self.assertEqual(reader.read(), b"y" * 4096)
+        self.assertEqual(self.hdfs_client.list(self.hdfs_path), [local_file])
+
+        os.remove(local_file)
+
+    def test_hdfs_checksum_across_chunks(self):
+        content = os.urandom(5000)
+        checksum = hdfs_operations._HdfsChecksum("MD5-of-0MD5-of-512CRC32C", 512, 2048)
+        for offset in range(0, len(content), 700):
+            checksum.update(content[offset:offset + 700])
+        with open("dummy8", 'wb') as file:
+            file.write(content)
+        self.assertEqual(checksum.hexdigest(),
+                         hdfs_operations._hdfs_style_checksum("dummy8", "MD5-of-0MD5-of-512CRC32C", 512, 2048))
+        os.remove("dummy8")
+
+    def test_write_file_resumable(self):
+        local_file = "dummy5"
+        journal_dir = "dummy5-journal"
+        content = os.urandom(10 * 1024)
+        with open(local_file, 'wb') as file:
+            file.write(content)
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+
+        # the link fails after two chunks
+        write = self.hdfs_client.write
+        def flaky_write(hdfs_path, **kwargs):
+            if kwargs.get('append') and flaky_write.appends == 1:
+                raise IOError("connection reset")
+            flaky_write.appends += 1 if kwargs.get('append') else 0
+            return write(hdfs_path, **kwargs)
+        flaky_write.appends = 0
+        with patch.object(self.hdfs_client, 'write', side_effect=flaky_write):
+            self.assertRaises(IOError, hdfs_operations._write_file, self.hdfs_client, hdfs_file, local_file,
+                              journal_dir=journal_dir, chunk_size=4096)
+        self.assertIsNone(self.hdfs_client.status(hdfs_file, strict=False))
+
+        # the next run verifies the 8 KB already written and only appends the rest
+        with patch.object(self.hdfs_client, 'write', side_effect=write) as mock_write:
+            hdfs_operations._write_file(self.hdfs_client, hdfs_file, local_file,
+                                        journal_dir=journal_dir, chunk_size=4096)
+            self.assertEqual([call[1].get('append') for call in mock_write.call_args_list], [True])
+        with self.hdfs_client.read(hdfs_file) as reader:
+            self.assertEqual(reader.read(), content)
+        self.assertEqual(os.listdir(journal_dir), [])
+
+        os.remove(local_file)
+        shutil.rmtree(journal_dir)
+
+    def test_write_file_parallel(self):
+        local_file = "dummy6"
+        content = os.urandom(10 * 1024 + 100)
+        with open(local_file, 'wb') as file:
+            file.write(content)
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+        self.hdfs_client.write(hdfs_file, data=b"old content")
+
+        hdfs_operations._write_file(self.hdfs_client, hdfs_file, local_file, overwrite=True, parts=4, block_size=1024)
+        with self.hdfs_client.read(hdfs_file) as reader:
+            self.assertEqual(reader.read(), content)
+        self.assertEqual(self.hdfs_client.list(self.hdfs_path), [local_file])
+
+        os.remove(local_file)
+
+    def test_write_file_keeps_original_on_failure(self):
+        local_file = "dummy12"
+        with open(local_file, 'wb') as file:
+            file.write(b"new content")
+        hdfs_file = os.path.join(self.hdfs_path, local_file)
+        self.hdfs_client.write(hdfs_file, data=b"old content")
+        rename = self.hdfs_client.rename
+
+        def _rename(src, dst):
+            if ".temp-" in src:
+                raise HdfsError("rename failed")
+            return rename(src, dst)
+
+        # the new file can't be moved in: the original is back in place and the error is the one of the rename
+        with patch.object(self.hdfs_client, 'rename', side_effect=_rename), \
+                patch.object(self.hdfs_client, 'delete', side_effect=HdfsError("delete failed")):
+            with self.assertRaises(HdfsError) as context:
+                hdfs_operations._write_file(self.hdfs_client, hdfs_file, local_file, overwrite=True)
+        self.assertEqual(str(context.exception), "rename failed")
+        with self.hdfs_client.read(hdfs_file) as reader:
+            self.assertEqual(reader.read(), b"old content")
+
+        for path in self.hdfs_client.list(self.hdfs_path):
+            if path.startswith(local_file):
+                self.hdfs_client.delete(os.path.join(self.hdfs_path, path))
+        os.remove(local_file)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_sync_localdir(self, mock_module):
+        local_dir = "dummy11"
+        os.makedirs(os.path.join(local_dir, "lib"))
+        for name, content in (("a.jar", b"a"), ("b.jar", b"bb"), ("lib/c.jar", b"ccc")):
+            with open(os.path.join(local_dir, name), 'wb') as file:
+                file.write(content)
+        hdfs_root = os.path.join(self.hdfs_path, local_dir)
+        self.hdfs_client.write(os.path.join(hdfs_root, "b.jar"), data=b"xx")
+        self.hdfs_client.write(os.path.join(hdfs_root, "old/d.jar"), data=b"dddd")
+
+        result = hdfs_operations.sync_localdir(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                               local_path=local_dir, delete=True, permission="0640", parallelism=4)
+        report = result['report']
+        self.assertEqual((report['created']['count'], report['created']['bytes']), (2, 4))
+        self.assertEqual((report['updated']['count'], report['deleted']['count'], report['deleted']['bytes']),
+                         (1, 1, 4))
+        self.assertEqual(report['directories']['count'], 1)
+        self.assertEqual(sorted(self.hdfs_client.list(hdfs_root)), ["a.jar", "b.jar", "lib"])
+        self.assertEqual(self.hdfs_client.status(os.path.join(hdfs_root, "lib/c.jar"))['permission'], "640")
+        self.assertEqual(self.hdfs_client.status(os.path.join(hdfs_root, "lib"))['permission'], "750")
+
+        # same size and modification time, nothing to compare
+        with patch.object(self.hdfs_client, 'checksum') as mock_checksum:
+            result = hdfs_operations.sync_localdir(mock_module, hdfs_client=self.hdfs_client,
+                                                   hdfs_path=self.hdfs_path, local_path=local_dir, delete=True,
+                                                   permission="0640", parallelism=4)
+            self.assertEqual((result['changed'], result['report']['unchanged']['count']), (False, 3))
+            self.assertEqual(mock_checksum.call_count, 0)
+
+        shutil.rmtree(local_dir)
+
+    @patch('hdfs_operations._write_file_resumable', side_effect=hdfs_operations._write_file_resumable)
+    @patch('hdfs_operations.AnsibleModule')
+    def test_sync_resumable(self, mock_module, mock_write_file_resumable):
+        local_dir = "dummy15"
+        os.mkdir(local_dir)
+        with open(os.path.join(local_dir, "a.jar"), 'wb') as file:
+            file.write(b"a" * 100)
+        mock_module.check_mode = False
+        mock_module.params = dict(command="sync", path=self.hdfs_path, local_path=local_dir, recurse=False,
+                                  owner=None, group=None, permission=None, parallelism=1, operations=None,
+                                  resumable=True, upload_journal=local_dir + "-journal", chunk_size=32)
+
+        hdfs_operations.run(mock_module, self.hdfs_client)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+        self.assertEqual(mock_write_file_resumable.call_count, 1)
+        self.assertEqual(mock_write_file_resumable.call_args[1]['chunk_size'], 32)
+        with self.hdfs_client.read(os.path.join(self.hdfs_path, local_dir, "a.jar")) as reader:
+            self.assertEqual(reader.read(), b"a" * 100)
+
+        shutil.rmtree(local_dir)
+        shutil.rmtree(local_dir + "-journal", ignore_errors=True)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_check_mode_output_file(self, mock_module):
+        mock_module.check_mode = True
+        mock_module.plan = hdfs_operations._ChangePlan()
+        output_file = "dummy16.jsonl"
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "dummy16/part-0"), data=b"0")
+
+        found = hdfs_operations.find_paths(mock_module, hdfs_client=self.hdfs_client,
+                                           hdfs_path=os.path.join(self.hdfs_path, "dummy16"), output_file=output_file)
+        self.assertFalse(os.path.exists(output_file))
+        self.assertEqual((found['count'], 'entries' in found), (2, False))
+        self.assertEqual(mock_module.plan.entries, [dict(operation="write_output", path=output_file, entries=2)])
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_check_mode(self, mock_module):
+        mock_module.check_mode = True
+        mock_module.plan = hdfs_operations._ChangePlan()
+        local_dir = "dummy12"
+        os.mkdir(local_dir)
+        with open(os.path.join(local_dir, "a.jar"), 'wb') as file:
+            file.write(b"a")
+        self.hdfs_client.write(os.path.join(self.hdfs_path, local_dir, "b.jar"), data=b"b")
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "data/part-0"), data=b"0")
+
+        with patch.object(self.hdfs_client, 'checksum') as mock_checksum:
+            hdfs_operations.sync_localdir(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                          local_path=local_dir, delete=True)
+            hdfs_operations.change_owner(mock_module, hdfs_client=self.hdfs_client,
+                                         hdfs_path=os.path.join(self.hdfs_path, "data"), owner="solr", recurse=True)
+            hdfs_operations.create_directory(mock_module, self.hdfs_client, os.path.join(self.hdfs_path, "new"))
+            hdfs_operations.remove(mock_module, hdfs_client=self.hdfs_client,
+                                   hdfs_path=os.path.join(self.hdfs_path, "data"), recursive=True)
+            self.assertEqual(mock_checksum.call_count, 0)
+
+        self.assertEqual(sorted((entry['operation'], entry['path'][len(self.hdfs_path):])
+                                for entry in mock_module.plan.entries),
+                         [("delete", "data"), ("delete", "dummy12/b.jar"), ("mkdir", "new"), ("set_owner", "data"),
+                          ("set_owner", "data/part-0"), ("upload", "dummy12/a.jar")])
+        self.assertEqual(sorted(self.hdfs_client.list(self.hdfs_path)), ["data", local_dir])
+        self.assertEqual(self.hdfs_client.list(os.path.join(self.hdfs_path, local_dir)), ["b.jar"])
+
+        shutil.rmtree(local_dir)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_download_hdfsfile(self, mock_module):
+        local_dir = "dummy9"
+        os.mkdir(local_dir)
+        content = os.urandom(10 * 1024 + 100)
+        hdfs_file = os.path.join(self.hdfs_path, "dump.bin")
+        self.hdfs_client.write(hdfs_file, data=content, blocksize=1024)
+
+        result = hdfs_operations.download_hdfsfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=hdfs_file,
+                                                   local_path=local_dir, parallelism=4)
+        self.assertEqual((result['changed'], result['bytes']), (True, len(content)))
+        with open(os.path.join(local_dir, "dump.bin"), 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+        result = hdfs_operations.download_hdfsfile(mock_module, hdfs_client=self.hdfs_client, hdfs_path=hdfs_file,
+                                                   local_path=local_dir, parallelism=4)
+        self.assertEqual(result['changed'], False)
+        self.assertEqual(os.listdir(local_dir), ["dump.bin"])
+
+        shutil.rmtree(local_dir)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_download_hdfsdir(self, mock_module):
+        local_dir = "dummy10"
+        os.mkdir(local_dir)
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "conf/hive-site.xml"), data=b"<configuration/>")
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "conf/empty"), data=b"")
+        self.hdfs_client.makedirs(os.path.join(self.hdfs_path, "conf/a/b"))
+
+        result = hdfs_operations.download_hdfsdir(mock_module, hdfs_client=self.hdfs_client,
+                                                  hdfs_path=os.path.join(self.hdfs_path, "conf"), local_path=local_dir,
+                                                  parallelism=4)
+        self.assertEqual((result['downloaded'], result['unchanged'], result['directories']), (2, 0, 3))
+        with open(os.path.join(local_dir, "conf/hive-site.xml"), 'rb') as file:
+            self.assertEqual(file.read(), b"<configuration/>")
+        self.assertTrue(os.path.isdir(os.path.join(local_dir, "conf/a/b")))
+
+        result = hdfs_operations.download_hdfsdir(mock_module, hdfs_client=self.hdfs_client,
+                                                  hdfs_path=os.path.join(self.hdfs_path, "conf"), local_path=local_dir,
+                                                  parallelism=4)
+        self.assertEqual((result['changed'], result['unchanged']), (False, 2))
+
+        shutil.rmtree(local_dir)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_caching_client(self, mock_module):
+        caching_client = hdfs_operations._CachingClient(self.hdfs_client)
+
+        changed_owner = hdfs_operations.change_owner(mock_module, hdfs_client=caching_client, hdfs_path=self.hdfs_path,
+                                                     owner="hdfs")
+        self.assertEqual(changed_owner['new'], "hdfs")
+        # the status fetched by _path_exists is reused
+        self.assertEqual(caching_client.statistics(), {'remote_calls_saved': 1, 'remote_calls': 1})
+        self.assertEqual(caching_client.status(self.hdfs_path)['owner'], "hdfs")
+
+        new_hdfs_dir = os.path.join(self.hdfs_path, "cached-dir")
+        self.assertEqual(caching_client.status(new_hdfs_dir, strict=False), None)
+        self.assertEqual(caching_client.list(self.hdfs_path), [])
+        caching_client.makedirs(new_hdfs_dir)
+        # writes drop the cached entries of the path and its parents
+        self.assertEqual(caching_client.status(new_hdfs_dir)['type'], "DIRECTORY")
+        self.assertEqual(caching_client.list(self.hdfs_path), ["cached-dir"])
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_existence_checks_without_listing(self, mock_module):
+        caching_client = hdfs_operations._CachingClient(self.hdfs_client)
+        with patch.object(self.hdfs_client, 'list', side_effect=AssertionError("parent directory listed")):
+            created = hdfs_operations.create_directory(mock_module, hdfs_client=caching_client,
+                                                       hdfs_path=os.path.join(self.hdfs_path, "new-dir"))
+        self.assertEqual(created, True)
+
+        # after enough lookups in the same directory, names that don't exist are answered by the name index
+        for i in range(hdfs_operations.NAME_INDEX_MIN_LOOKUPS * 2):
+            created = hdfs_operations.create_directory(mock_module, hdfs_client=caching_client,
+                                                       hdfs_path=os.path.join(self.hdfs_path, "dir-{0}".format(i)))
+            self.assertEqual(created, True)
+        self.assertGreaterEqual(caching_client.statistics()['remote_calls_saved'],
+                                hdfs_operations.NAME_INDEX_MIN_LOOKUPS)
+        created = hdfs_operations.create_directory(mock_module, hdfs_client=caching_client,
+                                                   hdfs_path=os.path.join(self.hdfs_path, "dir-1"))
+        self.assertEqual(created, False)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_find_paths(self, mock_module):
+        for i in range(5):
+            self.hdfs_client.write(os.path.join(self.hdfs_path, "a/b/file-{0}.jar".format(i)), data=b"x" * i)
+        self.hdfs_client.write(os.path.join(self.hdfs_path, "a/readme.txt"), data=b"readme")
+
+        found = hdfs_operations.find_paths(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path)
+        self.assertEqual((found['files'], found['directories'], found['bytes']), (6, 3, 16))
+
+        matches = hdfs_operations._path_filter(dict(pattern=["*.jar"], larger_than="2"))
+        found = hdfs_operations.find_paths(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                           matches=matches)
+        self.assertEqual(sorted(entry['path'] for entry in found['entries']),
+                         [os.path.join(self.hdfs_path, "a/b/file-{0}.jar".format(i)) for i in (3, 4)])
+
+        found = hdfs_operations.find_paths(mock_module, hdfs_client=self.hdfs_client, hdfs_path=self.hdfs_path,
+                                           max_depth=2, include_root=False, count_only=True)
+        self.assertEqual((found['count'], 'entries' in found), (3, False))
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_remove_matching(self, mock_module):
+        for day in range(1, 5):
+            partition = os.path.join(self.hdfs_path, "events/dt=2018-01-0{0}".format(day))
+            self.hdfs_client.write(os.path.join(partition, "part-0"), data=b"x" * day)
+            if day < 3:
+                self.hdfs_client.set_times(partition, modification_time=1000)
+
+        matches = hdfs_operations._path_filter(dict(older_than="30d"))
+        result = hdfs_operations.remove_matching(mock_module, hdfs_client=self.hdfs_client,
+                                                 hdfs_path=os.path.join(self.hdfs_path, "*/dt=2018-*"),
+                                                 recursive=True, matches=matches, parallelism=4, rate_limit=100)
+        self.assertEqual((result['deleted'], result['bytes']), (2, 3))
+        self.assertEqual(sorted(self.hdfs_client.list(os.path.join(self.hdfs_path, "events"))),
+                         ["dt=2018-01-03", "dt=2018-01-04"])
+
+        partition = os.path.join(self.hdfs_path, "events/dt=2018-01-03")
+        self.assertTrue(hdfs_operations.remove(mock_module, hdfs_client=self.hdfs_client, hdfs_path=partition,
+                                               skip_trash=False))
+        self.assertIsNone(self.hdfs_client.status(partition, strict=False))
+
+    def test_move_to_trash_rate_limit(self):
+        hdfs_file = os.path.join(self.hdfs_path, "dummy14")
+        self.hdfs_client.write(hdfs_file, data=b"x")
+        hdfs_client = InsecureClient(Singleton().webhdfs_url)
+        limiter = MagicMock()
+
+        # every NameNode call of the move takes its own token
+        with patch('hdfs_operations._METRICS', hdfs_operations._Metrics()) as metrics:
+            hdfs_operations._share_session(hdfs_client, 1)
+            self.assertTrue(hdfs_operations._move_to_trash(hdfs_client, hdfs_file, limiter))
+        self.assertEqual(limiter.acquire.call_count, metrics.summary()['requests'])
+        self.assertIsNone(self.hdfs_client.status(hdfs_file, strict=False))
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_metrics(self, mock_module):
+        local_file = "dummy13"
+        content = os.urandom(64 * 1024)
+        with open(local_file, 'wb') as file:
+            file.write(content)
+        mock_module.check_mode = False
+        mock_module.params = dict(command="put", path=self.hdfs_path, local_path=local_file, recurse=False,
+                                  owner=None, group=None, permission=None, parallelism=1, operations=None)
+
+        with patch('hdfs_operations._METRICS', hdfs_operations._Metrics()):
+            hdfs_operations.run(mock_module, InsecureClient(Singleton().webhdfs_url))
+        metrics = mock_module.exit_json.call_args[1]['metrics']
+        self.assertEqual(sorted(metrics['seconds']), sorted(hdfs_operations.METRICS_PHASES + ["total"]))
+        self.assertGreater(metrics['seconds']['transfer'], 0)
+        self.assertEqual(metrics['requests'], sum(metrics['requests_by_operation'].values()))
+        # CREATE is sent to the NameNode, then to the DataNode it redirects to
+        self.assertEqual(metrics['requests_by_operation']['CREATE'], 2)
+        self.assertGreaterEqual(metrics['bytes_sent'], len(content))
+        self.assertEqual(metrics['retries'], 0)
+
+        os.remove(local_file)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_namenode_failover(self, mock_module):
+        first, second = WebHDFSServer().start(), WebHDFSServer().start()
+        second.fs = first.fs
+        first.standby = True
+        cache_file = os.path.join(tempfile.mkdtemp(), "namenodes.json")
+        mock_module.check_mode = False
+
+        def _mkdir(name):
+            mock_module.params = dict(command="mkdir", path="/" + name, local_path=None, recurse=False, owner=None,
+                                      group=None, permission=None, parallelism=1, operations=None,
+                                      namenode_cache=cache_file, namenode_cache_ttl=300)
+            with patch('hdfs_operations._METRICS', hdfs_operations._Metrics()):
+                hdfs_operations.run(mock_module, InsecureClient("{0};{1}".format(first.url, second.url)))
+            self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+            with open(cache_file) as cache:
+                return list(json.load(cache).values())[0]['order'], mock_module.exit_json.call_args[1]['metrics']
+
+        # both NameNodes are probed, the active one is tried first
+        order, metrics = _mkdir("a")
+        self.assertEqual(order, [second.url, first.url])
+        self.assertEqual((metrics['retries'], first.ops['MKDIRS'], second.ops['MKDIRS']), (0, 0, 1))
+
+        # after a failover, the request answered with StandbyException is retried once and the cache is updated
+        first.standby, second.standby = False, True
+        order, metrics = _mkdir("b")
+        self.assertEqual(order, [first.url, second.url])
+        self.assertEqual(metrics['retries'], 1)
+
+        order, metrics = _mkdir("c")
+        self.assertEqual((metrics['retries'], metrics['requests']), (0, 2))
+        self.assertEqual(sorted(first.fs.get("/").children), ["a", "b", "c"])
+
+        first.stop()
+        second.stop()
+        shutil.rmtree(os.path.dirname(cache_file))
+
+    @patch('hdfs_operations.RETRY_BACKOFF', 0.001)
+    @patch('hdfs_operations.AnsibleModule')
+    def test_throttled_requests_are_retried(self, mock_module):
+        server = WebHDFSServer().start()
+        mock_module.check_mode = False
+
+        def _mkdir(name, retries):
+            mock_module.params = dict(command="mkdir", path="/" + name, local_path=None, recurse=False, owner=None,
+                                      group=None, permission=None, parallelism=4, operations=None, retries=retries)
+            with patch('hdfs_operations._METRICS', hdfs_operations._Metrics()):
+                hdfs_operations.run(mock_module, InsecureClient(server.url))
+            return mock_module.exit_json.call_args[1]['metrics']
+
+        server.inject_fault(op="MKDIRS", count=2, status=503, exception="RetriableException")
+        server.inject_fault(op="MKDIRS", count=1, status=403, exception="RetriableException")
+        metrics = _mkdir("a", retries=5)
+        self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+        self.assertEqual((metrics['retries'], metrics['requests_by_operation']['MKDIRS'], server.ops['MKDIRS']),
+                         (3, 4, 4))
+
+        # gives up once the retries are exhausted
+        server.inject_fault(op="MKDIRS", count=3, status=503, exception="RetriableException")
+        _mkdir("b", retries=2)
+        failure = mock_module.fail_json.call_args[1]
+        self.assertEqual((failure['msg'], failure['metrics']['retries']), ("Server too busy", 2))
+        self.assertIsNone(server.fs.lookup("/b"))
+
+        server.stop()
+
+    def test_concurrency_limit(self):
+        limit = hdfs_operations._ConcurrencyLimit(8, 64)
+        for _ in range(8):
+            limit.acquire()
+            limit.release("GETFILESTATUS", 0.01)
+        # a window of fast requests raises the limit by one
+        self.assertAlmostEqual(limit.limit, 9, delta=0.1)
+
+        limit.acquire()
+        limit.release("GETFILESTATUS", 0.01, throttled=True)
+        self.assertAlmostEqual(limit.limit, 4.5, delta=0.1)
+        # requests throttled within the same round trip count once
+        limit.acquire()
+        limit.release("GETFILESTATUS", 0.01, throttled=True)
+        self.assertAlmostEqual(limit.limit, 4.5, delta=0.1)
+
+        time.sleep(0.02)
+        limit.acquire()
+        limit.release("GETFILESTATUS", 1.0)
+        self.assertAlmostEqual(limit.limit, 4.05, delta=0.1)
+
+        for _ in range(10):
+            limit.acquire()
+            limit.release("LISTSTATUS", 0.01, throttled=True)
+            time.sleep(0.02)
+        self.assertEqual(limit.limit, 1.0)
+
+    @patch('hdfs_operations.AnsibleModule')
+    def test_kerberos_delegation_token(self, mock_module):
+        server = WebHDFSServer().start()
+        server.require_auth = True
+        cache_file = os.path.join(tempfile.mkdtemp(), "tokens.json")
+        mock_module.check_mode = False
+
+        def _mkdir(name):
+            mock_module.params = dict(command="mkdir", path="/" + name, local_path=None, recurse=False, owner=None,
+                                      group=None, permission=None, parallelism=1, operations=None,
+                                      principal="hive@EXAMPLE.COM", delegation_token_cache=cache_file)
+            hdfs_client = hdfs_operations._kerberos_client(mock_module, server.url, negotiate_auth=NegotiateAuth("hive"))
+            hdfs_operations.run(mock_module, hdfs_client)
+            self.assertEqual(mock_module.exit_json.call_args[1]['changed'], True)
+            self.assertEqual(server.fs.get("/" + name).owner, "hive")
+
+        # a single negotiation fetches the token used by all the requests
+        _mkdir("a")
+        self.assertEqual((server.negotiations, len(server.tokens)), (1, 1))
+        self.assertEqual(oct(os.stat(cache_file).st_mode & 0o777), oct(0o600))
+
+        # the cached token is reused by the next task
+        _mkdir("b")
+        self.assertEqual((server.negotiations, len(server.tokens)), (1, 1))
+
+        # a cancelled token is replaced once
+        server.tokens.clear()
+        _mkdir("c")
+        self.assertEqual((server.negotiations, len(server.tokens)), (2, 1))
+
+        server.stop()
+        shutil.rmtree(os.path.dirname(cache_file))
+
+    def test_persistent_worker(self):
+        home = tempfile.mkdtemp()
+        env = dict(os.environ, HOME=home)
+
+        def _run(**args):
+            args_file = os.path.join(home, "args.json")
+            with open(args_file, "w") as output:
+                json.dump({"ANSIBLE_MODULE_ARGS": dict(args, webhdfs_url=Singleton().webhdfs_url, persistent=True,
+                                                       persistent_idle_timeout=1)}, output)
+            process = subprocess.Popen([sys.executable, hdfs_operations.__file__.replace(".pyc", ".py"), args_file],
+                                       env=env, stdout=subprocess.PIPE)
+            return json.loads(process.communicate()[0].decode("utf-8"))
+
+        hdfs_path = os.path.join(self.hdfs_path, "persistent")
+        result = _run(command="mkdir", path=hdfs_path)
+        self.assertEqual((result["changed"], result["msg"]), (True, "created directory."))
+        sockets = [name for name in os.listdir(os.path.join(home, ".ansible", "pc")) if name.endswith(".sock")]
+        self.assertEqual(len(sockets), 1)
+
+        # the worker keeps serving the next tasks, and reports their errors
+        result = _run(command="mkdir", path=hdfs_path)
+        self.assertEqual((result["changed"], result["msg"]), (False, "directory already exists."))
+        result = _run(command="chmod", path=os.path.join(hdfs_path, "not-exists"), permission="0700")
+        self.assertTrue(result["failed"])
+        self.assertEqual(result["metrics"]["requests"], 1)
+
+        # and exits once it's idle
+        time.sleep(1.5)
+        self.assertFalse([name for name in os.listdir(os.path.join(home, ".ansible", "pc")) if name.endswith(".sock")])
+        shutil.rmtree(home)
+
+    def test_persistent_worker_busy(self):
+        home = tempfile.mkdtemp()
+        socket_path = os.path.join(home, "hdfs_operations.sock")
+        # a worker that never takes the request, e.g. stuck in the request of another task
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(8)
+        module = MagicMock()
+        module.params = dict(command="mkdir", path="/data", persistent=True, persistent_idle_timeout=1)
+        module.check_mode = False
+
+        with patch('hdfs_operations.WORKER_READY_TIMEOUT', 0.2):
+            with self.assertRaises(socket.timeout):
+                hdfs_operations._call_worker(socket_path, module.params)
+            # the module runs the request itself
+            with patch('hdfs_operations._worker_socket', return_value=socket_path):
+                self.assertIsNone(hdfs_operations._forward_to_worker(module))
+        self.assertEqual(module.warn.call_count, 1)
+
+        server.close()
+        shutil.rmtree(home)
+
+    def test_action_plugin_needs_host(self):
+        plugin_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                   "action_plugins", "hdfs_operations.py")
+        spec = importlib.util.spec_from_file_location("hdfs_operations_action", plugin_path)
+        plugin = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(plugin)
+        needs_host = plugin.ActionModule._needs_host
+
+        self.assertFalse(needs_host(None, dict(command="put", path="/data", local_path="file", resumable="no")))
+        # the journal of a resumable upload identifies the file of the host, not a copy fetched to the controller
+        self.assertTrue(needs_host(None, dict(command="put", path="/data", local_path="file", resumable="yes")))
+        self.assertTrue(needs_host(None, dict(operations=[dict(command="mkdir", path="/data"),
+                                                          dict(command="chmod", path="/data", upload_journal="j")])))
+
+    @unittest.skipIf(shutil.which("ansible-playbook") is None, "ansible-playbook isn't installed")
+    def test_action_plugin_runs_once_per_task(self):
+        server = WebHDFSServer().start()
+        work_dir = tempfile.mkdtemp()
+        local_file = os.path.join(work_dir, "file")
+        with open(local_file, "wb") as file:
+            file.write(os.urandom(4096))
+        with open(os.path.join(work_dir, "inventory"), "w") as inventory:
+            inventory.write("\n".join("host-{0} ansible_connection=local ansible_python_interpreter={1}".format(
+                index, sys.executable) for index in range(3)))
+        with open(os.path.join(work_dir, "play.yml"), "w") as play:
+            play.write(json.dumps([{"hosts": "all", "gather_facts": False, "tasks": [
+                {"hdfs_operations": {"webhdfs_url": server.url, "command": "mkdir", "path": "/data",
+                                     "run_on": "controller"}},
+                {"hdfs_operations": {"webhdfs_url": server.url, "command": "put", "path": "/data",
+                                     "local_path": local_file, "run_on": "controller"}, "register": "put"},
+                {"copy": {"content": "{{ put | to_json }}", "dest": os.path.join(work_dir, "{{ inventory_hostname }}")},
+                 "delegate_to": "localhost"}]}]))
+        src_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, HOME=work_dir, ANSIBLE_FORKS="3", ANSIBLE_LOCALHOST_WARNING="False",
+                   ANSIBLE_LIBRARY=os.path.join(src_dir, "library"),
+                   ANSIBLE_ACTION_PLUGINS=os.path.join(src_dir, "action_plugins"))
+
+        def _play():
+            server.reset_counters()
+            subprocess.check_call(["ansible-playbook", "-i", os.path.join(work_dir, "inventory"),
+                                   os.path.join(work_dir, "play.yml")], env=env, stdout=subprocess.DEVNULL)
+            results = []
+            for index in range(3):
+                with open(os.path.join(work_dir, "host-{0}".format(index))) as result:
+                    results.append(json.load(result))
+            return results
+
+        # the directory is created and the file uploaded once for the three hosts
+        results = _play()
+        self.assertEqual((server.ops["MKDIRS"], server.ops["CREATE"]), (1, 1))
+        self.assertEqual(sorted(result.get("deduplicated", False) for result in results), [False, True, True])
+        self.assertTrue(all(result["changed"] for result in results))
+        self.assertEqual(bytes(server.fs.get("/data/file").data), open(local_file, "rb").read())
+
+        # an unchanged file is neither fetched from the host nor compared by checksum
+        results = _play()
+        self.assertEqual(dict(server.ops), {"GETFILESTATUS": 2})
+        self.assertFalse(any(result["changed"] for result in results))
+
+        server.stop()
+        shutil.rmtree(work_dir)
@@ -0,0 +1,628 @@
+"""
+In-process stand-in for a WebHDFS NameNode and DataNode.
+
+The server keeps an in-memory file system tree and speaks the subset of the
+WebHDFS REST API that `hdfs_operations` uses, including the two-step
+CREATE/APPEND/OPEN redirects to a separate DataNode endpoint. Latency and
+bandwidth can be configured to approximate a remote cluster, and every request
+is counted so tests and benchmarks can assert on round trips.
+
+Usage:
+    server = WebHDFSServer(latency=0.001)
+    server.start()
+    client = InsecureClient(server.url)
+    ...
+    server.stop()
+"""
+
+import hashlib
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+import requests
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, quote, unquote, urlparse
+
+WEBHDFS_PREFIX = '/webhdfs/v1'
+
+try:
+    from crc32c import crc32c as _crc32c_fast
+except ImportError:
+    _crc32c_fast = None
+
+_CRC32C_TABLE = []
+for _i in range(256):
+    _crc = _i
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0x82F63B78 if _crc & 1 else _crc >> 1
+    _CRC32C_TABLE.append(_crc)
+
+def crc32c(data, crc=0):
+    """
+    CRC32C (Castagnoli), from the crc32c package if installed. The pure python
+    fallback is good enough for the small files used in tests.
+    :param data: bytes
+    :param crc: running crc
+    :return: crc32c of the data
+    """
+    if _crc32c_fast is not None:
+        return _crc32c_fast(data, crc)
+    crc ^= 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for byte in bytearray(data):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+class NegotiateAuth(requests.auth.AuthBase):
+    """
+    Client side of the stand-in SPNEGO negotiation, in place of requests_kerberos.HTTPKerberosAuth: answers a
+    401 challenge by sending the request again with "Authorization: Negotiate <user>:<ticket>".
+    """
+    def __init__(self, user):
+        self.user = user
+
+    def __call__(self, request):
+        request.register_hook('response', self._negotiate)
+        return request
+
+    def _negotiate(self, response, **kwargs):
+        if response.status_code != 401 or 'Authorization' in response.request.headers or \
+                'Negotiate' not in response.headers.get('WWW-Authenticate', ''):
+            return response
+        request = response.request.copy()
+        request.headers['Authorization'] = 'Negotiate {0}:ticket'.format(self.user)
+        response.close()
+        negotiated = response.connection.send(request, **kwargs)
+        negotiated.history.append(response)
+        negotiated.request = request
+        return negotiated
+
+class RemoteException(Exception):
+    """
+    Error that is returned to the client as a WebHDFS RemoteException.
+    """
+    def __init__(self, status, exception, message):
+        super(RemoteException, self).__init__(message)
+        self.status = status
+        self.exception = exception
+        self.message = message
+
+def _not_found(path):
+    return RemoteException(404, 'FileNotFoundException', 'File does not exist: {0}'.format(path))
+
+class _Node(object):
+    """
+    File or directory in the fake namespace.
+    """
+    def __init__(self, node_type, owner, group, permission, block_size=134217728, replication=3):
+        self.type = node_type
+        self.owner = owner
+        self.group = group
+        self.permission = permission
+        self.block_size = block_size if node_type == 'FILE' else 0
+        self.replication = replication if node_type == 'FILE' else 0
+        self.modification_time = int(time.time() * 1000)
+        self.access_time = self.modification_time if node_type == 'FILE' else 0
+        self.data = bytearray()
+        self.children = {}
+        self.file_id = 0
+
+    def status(self, name=''):
+        return {
+            'accessTime': self.access_time,
+            'blockSize': self.block_size,
+            'childrenNum': len(self.children),
+            'fileId': self.file_id,
+            'group': self.group,
+            'length': len(self.data) if self.type == 'FILE' else 0,
+            'modificationTime': self.modification_time,
+            'owner': self.owner,
+            'pathSuffix': name,
+            'permission': self.permission,
+            'replication': self.replication,
+            'storagePolicy': 0,
+            'type': self.type,
+        }
+
+class FakeHDFS(object):
+    """
+    Thread safe in-memory namespace shared by the NameNode and DataNode endpoints.
+    """
+    def __init__(self, user='hdfs', group='supergroup', block_size=134217728, bytes_per_checksum=512,
+                 checksum_type='CRC32C', list_limit=1000):
+        self.user = user
+        self.group = group
+        self.block_size = block_size
+        self.bytes_per_checksum = bytes_per_checksum
+        self.checksum_type = checksum_type
+        self.list_limit = list_limit
+        self.lock = threading.RLock()
+        self._next_id = 16385
+        self.root = self._new_node('DIRECTORY', '755')
+
+    def _new_node(self, node_type, permission, owner=None, block_size=None, replication=3):
+        node = _Node(node_type, owner or self.user, self.group, permission,
+                     block_size=block_size or self.block_size, replication=replication)
+        node.file_id = self._next_id
+        self._next_id += 1
+        return node
+
+    @staticmethod
+    def split(path):
+        return [part for part in path.split('/') if part]
+
+    def lookup(self, path):
+        node = self.root
+        for part in self.split(path):
+            if node.type != 'DIRECTORY' or part not in node.children:
+                return None
+            node = node.children[part]
+        return node
+
+    def get(self, path):
+        node = self.lookup(path)
+        if node is None:
+            raise _not_found(path)
+        return node
+
+    def parent(self, path, create=False, owner=None):
+        parts = self.split(path)
+        if not parts:
+            raise RemoteException(400, 'IllegalArgumentException', 'Invalid path: {0}'.format(path))
+        node = self.root
+        for part in parts[:-1]:
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    raise _not_found('/' + '/'.join(parts[:-1]))
+                child = self._new_node('DIRECTORY', '755', owner=owner)
+                node.children[part] = child
+            elif child.type != 'DIRECTORY':
+                raise RemoteException(403, 'ParentNotDirectoryException',
+                                      'Parent path is not a directory: {0}'.format(part))
+            node = child
+        return node, parts[-1]
+
+    def mkdirs(self, path, permission='755', owner=None):
+        node = self.root
+        for part in self.split(path):
+            child = node.children.get(part)
+            if child is None:
+                child = self._new_node('DIRECTORY', permission, owner=owner)
+                node.children[part] = child
+                node.modification_time = int(time.time() * 1000)
+            elif child.type != 'DIRECTORY':
+                raise RemoteException(403, 'FileAlreadyExistsException',
+                                      'Path is not a directory: {0}'.format(path))
+            node = child
+        return node
+
+    def create(self, path, data, overwrite=False, permission='644', owner=None, block_size=None,
+               replication=3):
+        parent, name = self.parent(path, create=True, owner=owner)
+        existing = parent.children.get(name)
+        if existing is not None:
+            if existing.type == 'DIRECTORY':
+                raise RemoteException(403, 'FileAlreadyExistsException',
+                                      '{0} already exists as a directory'.format(path))
+            if not overwrite:
+                raise RemoteException(403, 'FileAlreadyExistsException',
+                                      '{0} for client already exists'.format(path))
+        node = self._new_node('FILE', permission, owner=owner, block_size=block_size,
+                              replication=replication)
+        node.data = bytearray(data)
+        parent.children[name] = node
+        parent.modification_time = node.modification_time
+        return node
+
+    def checksum(self, node):
+        """
+        Mirrors DFSClient#getFileChecksum for MD5MD5CRC32 and COMPOSITE_CRC modes.
+        """
+        data = bytes(node.data)
+        bpc = self.bytes_per_checksum
+        crc_func = crc32c if self.checksum_type.endswith('CRC32C') else (lambda d: zlib.crc32(d) & 0xFFFFFFFF)
+        if self.checksum_type.startswith('COMPOSITE-'):
+            return {'algorithm': self.checksum_type,
+                    'bytes': '{0:08x}'.format(crc_func(data)),
+                    'length': 4}
+        block_md5s = b''
+        blocks = [data[i:i + node.block_size] for i in range(0, len(data), node.block_size)] or [b'']
+        for block in blocks:
+            crcs = b''.join(struct.pack('>I', crc_func(block[i:i + bpc])) for i in range(0, len(block), bpc))
+            block_md5s += hashlib.md5(crcs).digest()
+        crc_per_block = node.block_size // bpc if len(blocks) > 1 else 0
+        algorithm = 'MD5-of-{0}MD5-of-{1}{2}'.format(crc_per_block, bpc, self.checksum_type)
+        raw = struct.pack('>iq', bpc, crc_per_block) + hashlib.md5(block_md5s).digest()
+        return {'algorithm': algorithm, 'bytes': raw.hex() if hasattr(raw, 'hex') else raw.encode('hex'),
+                'length': 28}
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Dispatches WebHDFS requests to the NameNode or DataNode role of its server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().strip().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body.extend(self.rfile.read(size))
+                self.rfile.readline()
+            return bytes(body)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, payload=None, headers=None, raw=None):
+        body = raw if raw is not None else (json.dumps(payload).encode('utf-8') if payload is not None else b'')
+        self.server.owner.throttle(len(body))
+        self.server.owner.record(bytes_out=len(body))
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if raw is not None:
+            self.send_header('Content-Type', 'application/octet-stream')
+        else:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        owner = self.server.owner
+        parsed = urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in parse_qs(parsed.query, keep_blank_values=True).items())
+        body = self._read_body()
+        op = params.get('op', '').upper()
+        owner.record(op=op, role=self.server.role, bytes_in=len(body))
+        owner.throttle(len(body))
+        if owner.latency:
+            time.sleep(owner.latency)
+        if not parsed.path.startswith(WEBHDFS_PREFIX):
+            return self._send(404, {'RemoteException': {'exception': 'IllegalArgumentException',
+                                                         'message': 'Invalid path'}})
+        path = unquote(parsed.path[len(WEBHDFS_PREFIX):]) or '/'
+        try:
+            injected = owner.next_fault(op)
+            if injected is not None:
+                raise injected
+            if self.server.role == 'namenode':
+                result = owner.namenode(method, op, path, params, body, self.headers)
+            else:
+                result = owner.datanode(method, op, path, params, body)
+        except RemoteException as e:
+            return self._send(e.status, {'RemoteException': {
+                'exception': e.exception,
+                'javaClassName': 'org.apache.hadoop.' + e.exception,
+                'message': e.message}}, headers={'WWW-Authenticate': 'Negotiate'} if e.status == 401 else None)
+        status, payload, headers, raw = result
+        self._send(status, payload, headers, raw)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+class _ThreadedServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class WebHDFSServer(object):
+    """
+    NameNode and DataNode pair serving a shared `FakeHDFS`.
+    :param latency: seconds added to every request (NameNode RPC or DataNode op).
+    :param bandwidth: bytes per second for request and response bodies, None for unlimited.
+    :param kwargs: forwarded to `FakeHDFS`.
+    """
+    def __init__(self, latency=0.0, bandwidth=None, host='127.0.0.1', **kwargs):
+        self.fs = FakeHDFS(**kwargs)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host = host
+        self.standby = False
+        self.tokens = {}
+        self.require_auth = False
+        self.negotiations = 0
+        self._faults = []
+        self._stats_lock = threading.Lock()
+        self.reset_counters()
+        self._servers = []
+        self._threads = []
+
+    # bookkeeping
+
+    def reset_counters(self):
+        with self._stats_lock:
+            self.ops = Counter()
+            self.requests = 0
+            self.namenode_requests = 0
+            self.datanode_requests = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def record(self, op=None, role=None, bytes_in=0, bytes_out=0):
+        with self._stats_lock:
+            if op is not None:
+                self.requests += 1
+                if role == 'namenode':
+                    self.namenode_requests += 1
+                    self.ops[op] += 1
+                else:
+                    self.datanode_requests += 1
+                    self.ops['DN_' + op] += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def throttle(self, nbytes):
+        if self.bandwidth and nbytes:
+            time.sleep(float(nbytes) / self.bandwidth)
+
+    def inject_fault(self, op=None, count=1, status=503, exception='RetriableException',
+                     message='Server too busy', every=1):
+        """
+        Makes the next `count` requests (optionally only for `op`) fail with a RemoteException.
+        With `every`, only one request in `every` fails until `count` requests failed.
+        """
+        with self._stats_lock:
+            self._faults.append([op, count, RemoteException(status, exception, message), every, 0])
+
+    def next_fault(self, op):
+        if self.standby:
+            return RemoteException(403, 'StandbyException',
+                                   'Operation category READ is not supported in state standby')
+        with self._stats_lock:
+            for fault in self._faults:
+                if fault[0] in (None, op) and fault[1] > 0:
+                    fault[4] += 1
+                    if fault[4] % fault[3]:
+                        continue
+                    fault[1] -= 1
+                    if fault[1] == 0:
+                        self._faults.remove(fault)
+                    return fault[2]
+        return None
+
+    # lifecycle
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(self.host, self._servers[0].server_address[1])
+
+    @property
+    def datanode_url(self):
+        return 'http://{0}:{1}'.format(self.host, self._servers[1].server_address[1])
+
+    def start(self):
+        for role in ('namenode', 'datanode'):
+            server = _ThreadedServer((self.host, 0), _Handler)
+            server.owner = self
+            server.role = role
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            self._servers.append(server)
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # authentication
+
+    def _authenticate(self, params, headers):
+        if not self.require_auth:
+            return params.get('user.name') or self.fs.user
+        token = params.get('delegation')
+        if token:
+            if token not in self.tokens or self.tokens[token]['expires'] < time.time() * 1000:
+                raise RemoteException(403, 'InvalidToken', 'token ({0}) is expired or invalid'.format(token))
+            return self.tokens[token]['owner']
+        authorization = headers.get('Authorization', '')
+        if authorization.startswith('Negotiate '):
+            with self._stats_lock:
+                self.negotiations += 1
+            return authorization[len('Negotiate '):].split(':')[0] or self.fs.user
+        raise RemoteException(401, 'AuthenticationException', 'Authentication required')
+
+    # roles
+
+    def _redirect(self, path, params):
+        query = '&'.join('{0}={1}'.format(k, quote(str(v), safe='')) for k, v in sorted(params.items()))
+        location = '{0}{1}{2}?{3}'.format(self.datanode_url, WEBHDFS_PREFIX, quote(path), query)
+        return 307, None, {'Location': location}, None
+
+    def namenode(self, method, op, path, params, body, headers):
+        user = self._authenticate(params, headers)
+        fs = self.fs
+        with fs.lock:
+            if op == 'GETFILESTATUS':
+                return 200, {'FileStatus': fs.get(path).status()}, None, None
+            if op in ('LISTSTATUS', 'LISTSTATUS_BATCH'):
+                node = fs.get(path)
+                if node.type == 'FILE':
+                    statuses = [node.status()]
+                    names = ['']
+                else:
+                    names = sorted(node.children)
+                    statuses = None
+                if op == 'LISTSTATUS':
+                    if statuses is None:
+                        statuses = [node.children[n].status(n) for n in names]
+                    return 200, {'FileStatuses': {'FileStatus': statuses}}, None, None
+                if statuses is None:
+                    start_after = params.get('startAfter', '')
+                    if start_after:
+                        import bisect
+                        names = names[bisect.bisect_right(names, start_after):]
+                    page = names[:fs.list_limit]
+                    statuses = [node.children[n].status(n) for n in page]
+                    remaining = len(names) - len(page)
+                else:
+                    remaining = 0
+                return 200, {'DirectoryListing': {'partialListing': {'FileStatuses': {'FileStatus': statuses}},
+                                                  'remainingEntries': remaining}}, None, None
+            if op == 'GETCONTENTSUMMARY':
+                node = fs.get(path)
+                summary = {'directoryCount': 0, 'fileCount': 0, 'length': 0}
+                stack = [node]
+                while stack:
+                    current = stack.pop()
+                    if current.type == 'DIRECTORY':
+                        summary['directoryCount'] += 1
+                        stack.extend(current.children.values())
+                    else:
+                        summary['fileCount'] += 1
+                        summary['length'] += len(current.data)
+                return 200, {'ContentSummary': summary}, None, None
+            if op == 'GETFILECHECKSUM':
+                node = fs.get(path)
+                if node.type != 'FILE':
+                    raise RemoteException(404, 'FileNotFoundException', 'Path is not a file: {0}'.format(path))
+                return 200, {'FileChecksum': fs.checksum(node)}, None, None
+            if op == 'GETHOMEDIRECTORY':
+                return 200, {'Path': '/user/{0}'.format(user)}, None, None
+            if op == 'GETTRASHROOT':
+                return 200, {'Path': '/user/{0}/.Trash'.format(user)}, None, None
+            if op == 'MKDIRS':
+                fs.mkdirs(path, permission=params.get('permission') or '755', owner=user)
+                return 200, {'boolean': True}, None, None
+            if op == 'SETOWNER':
+                node = fs.get(path)
+                if params.get('owner'):
+                    node.owner = params['owner']
+                if params.get('group'):
+                    node.group = params['group']
+                return 200, None, None, None
+            if op == 'SETPERMISSION':
+                node = fs.get(path)
+                node.permission = (params.get('permission') or '755').lstrip('0').rjust(3, '0')
+                return 200, None, None, None
+            if op == 'SETTIMES':
+                node = fs.get(path)
+                if params.get('modificationtime') not in (None, '', '-1'):
+                    node.modification_time = int(params['modificationtime'])
+                if params.get('accesstime') not in (None, '', '-1'):
+                    node.access_time = int(params['accesstime'])
+                return 200, None, None, None
+            if op == 'DELETE':
+                node = fs.lookup(path)
+                if node is None:
+                    return 200, {'boolean': False}, None, None
+                if node is fs.root:
+                    return 200, {'boolean': False}, None, None
+                if node.type == 'DIRECTORY' and node.children and str(params.get('recursive')).lower() != 'true':
+                    raise RemoteException(403, 'PathIsNotEmptyDirectoryException',
+                                          '`{0} is non empty\': Directory is not empty'.format(path))
+                parent, name = fs.parent(path)
+                del parent.children[name]
+                return 200, {'boolean': True}, None, None
+            if op == 'RENAME':
+                destination = params.get('destination')
+                node = fs.lookup(path)
+                if node is None or not destination:
+                    return 200, {'boolean': False}, None, None
+                target = fs.lookup(destination)
+                if target is not None and target.type == 'DIRECTORY':
+                    destination = destination.rstrip('/') + '/' + fs.split(path)[-1]
+                    target = fs.lookup(destination)
+                if target is not None:
+                    return 200, {'boolean': False}, None, None
+                try:
+                    dst_parent, dst_name = fs.parent(destination)
+                except RemoteException:
+                    return 200, {'boolean': False}, None, None
+                src_parent, src_name = fs.parent(path)
+                del src_parent.children[src_name]
+                dst_parent.children[dst_name] = node
+                return 200, {'boolean': True}, None, None
+            if op == 'CONCAT':
+                target = fs.get(path)
+                sources = [s for s in params.get('sources', '').split(',') if s]
+                for source in sources:
+                    node = fs.get(source)
+                    target.data.extend(node.data)
+                    parent, name = fs.parent(source)
+                    del parent.children[name]
+                target.modification_time = int(time.time() * 1000)
+                return 200, None, None, None
+            if op == 'TRUNCATE':
+                node = fs.get(path)
+                del node.data[int(params.get('newlength', 0)):]
+                return 200, {'boolean': True}, None, None
+            if op == 'GETDELEGATIONTOKEN':
+                token = 'token-{0}-{1}'.format(user, len(self.tokens) + 1)
+                self.tokens[token] = {'owner': user, 'renewer': params.get('renewer'),
+                                      'expires': int(time.time() * 1000) + 24 * 3600 * 1000}
+                return 200, {'Token': {'urlString': token}}, None, None
+            if op == 'RENEWDELEGATIONTOKEN':
+                token = params.get('token')
+                if token not in self.tokens:
+                    raise RemoteException(403, 'InvalidToken', 'token is invalid')
+                self.tokens[token]['expires'] = int(time.time() * 1000) + 24 * 3600 * 1000
+                return 200, {'long': self.tokens[token]['expires']}, None, None
+            if op == 'CANCELDELEGATIONTOKEN':
+                self.tokens.pop(params.get('token'), None)
+                return 200, None, None, None
+            if op == 'CREATE':
+                if fs.lookup(path) is not None and str(params.get('overwrite')).lower() != 'true':
+                    raise RemoteException(403, 'FileAlreadyExistsException',
+                                          '{0} for client already exists'.format(path))
+                params = dict(params, **{'user.name': user})
+                return self._redirect(path, params)
+            if op in ('APPEND', 'OPEN'):
+                node = fs.get(path)
+                if node.type != 'FILE':
+                    raise RemoteException(404, 'FileNotFoundException', 'Path is not a file: {0}'.format(path))
+                params = dict(params, **{'user.name': user})
+                return self._redirect(path, params)
+        raise RemoteException(400, 'IllegalArgumentException', 'Invalid value for webhdfs parameter "op"')
+
+    def datanode(self, method, op, path, params, body):
+        fs = self.fs
+        with fs.lock:
+            if op == 'CREATE':
+                block_size = int(params['blocksize']) if params.get('blocksize') not in (None, '', 'None') else None
+                permission = params.get('permission') if params.get('permission') not in (None, '', 'None') else '644'
+                fs.create(path, body, overwrite=str(params.get('overwrite')).lower() == 'true', permission=permission,
+                          owner=params.get('user.name'), block_size=block_size)
+                return 201, None, {'Location': 'hdfs://{0}'.format(path)}, None
+            if op == 'APPEND':
+                node = fs.get(path)
+                node.data.extend(body)
+                node.modification_time = int(time.time() * 1000)
+                return 200, None, None, None
+            if op == 'OPEN':
+                node = fs.get(path)
+                offset = int(params.get('offset') or 0)
+                length = params.get('length')
+                end = len(node.data) if length in (None, '', 'None') else offset + int(length)
+                return 200, None, None, bytes(node.data[offset:end])
+        raise RemoteException(400, 'IllegalArgumentException', 'Invalid value for webhdfs parameter "op"')